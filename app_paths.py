@@ -0,0 +1,13 @@
+import os
+
+
+def get_data_dir() -> str:
+    """获取本地数据目录（缓存、统计、数据库等），可通过 INSTALLER_DATA_DIR 覆盖"""
+    data_dir = os.getenv("INSTALLER_DATA_DIR") or os.path.join(os.path.expanduser("~"), ".llm_github_installer")
+    os.makedirs(data_dir, exist_ok=True)
+    return data_dir
+
+
+def get_data_path(filename: str) -> str:
+    """获取数据目录下某个文件的完整路径"""
+    return os.path.join(get_data_dir(), filename)
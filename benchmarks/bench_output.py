@@ -0,0 +1,73 @@
+"""
+命令输出渲染吞吐量基准：对比逐行 console.print 与限速批量刷新的 LiveOutputView。
+
+用法: python benchmarks/bench_output.py [行数，默认 1000000]
+逐行 print 太慢，只用前 100000 行测量其吞吐量。
+"""
+import io
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from rich.console import Console
+
+from command_executor import run_command
+from output_view import LiveOutputView
+
+
+LEGACY_SAMPLE_LINES = 100_000
+
+
+def generator_command(line_count):
+    # 输出中带有 rich 标记样式的文本，逐行 print 时会触发标记解析
+    script = f"import sys\nw = sys.stdout.write\nfor i in range({line_count}): w(f'[bold]line[/bold] {{i}} building target lib_{{i % 97}}.o\\n')"
+    return f'"{sys.executable}" -c "{script}"'
+
+
+def bench_per_line_print(command, target_console):
+    """旧实现：每行调用一次 console.print"""
+    start = time.monotonic()
+    process = subprocess.Popen(command, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, bufsize=1)
+    count = 0
+    for line in iter(process.stdout.readline, ''):
+        target_console.print(line, end='')
+        count += 1
+    process.wait()
+    return count, time.monotonic() - start
+
+
+def bench_live_view(command, target_console, log_path):
+    """新实现：缓冲 + 固定帧率刷新"""
+    start = time.monotonic()
+    view = LiveOutputView(command, log_path=log_path, target_console=target_console)
+    stdout, _, _, _ = run_command(command, view=view)
+    return view.line_count, time.monotonic() - start
+
+
+def main():
+    line_count = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    command = generator_command(line_count)
+    legacy_command = generator_command(min(line_count, LEGACY_SAMPLE_LINES))
+    # 渲染到内存中的"终端"，排除真实终端速度的影响，只比较渲染侧的 CPU 开销
+    terminal = lambda: Console(file=io.StringIO(), force_terminal=True, width=120)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        results = [
+            ("逐行 console.print", *bench_per_line_print(legacy_command, terminal())),
+            ("LiveOutputView", *bench_live_view(command, terminal(), os.path.join(tmp, "bench.log"))),
+        ]
+
+    print(f"输出行数: {line_count}")
+    for name, count, elapsed in results:
+        print(f"{name:<22} 行数 {count:>9}  用时 {elapsed:7.2f}s  吞吐 {count / elapsed:12,.0f} 行/秒")
+    legacy_rate = results[0][1] / results[0][2]
+    live_rate = results[1][1] / results[1][2]
+    print(f"吞吐量提升: {live_rate / legacy_rate:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,415 @@
+"""
+并发安装会话压测：在本地启动模拟的大模型服务（OpenAI 兼容接口，延迟分布和错误率可配置）和模拟的 GitHub 服务，
+按不同的并发数通过安装服务（install_daemon.InstallDaemon，工作线程数 = 并发数）同时执行多个安装会话，
+命令由模拟的大模型按脚本给出（克隆、构建，部分会话中途失败一次再修复），
+报告吞吐量、会话耗时 p50/p95/p99、大模型请求的排队时间、文件描述符和内存占用随并发数的变化。
+
+用法: python benchmarks/load_test.py [--concurrency 1,10,25,50] [--sessions-per-worker 2]
+      [--llm-latency lognormal:1.0,0.5] [--llm-error-rate 0.02] [--fail-rate 0.3] [--command-seconds 0.2] [--json 结果.json]
+延迟分布: fixed:秒、uniform:最小,最大、lognormal:中位数,sigma。
+每个并发级别在单独的子进程中执行，文件描述符、内存和线程数只统计该进程；模拟服务运行在主进程中。
+"""
+import argparse
+import hashlib
+import json
+import math
+import os
+import random
+import re
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Optional
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from rich.console import Console
+from rich.table import Table
+
+console = Console()
+
+MOCK_MODEL = "mock-model"
+RESULT_PREFIX = "LOAD_RESULT "
+SAMPLE_INTERVAL = 0.1
+
+
+def parse_latency(spec: str) -> Callable[[random.Random], float]:
+    """解析延迟分布，返回按随机数生成器取样的函数（秒）"""
+    kind, _, params = spec.partition(":")
+    values = [float(v) for v in params.split(",") if v]
+    if kind == "fixed" and len(values) == 1:
+        return lambda rng: values[0]
+    if kind == "uniform" and len(values) == 2:
+        return lambda rng: rng.uniform(values[0], values[1])
+    if kind == "lognormal" and len(values) == 2:
+        return lambda rng: rng.lognormvariate(math.log(values[0]), values[1])
+    raise ValueError(f"无法解析延迟分布: {spec}（fixed:秒、uniform:最小,最大、lognormal:中位数,sigma）")
+
+
+def percentile(values: List[float], p: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, math.ceil(p / 100 * len(ordered)) - 1))]
+
+
+class MockStats:
+    """模拟服务端的请求统计（线程安全），每个并发级别结束后读取并清零"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.data = self._empty()
+
+    @staticmethod
+    def _empty() -> Dict:
+        return {"requests": 0, "errors": 0, "latencies": [], "in_flight": 0, "max_in_flight": 0}
+
+    def reset(self) -> Dict:
+        """返回到目前为止的统计并清零"""
+        with self.lock:
+            snapshot, self.data = self.data, self._empty()
+        return snapshot
+
+    def begin(self):
+        with self.lock:
+            self.data["requests"] += 1
+            self.data["in_flight"] += 1
+            self.data["max_in_flight"] = max(self.data["max_in_flight"], self.data["in_flight"])
+
+    def end(self, latency: float, error: bool):
+        with self.lock:
+            self.data["in_flight"] -= 1
+            self.data["latencies"].append(latency)
+            self.data["errors"] += error
+
+
+def script_response(messages: List[Dict], fail_rate: float, command_seconds: float) -> Dict:
+    """
+    按脚本生成结构化响应：首轮给出克隆和构建命令（按 fail_rate 决定的会话多一条会失败的命令），
+    命令失败后给出修复命令，命令成功后结束。
+    """
+    text = "\n".join(message.get("content", "") for message in messages)
+    install_directory = (re.search(r"安装目录 (\S+)", text) or [None, "."])[1]
+    project = (re.search(r"项目: (\S+)/(\S+)", text) or [None, "load", "repo"])
+    repo = project[2]
+    project_directory = os.path.join(install_directory, repo)
+    last = messages[-1].get("content", "") if messages else ""
+    if "第一步请克隆项目" in last:
+        steps = [
+            f"cd {install_directory} && mkdir -p {repo} && echo cloned {repo}",
+            f"cd {project_directory} && sleep {command_seconds} && echo built",
+        ]
+        if random.Random(repo).random() < fail_rate:
+            steps.append(f"cd {project_directory} && echo 'error: simulated build failure' >&2 && exit 1")
+        return {"steps": [{"command": step} for step in steps], "done": False}
+    match = re.search(r"返回码: (\S+)", last)
+    if match and match.group(1) != "0":
+        return {"steps": [{"command": f"cd {project_directory} && sleep {command_seconds} && echo fixed"}], "done": False}
+    return {"steps": [], "done": True}
+
+
+class MockLLMHandler(BaseHTTPRequestHandler):
+    """OpenAI 兼容的 /chat/completions（支持流式和非流式），按延迟分布等待后返回脚本生成的响应"""
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status: int, body: bytes, content_type: str):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path.rstrip("/").endswith("/models"):
+            return self._send(200, json.dumps({"data": [{"id": MOCK_MODEL}]}).encode(), "application/json")
+        self._send(404, b"{}", "application/json")
+
+    def do_POST(self):
+        server = self.server
+        length = int(self.headers.get("Content-Length", "0"))
+        request = json.loads(self.rfile.read(length) or b"{}")
+        with server.rng_lock:
+            latency = server.latency(server.rng)
+            error = server.rng.random() < server.error_rate
+        server.stats.begin()
+        start = time.monotonic()
+        try:
+            time.sleep(latency)
+            if error:
+                return self._send(500, json.dumps({"error": {"message": "simulated error"}}).encode(), "application/json")
+            content = json.dumps(script_response(request.get("messages", []), server.fail_rate, server.command_seconds), ensure_ascii=False)
+            if not request.get("stream"):
+                body = {"choices": [{"message": {"role": "assistant", "content": content}}]}
+                return self._send(200, json.dumps(body, ensure_ascii=False).encode("utf-8"), "application/json")
+            # 分成几个增量发送，和真实服务的 SSE 格式一致
+            size = max(1, len(content) // 3)
+            events = [{"choices": [{"delta": {"content": content[i:i + size]}}]} for i in range(0, len(content), size)]
+            body = "".join(f"data: {json.dumps(event, ensure_ascii=False)}\n\n" for event in events) + "data: [DONE]\n\n"
+            self._send(200, body.encode("utf-8"), "text/event-stream")
+        finally:
+            server.stats.end(time.monotonic() - start, error)
+
+
+class MockGitHubHandler(BaseHTTPRequestHandler):
+    """同时充当 raw.githubusercontent.com（/{owner}/{repo}/{branch}/README.md）和 api.github.com（/repos/...）"""
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status: int, body: str, content_type: str = "application/json"):
+        data = body.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        self.server.stats.begin()
+        start = time.monotonic()
+        try:
+            parts = [part for part in self.path.split("?")[0].split("/") if part]
+            if parts[:1] == ["repos"] and len(parts) >= 3:
+                owner, repo = parts[1], parts[2]
+                if parts[3:5] == ["commits", "HEAD"]:
+                    return self._send(200, hashlib.sha1(f"{owner}/{repo}".encode()).hexdigest(), "text/plain")
+                if parts[3:5] == ["git", "trees"]:
+                    return self._send(200, json.dumps({"tree": [{"path": "docs/install.md", "type": "blob"}]}))
+                return self._send(200, json.dumps({"default_branch": "main"}))
+            if len(parts) >= 4 and parts[2] == "main":
+                text = f"# {parts[1]}\n\n## Installation\n\n```bash\ngit clone https://github.com/{parts[0]}/{parts[1]}.git\nmake\n```\n"
+                return self._send(200, text, "text/plain")
+            self._send(404, "Not Found", "text/plain")
+        finally:
+            self.server.stats.end(time.monotonic() - start, False)
+
+
+def start_server(handler, **attributes) -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    server.daemon_threads = True
+    server.request_queue_size = 256
+    server.stats = MockStats()
+    for name, value in attributes.items():
+        setattr(server, name, value)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+class ResourceSampler:
+    """在后台定期采样本进程的文件描述符数、常驻内存和线程数，记录峰值"""
+
+    def __init__(self):
+        self.stop_event = threading.Event()
+        self.samples: List[Dict] = []
+        try:
+            import psutil
+            self.process = psutil.Process()
+        except ImportError:
+            self.process = None
+
+    def sample(self) -> Dict:
+        fds = rss = None
+        if self.process:
+            fds = self.process.num_fds() if hasattr(self.process, "num_fds") else self.process.num_handles()
+            rss = self.process.memory_info().rss
+        elif os.path.isdir("/proc/self/fd"):
+            fds = len(os.listdir("/proc/self/fd"))
+            with open("/proc/self/status", encoding="utf-8") as f:
+                match = re.search(r"VmRSS:\s+(\d+) kB", f.read())
+                rss = int(match.group(1)) * 1024 if match else None
+        return {"fds": fds, "rss": rss, "threads": threading.active_count()}
+
+    def _run(self):
+        while not self.stop_event.wait(SAMPLE_INTERVAL):
+            self.samples.append(self.sample())
+
+    def __enter__(self):
+        self.baseline = self.sample()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop_event.set()
+        self.thread.join()
+
+    def peak(self, key: str) -> Optional[int]:
+        values = [sample[key] for sample in self.samples + [self.baseline] if sample[key] is not None]
+        return max(values) if values else None
+
+
+def run_level_in_process(concurrency: int, sessions: int, work_directory: str, timeout: float) -> Dict:
+    """子进程中执行：启动安装服务，提交 sessions 个任务，等待全部结束并统计"""
+    from install_daemon import InstallDaemon, FINISHED_STATES
+    from app_paths import get_data_path
+
+    with ResourceSampler() as sampler:
+        daemon = InstallDaemon(workers=concurrency)
+        daemon.start()
+        start = time.monotonic()
+        jobs = [daemon.submit({
+            "repo_url": f"https://github.com/load/r{index}",
+            "install_directory": os.path.join(work_directory, f"s{index}"),
+            "provider": "openai_compat",
+            "on_ask": "approve",
+            "replay": False,
+            "use_known_fixes": False,
+        }) for index in range(sessions)]
+        deadline = start + timeout
+        while time.monotonic() < deadline and any(job.status not in FINISHED_STATES for job in jobs):
+            time.sleep(SAMPLE_INTERVAL)
+        wall = time.monotonic() - start
+
+    finished = [job for job in jobs if job.status in FINISHED_STATES and job.started]
+    outcomes: Dict[str, int] = {}
+    for job in jobs:
+        outcomes[job.status] = outcomes.get(job.status, 0) + 1
+    with sqlite3.connect(get_data_path("sessions.db")) as db:
+        turns = [row[0] for row in db.execute("SELECT duration FROM llm_turns WHERE duration IS NOT NULL")]
+    return {
+        "concurrency": concurrency,
+        "sessions": sessions,
+        "wall": wall,
+        "outcomes": outcomes,
+        "session_latencies": [job.finished - job.started for job in finished],
+        "queue_waits": [job.started - job.created for job in finished],
+        "llm_turns": turns,
+        "fds": {"baseline": sampler.baseline["fds"], "peak": sampler.peak("fds")},
+        "rss": {"baseline": sampler.baseline["rss"], "peak": sampler.peak("rss")},
+        "threads": {"baseline": sampler.baseline["threads"], "peak": sampler.peak("threads")},
+    }
+
+
+def run_level(concurrency: int, args, llm_server: ThreadingHTTPServer, github_server: ThreadingHTTPServer, root: str) -> Dict:
+    """在子进程中执行一个并发级别，合并模拟服务端的统计"""
+    level_directory = os.path.join(root, f"c{concurrency}")
+    os.makedirs(os.path.join(level_directory, "work"))
+    env = dict(os.environ)
+    env.update({
+        "INSTALLER_DATA_DIR": os.path.join(level_directory, "data"),
+        "OPENAI_COMPAT_BASE_URL": f"http://127.0.0.1:{llm_server.server_port}/v1",
+        "OPENAI_COMPAT_MODEL_NAME": MOCK_MODEL,
+        "OPENAI_COMPAT_FAST_MODEL_NAME": "",
+        "OPENAI_COMPAT_API_KEY": "",
+        "DAEMON_PROVIDER": "openai_compat",
+        "GITHUB_API_URL": f"http://127.0.0.1:{github_server.server_port}",
+        "GITHUB_RAW_URL": f"http://127.0.0.1:{github_server.server_port}",
+        "GITHUB_TOKEN": "",
+        # 只测安装流程本身，关闭会改变执行路径的可选功能
+        "FIX_TRIALS": "0",
+        "UV_FAST_PATH": "0",
+        "ENV_POOL_SIZE": "0",
+    })
+    llm_server.stats.reset()
+    github_server.stats.reset()
+    command = [sys.executable, os.path.abspath(__file__), "_level", "--concurrency", str(concurrency),
+               "--sessions", str(concurrency * args.sessions_per_worker), "--work", os.path.join(level_directory, "work"),
+               "--timeout", str(args.timeout)]
+    process = subprocess.run(command, env=env, capture_output=True, text=True, errors="replace")
+    lines = [line for line in process.stdout.splitlines() if line.startswith(RESULT_PREFIX)]
+    if not lines:
+        raise RuntimeError(f"并发 {concurrency} 的子进程没有返回结果（返回码 {process.returncode}）:\n{process.stderr[-2000:]}")
+    result = json.loads(lines[-1][len(RESULT_PREFIX):])
+    result["llm_server"] = llm_server.stats.reset()
+    result["github_server"] = github_server.stats.reset()
+    return result
+
+
+def _seconds(value: Optional[float]) -> str:
+    return f"{value:.2f}" if value is not None else "-"
+
+
+def _megabytes(value: Optional[int]) -> str:
+    return f"{value / 1024 / 1024:.0f}" if value is not None else "-"
+
+
+def display_results(results: List[Dict]):
+    table = Table(title="并发安装会话压测", style="cyan")
+    for column in ("并发", "会话", "成功", "吞吐(个/分)", "耗时 p50", "p95", "p99", "排队 p95",
+                   "大模型 p50", "服务端 p50", "请求排队≈", "服务端并发峰值", "fd 峰值", "内存峰值(MB)", "线程峰值"):
+        table.add_column(column, justify="right")
+    for result in results:
+        latencies = result["session_latencies"]
+        llm = result["llm_server"]
+        client_mean = sum(result["llm_turns"]) / len(result["llm_turns"]) if result["llm_turns"] else None
+        server_mean = sum(llm["latencies"]) / len(llm["latencies"]) if llm["latencies"] else None
+        # 客户端观察到的平均请求耗时减去服务端的平均处理时间：连接池、线程调度等造成的排队和开销
+        queueing = client_mean - server_mean if client_mean is not None and server_mean is not None else None
+        table.add_row(
+            str(result["concurrency"]), str(result["sessions"]), str(result["outcomes"].get("success", 0)),
+            f"{result['sessions'] / result['wall'] * 60:.1f}",
+            _seconds(percentile(latencies, 50)), _seconds(percentile(latencies, 95)), _seconds(percentile(latencies, 99)),
+            _seconds(percentile(result["queue_waits"], 95)),
+            _seconds(percentile(result["llm_turns"], 50)), _seconds(percentile(llm["latencies"], 50)), _seconds(queueing),
+            str(llm["max_in_flight"]), str(result["fds"]["peak"] or "-"), _megabytes(result["rss"]["peak"]), str(result["threads"]["peak"]),
+        )
+    console.print(table)
+    for result in results:
+        failed = {status: count for status, count in result["outcomes"].items() if status != "success"}
+        errors = result["llm_server"]["errors"]
+        if failed or errors:
+            console.print(f"[dim]并发 {result['concurrency']}: 未成功的会话 {failed or '无'}，模拟的大模型错误 {errors} 次[/dim]")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="并发安装会话压测（模拟的大模型服务和 GitHub 服务）")
+    parser.add_argument("--concurrency", default="1,10,25,50", help="逗号分隔的并发数（默认 1,10,25,50）")
+    parser.add_argument("--sessions-per-worker", type=int, default=2, help="每个并发级别的会话数 = 并发数 × 该值（默认 2）")
+    parser.add_argument("--llm-latency", default="lognormal:1.0,0.5", help="大模型响应延迟分布（默认 lognormal:1.0,0.5）")
+    parser.add_argument("--llm-error-rate", type=float, default=0.0, help="大模型返回 500 错误的比例（默认 0）")
+    parser.add_argument("--fail-rate", type=float, default=0.3, help="中途有一条命令失败、需要修复一轮的会话比例（默认 0.3）")
+    parser.add_argument("--command-seconds", type=float, default=0.2, help="构建和修复命令的执行时间（默认 0.2 秒）")
+    parser.add_argument("--timeout", type=float, default=900, help="每个并发级别的最长时间（默认 900 秒）")
+    parser.add_argument("--seed", type=int, default=0, help="模拟服务的随机数种子")
+    parser.add_argument("--json", help="把完整结果写入 JSON 文件")
+    parser.add_argument("--keep", action="store_true", help="保留临时目录（安装目录、会话库、任务日志）")
+    # 内部使用：在子进程中执行一个并发级别
+    parser.add_argument("action", nargs="?", choices=["_level"], help=argparse.SUPPRESS)
+    parser.add_argument("--sessions", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--work", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.action == "_level":
+        result = run_level_in_process(int(args.concurrency), args.sessions, args.work, args.timeout)
+        print(RESULT_PREFIX + json.dumps(result, ensure_ascii=False))
+        return
+
+    llm_server = start_server(MockLLMHandler, latency=parse_latency(args.llm_latency), error_rate=args.llm_error_rate,
+                              fail_rate=args.fail_rate, command_seconds=args.command_seconds,
+                              rng=random.Random(args.seed), rng_lock=threading.Lock())
+    github_server = start_server(MockGitHubHandler)
+    root = tempfile.mkdtemp(prefix="installer-load-")
+    results = []
+    try:
+        for concurrency in [int(value) for value in args.concurrency.split(",") if value.strip()]:
+            console.print(f"[INFO] 并发 {concurrency}: {concurrency * args.sessions_per_worker} 个会话...")
+            result = run_level(concurrency, args, llm_server, github_server, root)
+            console.print(f"[INFO] 并发 {concurrency} 完成，用时 {result['wall']:.1f}s，结果 {result['outcomes']}")
+            results.append(result)
+    finally:
+        llm_server.shutdown()
+        github_server.shutdown()
+        if args.keep:
+            console.print(f"[INFO] 临时目录: {root}")
+        else:
+            shutil.rmtree(root, ignore_errors=True)
+    display_results(results)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        console.print(f"[INFO] 完整结果已写入 {args.json}")
+
+
+if __name__ == "__main__":
+    main()
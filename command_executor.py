@@ -1,140 +1,226 @@
 import subprocess
-from rich.console import Console
+import sys
+import threading
+import time
+from rich.markup import escape
 from rich.syntax import Syntax
 
-console = Console()
+from fatal_patterns import create_fatal_classifier
+from process_watchdog import create_watchdog, describe_termination, kill_process_tree, popen_group_kwargs
+from uv_fast_path import fast_path_enabled, translate_command
+from interaction import ConsoleProxy, ask, emit, get_interaction
+from log_channels import child_channel
 
-def execute_command_interactive(command_str):
+console = ConsoleProxy()
+
+POLL_INTERVAL = 0.25
+READER_JOIN_TIMEOUT = 10.0
+
+
+def _read_stream(stream, view, lines, stream_name, watchdog=None, classifier=None):
+    """逐行读取子进程输出，写入视图缓冲区（不在读取线程中渲染）"""
+    for line in iter(stream.readline, ''):
+        if watchdog:
+            watchdog.output()
+        if classifier:
+            classifier.feed(line)
+        if stream_name == "stderr" and not line.strip():
+            continue
+        lines.append(line)
+        view.add(line, stream_name)
+    stream.close()
+
+
+def run_command(command_str, view=None, watchdog=None, classifier=None, interactive=True, cwd=None):
+    """
+    执行命令，同时读取 stdout 和 stderr 并通过限速刷新的视图显示。
+    watchdog 为 process_watchdog.CommandWatchdog，超时时终止整个进程树；
+    classifier 为 fatal_patterns.FatalOutputClassifier，输出中出现致命错误时提前终止。
+    interactive 且在终端中交互时命令保留控制终端（sudo 密码等提示）；并行试验等场合传 False。
+    不保留终端时标准输入为 /dev/null：无界面模式的标准输入是回答询问的 JSON 行，等待输入的命令不能读走它们。
+    cwd 为执行目录，默认为安装器的当前目录。
+    返回 (stdout, stderr, 返回码, 终止原因)；正常结束时终止原因为 None，被终止时返回码为 None。
+    """
+    attach_terminal = interactive and get_interaction().terminal and sys.stdin is not None and sys.stdin.isatty()
+    process = subprocess.Popen(command_str, shell=True, stdin=None if attach_terminal else subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, bufsize=1, universal_newlines=True, errors="replace", cwd=cwd, **popen_group_kwargs(attach_terminal))
+    stdout_lines = []
+    stderr_lines = []
+    view = view or get_interaction().output_view(command_str)
+    termination = None
+
+    with view:
+        readers = [
+            threading.Thread(target=_read_stream, args=(process.stdout, view, stdout_lines, "stdout", watchdog, classifier), daemon=True),
+            threading.Thread(target=_read_stream, args=(process.stderr, view, stderr_lines, "stderr", watchdog, classifier), daemon=True),
+        ]
+        for reader in readers:
+            reader.start()
+        while process.poll() is None:
+            try:
+                process.wait(timeout=POLL_INTERVAL)
+            except subprocess.TimeoutExpired:
+                pass
+            if process.poll() is not None:
+                break
+            termination = (classifier and classifier.termination()) or (watchdog and watchdog.check(process.pid))
+            if termination:
+                kill_process_tree(process)
+                break
+        # 后台子进程可能一直占用输出管道，主进程结束后最多再等待一会儿
+        for reader in readers:
+            reader.join(timeout=READER_JOIN_TIMEOUT)
+
+    if termination:
+        console.print(f"[bold red][CMD] {describe_termination(termination)}[/bold red]")
+        return "".join(stdout_lines), "".join(stderr_lines), None, termination
+    console.print(f"[dim][CMD] {view.summary()}[/dim]")
+    return "".join(stdout_lines), "".join(stderr_lines), process.returncode, None
+
+
+def _run_checked(command_str, recorder=None):
+    """
+    在超时看门狗和致命错误规则的监视下执行一次命令，终止原因或匹配的摘录附在 stderr 末尾，并记录到会话库。
+    返回 (stdout, stderr, 返回码, 终止原因)。
+    """
+    started_at = time.time()
+    start = time.monotonic()
+    watchdog = create_watchdog(command_str, recorder.store if recorder else None)
+    classifier = create_fatal_classifier(command_str)
+    stdout, stderr, returncode, termination = run_command(command_str, watchdog=watchdog, classifier=classifier)
+    if termination:
+        # 终止原因附在 stderr 末尾（截断输出时保留结尾），修复流程和大模型都能看到
+        stderr = f"{stderr.rstrip()}\n{describe_termination(termination)}".lstrip()
+    elif returncode != 0 and classifier and classifier.match:
+        # 只记录不终止的规则：命令失败时同样把匹配的摘录附上
+        stderr = f"{stderr.rstrip()}\n{classifier.describe()}".lstrip()
+    if recorder:
+        recorder.record_command(command_str, started_at, time.monotonic() - start, returncode, stdout, stderr)
+    return stdout, stderr, returncode, termination
+
+
+def _run_fast_path(command_str, fast_command, recorder=None, snapshot=None):
+    """
+    先执行翻译为 uv 的命令，失败时回退执行原命令；两次执行的耗时都记录到会话库。
+    snapshot 为该步骤的快照，回退前先恢复，原命令从执行前的状态开始。
+    """
+    console.print(f"[dim][CMD] uv 快速路径: {escape(fast_command)}[/dim]")
+    started_at = time.time()
+    start = time.monotonic()
+    result = _run_checked(fast_command, recorder)
+    fast_duration = time.monotonic() - start
+    if result[2] == 0:
+        console.print(f"[dim][CMD] uv 快速路径成功，用时 {fast_duration:.1f}s[/dim]")
+        if recorder:
+            recorder.record_fast_path(command_str, fast_command, started_at, fast_duration, True)
+        return result
+    console.print(f"[yellow][CMD] uv 快速路径失败（{fast_duration:.1f}s），回退执行原命令...[/yellow]")
+    if snapshot:
+        snapshot.rewind()
+    start = time.monotonic()
+    result = _run_checked(command_str, recorder)
+    if recorder:
+        recorder.record_fast_path(command_str, fast_command, started_at, fast_duration, False, time.monotonic() - start, result[2] == 0)
+    return result
+
+
+def _execute(command_str, recorder=None, snapshots=None, executed=None):
+    """执行命令并显示结果，返回 execute_command_interactive 的结果元组；命令的消息和输出写入单独的日志通道"""
+    if executed is not None:
+        executed.append(command_str)
+    with child_channel():
+        return _execute_in_channel(command_str, recorder, snapshots)
+
+
+def _execute_in_channel(command_str, recorder=None, snapshots=None):
+    snapshot = snapshots.take(command_str) if snapshots else None
+    console.print("[bold green][CMD] 正在执行...[/bold green]")
+    emit("command_started", command=command_str)
+    started_at = time.time()
+    start = time.monotonic()
+    try:
+        # UV_FAST_PATH=1 时，venv 创建和 pip install 先通过 uv 执行
+        fast_command = translate_command(command_str) if fast_path_enabled() else None
+        if fast_command:
+            stdout, stderr, returncode, termination = _run_fast_path(command_str, fast_command, recorder, snapshot)
+        else:
+            stdout, stderr, returncode, termination = _run_checked(command_str, recorder)
+    except Exception as e:
+        if snapshot:
+            snapshot.discard()
+        console.print(f"[bold red][CMD] 执行命令时发生错误: {e}[/bold red]")
+        if recorder:
+            recorder.record_command(command_str, started_at, time.monotonic() - start, None, "", str(e))
+        emit("command_finished", command=command_str, exit_code=None, success=False, duration=round(time.monotonic() - start, 3), error=str(e))
+        return "", str(e), False, False, None
+    duration = time.monotonic() - start
+    if snapshot and returncode != 0:
+        # 失败的命令可能留下装了一半的包或构建产物，恢复到执行前的状态，并告诉大模型
+        stderr = f"{stderr.rstrip()}\n{snapshot.restore()}".lstrip()
+    elif snapshot:
+        snapshot.discard()
+    emit("command_finished", command=command_str, exit_code=returncode, success=returncode == 0, duration=round(duration, 3),
+         termination=termination["reason"] if termination else None)
+
+    if not stdout and not stderr:
+        console.print("[bold blue][CMD] 标准输出: <无输出>[/bold blue]")
+        console.print("[bold red][CMD] 标准错误: <无输出>[/bold red]")
+
+    if returncode != 0:
+        console.print("\n[bold red][CMD] 命令执行失败，返回码: {}[/bold red]".format(returncode))
+    else:
+        console.print("\n[bold green][CMD] 命令执行成功。[/bold green]")
+    console.rule()
+    return stdout, stderr, returncode == 0, False, returncode
+
+
+def execute_command_interactive(command_str, recorder=None, policy=None, snapshots=None, executed=None):
     """
     显示命令给用户，请求确认后执行，并返回输出。
+    返回 (stdout, stderr, 是否成功, 是否退出脚本, 返回码)，未执行时返回码为 None。
+    recorder 为会话记录器，设置后记录实际执行的命令。
+    policy 为命令审批策略，设置后自动批准安全的命令、直接拒绝危险的命令，其余仍询问用户。
+    snapshots 为 workspace_snapshot.WorkspaceSnapshots，设置后有风险的命令执行前建立快照，失败时恢复。
+    executed 为列表时，追加实际执行的命令（用户手动编辑过时与 command_str 不同）；命令没有执行时不追加。
     """
     console.rule("[bold yellow]即将执行的命令")
-    command_str1= command_str.strip()
     syntax = Syntax(command_str, "bash", theme="monokai", line_numbers=False, word_wrap=True)
     console.print(syntax)
     console.rule()
 
+    if policy:
+        action, reason = policy.evaluate(command_str)
+        if action == "deny":
+            console.print(f"[bold red][POLICY] 命令被安全策略拒绝: {reason}[/bold red]")
+            emit("command_blocked", command=command_str, source="policy", reason=reason)
+            console.rule()
+            return "", f"命令被安全策略拒绝，未执行（{reason}）。请换一种不需要该操作的方式。", False, False, None
+        if action == "allow":
+            console.print(f"[bold green][POLICY] 安全策略自动批准: {reason}[/bold green]")
+            return _execute(command_str, recorder, snapshots, executed)
+        console.print(f"[yellow][POLICY] 需要确认: {reason}[/yellow]")
+
     if "sudo" in command_str.lower():
         console.print("[bold red][警告][/bold red] 此命令包含 'sudo'，将以管理员权限运行。请务必小心！")
 
     console.print("[bold green]请选择操作：[/bold green][yellow](y)[/yellow] 执行  [yellow](n)[/yellow] 跳过  [yellow](m)[/yellow] 手动编辑  [yellow](q)[/yellow] 退出脚本")
-    user_input = input("你的选择 (y/n/m/q): ").strip().lower()
+    user_input = ask("confirm_command", "你的选择 (y/n/m/q): ", command=command_str).strip().lower()
 
     if user_input == 'y':
-        console.print("[bold green][CMD] 正在执行...[/bold green]")
-        try:
-            process = subprocess.Popen(command_str, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, bufsize=1, universal_newlines=True)
-            
-            stdout_lines = []
-            stderr_lines = []
-         
-            # Stream output
-            if process.stdout:
-                console.print("[bold blue][CMD] 标准输出:[/bold blue]")
-                for line in iter(process.stdout.readline, ''):
-                    console.print(line, end='')
-                    stdout_lines.append(line)
-                process.stdout.close()
-            
-            if process.stderr:
-                # Wait for stderr to complete after stdout
-                for line in iter(process.stderr.readline, ''):
-                    if not line.strip():
-                        continue
-                    if not stdout_lines: console.print("[bold blue][CMD] 标准输出: <无输出>[/bold blue]")
-                    if not stderr_lines : console.print("[bold red][CMD] 标准错误:[/bold red]")
-                    console.print(line, end='')
-                    stderr_lines.append(line)
-                process.stderr.close()
-
-            process.wait(timeout=500)
-            stdout = "".join(stdout_lines)
-            stderr = "".join(stderr_lines)
-            
-            if not stdout_lines and not stderr_lines :
-                 console.print("[bold blue][CMD] 标准输出: <无输出>[/bold blue]")
-                 console.print("[bold red][CMD] 标准错误: <无输出>[/bold red]")
-
-            if process.returncode != 0:
-                console.print("\n[bold red][CMD] 命令执行失败，返回码: {}[/bold red]".format(process.returncode))
-            else:
-                console.print("\n[bold green][CMD] 命令执行成功。[/bold green]")
-            console.rule()
-            return stdout, stderr, process.returncode == 0, False
-        except subprocess.TimeoutExpired:
-            console.print("[bold red][CMD] 命令执行超时。[/bold red]")
-            if process:
-                stdout_after_kill, stderr_after_kill = process.communicate()
-                return "".join(stdout_lines) + stdout_after_kill, "".join(stderr_lines) + stderr_after_kill, False, False
-            return "".join(stdout_lines), "".join(stderr_lines), False, False
-        except Exception as e:
-            console.print(f"[bold red][CMD] 执行命令时发生错误: {e}[/bold red]")
-            return "", str(e), False, False
+        return _execute(command_str, recorder, snapshots, executed)
     elif user_input == 'q':
         console.print("[bold magenta][INFO] 用户选择退出脚本。[/bold magenta]")
         console.rule()
-        return "", "", False, True 
+        return "", "", False, True, None
     elif user_input == 'm':
         console.print("[bold yellow][INFO] 用户选择手动执行命令。[/bold yellow]")
         console.rule()
         #复制原来的命令，右键粘贴
-        command_str = input("请输入手动执行的命令: ").strip()
+        command_str = ask("manual_command", "请输入手动执行的命令: ", command=command_str).strip()
         while not command_str:
             console.print("[bold red][ERROR] 未输入命令，无法执行，请重新输入。[/bold red]")
-            command_str = input("请输入手动执行的命令: ").strip()
-            
-        console.print("[bold green][CMD] 正在执行...[/bold green]")
-        try:
-             process = subprocess.Popen(command_str, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, bufsize=1, universal_newlines=True)
-            
-             stdout_lines = []
-             stderr_lines = []
-
-            # Stream output
-             if process.stdout:
-                console.print("[bold blue][CMD] 标准输出:[/bold blue]")
-                for line in iter(process.stdout.readline, ''):
-                    console.print(line, end='')
-                    stdout_lines.append(line)
-                process.stdout.close()
-            
-             if process.stderr:
-                # Wait for stderr to complete after stdout
-                for line in iter(process.stderr.readline, ''):
-                    if not line.strip():
-                        continue
-                    if not stdout_lines: console.print("[bold blue][CMD] 标准输出: <无输出>[/bold blue]")
-                    if not stderr_lines : console.print("[bold red][CMD] 标准错误:[/bold red]")
-                    console.print(line, end='')
-                    stderr_lines.append(line)
-                process.stderr.close()
-
-             process.wait(timeout=500)
-             stdout = "".join(stdout_lines)
-             stderr = "".join(stderr_lines)
-            
-             if not stdout_lines and not stderr_lines :
-                 console.print("[bold blue][CMD] 标准输出: <无输出>[/bold blue]")
-                 console.print("[bold red][CMD] 标准错误: <无输出>[/bold red]")
-
-             if process.returncode != 0:
-                console.print("\n[bold red][CMD] 命令执行失败，返回码: {}[/bold red]".format(process.returncode))
-             else:
-                console.print("\n[bold green][CMD] 命令执行成功。[/bold green]")
-             console.rule()
-             return stdout, stderr, process.returncode == 0, False
-        except subprocess.TimeoutExpired:
-             console.print("[bold red][CMD] 命令执行超时。[/bold red]")
-             if process:
-                stdout_after_kill, stderr_after_kill = process.communicate()
-                return "".join(stdout_lines) + stdout_after_kill, "".join(stderr_lines) + stderr_after_kill, False, False
-             return "".join(stdout_lines), "".join(stderr_lines), False, False
-        except Exception as e:
-             console.print(f"[bold red][CMD] 执行命令时发生错误: {e}[/bold red]")
-             return "", str(e), False, False
-
-
+            command_str = ask("manual_command", "请输入手动执行的命令: ").strip()
+        return _execute(command_str, recorder, snapshots, executed)
     else:
         console.print("[bold yellow][INFO] 跳过命令。[/bold yellow]")
         console.rule()
-        return "", "", True, False
+        return "", "", True, False, None
@@ -0,0 +1,345 @@
+import argparse
+import json
+import os
+import re
+import shlex
+import time
+from collections import Counter
+from typing import List, Dict, Optional, Tuple
+
+from rich.table import Table
+
+from app_paths import get_data_path
+from interaction import ConsoleProxy
+
+console = ConsoleProxy()
+
+ALLOW = "allow"
+ASK = "ask"
+DENY = "deny"
+# 多段命令取最严格的结果
+SEVERITY = {ALLOW: 0, ASK: 1, DENY: 2}
+
+CATEGORIES = {
+    "package_manager": ["pip", "pip3", "conda", "mamba", "micromamba", "uv", "poetry", "pipx", "npm", "yarn", "pnpm", "cargo", "gem", "bundle"],
+    "system_package_manager": ["apt", "apt-get", "yum", "dnf", "pacman", "zypper", "brew", "snap", "choco", "winget"],
+    "network": ["curl", "wget", "ssh", "scp", "rsync", "nc", "ncat", "telnet", "ftp", "sftp"],
+    "shell_builtin": ["cd", "export", "source", ".", "set", "unset", "true"],
+    "read_only": ["echo", "ls", "pwd", "cat", "head", "tail", "which", "where", "whoami", "uname", "nvidia-smi", "nvcc", "printenv", "dir", "type"],
+    "filesystem": ["mkdir", "touch", "cp", "mv", "rm", "ln", "chmod", "unzip", "tar"],
+}
+
+# 不写策略文件时使用的默认策略，可用 python command_policy.py init 导出后修改
+DEFAULT_POLICY = {
+    "default": ASK,
+    "allowed_paths": ["/tmp", "/dev/null"],
+    "rules": [
+        {"action": DENY, "whole_command": True, "pattern": r"\brm\s+(-[a-zA-Z]*[rf][a-zA-Z]*\s+)+(/|~|\$HOME)/?(\s|$|\*)", "description": "删除根目录或用户主目录"},
+        {"action": DENY, "whole_command": True, "pattern": r":\(\)\s*\{\s*:\|:&\s*\};:", "description": "fork 炸弹"},
+        {"action": DENY, "whole_command": True, "pattern": r"\bdd\b.*\bof=/dev/|>\s*/dev/sd[a-z]", "description": "直接写磁盘设备"},
+        {"action": DENY, "executables": ["mkfs", "fdisk", "parted", "shutdown", "reboot", "halt", "poweroff"], "description": "磁盘格式化或关机"},
+        {"action": ASK, "unresolved_paths": True, "description": "参数中的变量或命令替换在执行前无法确定"},
+        {"action": DENY, "executables": ["rm"], "outside_install_dir": True, "description": "删除安装目录以外的文件"},
+        {"action": DENY, "executables": ["chmod", "chown"], "pattern": r"\s-R\b", "outside_install_dir": True, "description": "递归修改安装目录以外的权限"},
+        {"action": ASK, "whole_command": True, "pattern": r"\b(curl|wget)\b[^|]*\|\s*(sudo\s+)?(ba|z)?sh\b", "description": "下载脚本并直接执行"},
+        {"action": ASK, "sudo": True, "description": "以管理员权限运行"},
+        {"action": ASK, "category": "system_package_manager", "description": "修改系统软件包"},
+        {"action": ASK, "category": "network", "description": "网络工具"},
+        {"action": ASK, "outside_install_dir": True, "description": "涉及安装目录以外的路径"},
+        {"action": ASK, "pattern": r"^(pip3?|uv\s+pip)\s+install\b.*\s(--user|--break-system-packages)\b", "description": "安装到用户或系统 Python"},
+        {"action": ASK, "pattern": r"^((uv|poetry|pipx|conda|mamba|micromamba)\s+run|npm\s+(exec|x)|pnpm\s+(exec|dlx)|yarn\s+dlx|npx|uvx)(\s|$)", "description": "通过包管理器运行任意命令"},
+        {"action": ASK, "executables": ["source", "."], "description": "在当前 shell 中执行脚本"},
+        {"action": ALLOW, "category": "package_manager", "description": "包管理器"},
+        {"action": ALLOW, "executables": ["git"], "pattern": r"^git\s+(clone|checkout|switch|submodule|pull|fetch|lfs|status|log|rev-parse)\b", "description": "获取源码"},
+        {"action": ALLOW, "pattern": r"^python3?(\.\d+)?\s+(setup\.py\s+(install|develop|build\w*)|--version|-V)(\s|$)", "description": "构建或检查 Python"},
+        {"action": ALLOW, "category": "shell_builtin", "description": "shell 内建命令"},
+        {"action": ALLOW, "category": "read_only", "description": "只读命令"},
+        {"action": ALLOW, "category": "filesystem", "description": "安装目录内的文件操作"},
+    ],
+}
+
+ENV_ASSIGNMENT = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*=")
+# 执行时才展开的内容：$VAR、${VAR}、$(...) 和反引号
+UNRESOLVED = re.compile(r"[$`]")
+# 这些命令的所有操作数都是路径（包括 build、*、. 这样的相对名字），chmod / chown 的第一个操作数是权限或属主
+FILE_OPERATIONS = {"rm": 0, "mv": 0, "cp": 0, "chmod": 1, "chown": 1}
+
+
+def split_command(command: str) -> List[Tuple[str, List[str]]]:
+    """
+    按 && || ; | & 拆分命令，返回 [(前面的连接符, 该段的词列表)]，第一段的连接符为空字符串；
+    引号不匹配等无法解析时抛出 ValueError
+    """
+    lexer = shlex.shlex(command, posix=True, punctuation_chars=True)
+    lexer.whitespace_split = True
+    parts, current, operator = [], [], ""
+    for token in lexer:
+        if token and set(token) <= set("&|;()"):
+            if current:
+                parts.append((operator, current))
+            current, operator = [], token
+        else:
+            current.append(token)
+    if current:
+        parts.append((operator, current))
+    return parts
+
+
+def split_segments(command: str) -> List[List[str]]:
+    """按 && || ; | 拆分命令，返回每段的词列表；引号不匹配等无法解析时抛出 ValueError"""
+    return [tokens for _, tokens in split_command(command)]
+
+
+def _analyze(tokens: List[str]) -> Tuple[str, bool, List[str]]:
+    """返回 (可执行文件名, 是否 sudo, 去掉环境变量赋值和 sudo 之后的词)"""
+    tokens = list(tokens)
+    while tokens and ENV_ASSIGNMENT.match(tokens[0]):
+        tokens.pop(0)
+    sudo = False
+    if tokens and tokens[0] in ("sudo", "doas"):
+        sudo = True
+        tokens.pop(0)
+        while tokens and tokens[0].startswith("-"):
+            tokens.pop(0)
+    if not tokens:
+        return "", sudo, tokens
+    executable = os.path.basename(tokens[0])
+    # python -m pip ... 按 pip 处理
+    if re.match(r"^python[\d.]*$", executable) and len(tokens) > 2 and tokens[1] == "-m":
+        executable = tokens[2]
+        tokens = tokens[2:]
+    return executable, sudo, tokens
+
+
+def _file_operands(executable: str, tokens: List[str]) -> List[str]:
+    """rm / mv / cp / chmod / chown 的路径操作数（跳过选项和 chmod 的权限、chown 的属主）"""
+    operands, options_done = [], False
+    for token in tokens[1:]:
+        if not options_done and token == "--":
+            options_done = True
+        elif options_done or not token.startswith("-") or token == "-":
+            operands.append(token)
+    return operands[FILE_OPERATIONS[executable]:]
+
+
+def _path_arguments(executable: str, tokens: List[str]) -> List[str]:
+    """找出参数中像路径的部分：绝对路径、~、./ ../ 开头或包含 / 的词，cd 的目标，以及文件操作命令的所有操作数"""
+    if executable in FILE_OPERATIONS:
+        return _file_operands(executable, tokens)
+    paths = []
+    for token in tokens[1:]:
+        if executable == "cd" and token.lower() == "/d":
+            continue
+        if "://" in token or token.startswith("git@"):
+            continue
+        if token.startswith("-"):
+            if "=" not in token:
+                continue
+            token = token.split("=", 1)[1]
+        if executable == "cd" or token.startswith(("/", "~", "./", "../")) or (token != ".." and "/" in token and not token.startswith("$")):
+            paths.append(token)
+    return paths
+
+
+def _unresolved_arguments(tokens: List[str]) -> List[str]:
+    """参数中执行时才展开的部分（$VAR、${VAR}、命令替换），这样的路径无法在执行前判断是否在安装目录内"""
+    return [token for token in tokens[1:] if UNRESOLVED.search(token)]
+
+
+def _is_within(path: str, directories: List[str]) -> bool:
+    path = os.path.normcase(os.path.normpath(path))
+    for directory in directories:
+        directory = os.path.normcase(os.path.normpath(directory))
+        if path == directory or path.startswith(directory.rstrip(os.sep) + os.sep):
+            return True
+    return False
+
+
+class CommandPolicy:
+    """
+    声明式命令审批策略：规则按顺序匹配，第一条命中的规则决定该段命令的结果（allow / ask / deny），
+    整条命令取各段中最严格的结果。
+    """
+
+    def __init__(self, policy: Dict, install_directory: str):
+        self.default = policy.get("default", ASK)
+        self.rules = [dict(rule, _regex=re.compile(rule["pattern"])) if "pattern" in rule else dict(rule) for rule in policy.get("rules", [])]
+        self.install_directory = os.path.abspath(os.path.expanduser(install_directory))
+        self.allowed_paths = [self.install_directory] + [os.path.expanduser(p) for p in policy.get("allowed_paths", [])]
+
+    def _outside_paths(self, executable: str, tokens: List[str], cwd: str) -> List[str]:
+        # 无法确定的参数一律视为安装目录以外的路径
+        outside = _unresolved_arguments(tokens)
+        for token in _path_arguments(executable, tokens):
+            if token in outside:
+                continue
+            token_path = os.path.expanduser(token)
+            path = os.path.join(cwd, token_path)
+            # 文件操作的相对路径（包括 * 和 .）相对于命令实际执行的目录：该目录不在安装目录内时，
+            # 即使在 allowed_paths 中（如 /tmp）也不视为安装目录内的操作
+            allowed = [self.install_directory] if executable in FILE_OPERATIONS and not os.path.isabs(token_path) else self.allowed_paths
+            if not _is_within(path, allowed):
+                outside.append(token)
+        return outside
+
+    def _rule_matches(self, rule: Dict, segment: str, executable: str, sudo: bool, outside: List[str], unresolved: List[str]) -> bool:
+        # mkfs.ext4 之类的命令按 mkfs 匹配
+        if "executables" in rule and executable not in rule["executables"] and executable.split(".")[0] not in rule["executables"]:
+            return False
+        if "category" in rule and executable not in CATEGORIES.get(rule["category"], []):
+            return False
+        if "sudo" in rule and rule["sudo"] != sudo:
+            return False
+        if "outside_install_dir" in rule and rule["outside_install_dir"] != bool(outside):
+            return False
+        if "unresolved_paths" in rule and rule["unresolved_paths"] != bool(unresolved):
+            return False
+        if "_regex" in rule and not rule["_regex"].search(segment):
+            return False
+        return True
+
+    def evaluate(self, command: str) -> Tuple[str, str]:
+        """返回 (allow/ask/deny, 原因)"""
+        for rule in self.rules:
+            if rule.get("whole_command") and rule["_regex"].search(command):
+                return rule["action"], rule.get("description", rule["pattern"])
+
+        try:
+            segments = split_segments(command)
+        except ValueError:
+            return ASK, "无法解析命令"
+        if not segments:
+            return ASK, "空命令"
+
+        # 命令在安装器的当前目录中执行，cd 会改变后续各段的工作目录
+        cwd = os.getcwd()
+        decision, reasons = ALLOW, []
+        for tokens in segments:
+            executable, sudo, tokens = _analyze(tokens)
+            segment = " ".join(tokens)
+            outside = self._outside_paths(executable, tokens, cwd)
+            unresolved = _unresolved_arguments(tokens)
+            action, reason = self.default, f"没有匹配的规则: {executable}"
+            for rule in self.rules:
+                if not rule.get("whole_command") and self._rule_matches(rule, segment, executable, sudo, outside, unresolved):
+                    action, reason = rule["action"], rule.get("description", rule.get("pattern", ""))
+                    break
+            if outside and action != ALLOW:
+                reason += f"（{', '.join(outside)}）"
+            targets = _path_arguments(executable, tokens) if executable == "cd" else []
+            if targets:
+                cwd = os.path.join(cwd, os.path.expanduser(targets[0]))
+            if SEVERITY[action] > SEVERITY[decision]:
+                decision, reasons = action, [reason]
+            elif action == decision and reason not in reasons:
+                reasons.append(reason)
+        return decision, "；".join(reasons)
+
+
+def get_policy_path() -> str:
+    return os.getenv("COMMAND_POLICY_FILE") or get_data_path("policy.json")
+
+
+def load_policy(install_directory: str, path: str = None) -> Optional[CommandPolicy]:
+    """
+    加载命令审批策略：COMMAND_POLICY=off 时返回 None（每条命令都询问）；
+    策略文件不存在时使用默认策略。
+    """
+    if os.getenv("COMMAND_POLICY", "").lower() in ("off", "0", "false"):
+        return None
+    path = path or get_policy_path()
+    policy = DEFAULT_POLICY
+    if os.path.exists(path):
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                policy = json.load(f)
+        except (OSError, ValueError) as e:
+            console.print(f"[WARN] 读取命令审批策略 {path} 失败，使用默认策略: {e}")
+    try:
+        return CommandPolicy(policy, install_directory)
+    except (KeyError, re.error) as e:
+        console.print(f"[ERROR] 命令审批策略有误，所有命令都需要确认: {e}")
+        return None
+
+
+def dry_run(policy_path: str = None, db_path: str = None, days: float = 30, repo: str = None, limit: int = 10):
+    """用当前策略评估会话库中记录过的命令，统计哪些会被自动批准、询问或拒绝"""
+    from session_store import SessionStore
+
+    store = SessionStore(db_path)
+    sql = "SELECT c.command, s.install_directory, s.owner || '/' || s.repo AS repo FROM commands c JOIN sessions s ON s.id = c.session_id WHERE c.started_at >= ?"
+    params = [time.time() - days * 86400]
+    if repo:
+        sql += " AND (s.repo = ? OR s.owner || '/' || s.repo = ?)"
+        params += [repo, repo]
+    rows = store.query(sql, params)
+
+    policies = {}
+    counts = Counter()
+    examples: Dict[str, Counter] = {ASK: Counter(), DENY: Counter()}
+    for row in rows:
+        install_directory = row["install_directory"] or os.getcwd()
+        if install_directory not in policies:
+            policies[install_directory] = load_policy(install_directory, policy_path) or CommandPolicy({"default": ASK}, install_directory)
+        action, reason = policies[install_directory].evaluate(row["command"])
+        counts[action] += 1
+        if action in examples:
+            examples[action][(row["command"][:80], reason)] += 1
+
+    total = sum(counts.values())
+    table = Table(title=f"策略试运行（{total} 条命令）", style="cyan")
+    table.add_column("结果")
+    table.add_column("命令数")
+    table.add_column("占比")
+    for action, label in ((ALLOW, "自动批准"), (ASK, "询问"), (DENY, "拒绝")):
+        table.add_row(label, str(counts[action]), f"{counts[action] / total:.0%}" if total else "-")
+    console.print(table)
+
+    for action, label in ((DENY, "会被拒绝的命令"), (ASK, "仍需确认的命令")):
+        if not examples[action]:
+            continue
+        table = Table(title=label, style="cyan")
+        table.add_column("次数", justify="right")
+        table.add_column("命令", overflow="fold")
+        table.add_column("原因", overflow="fold")
+        for (command, reason), count in examples[action].most_common(limit):
+            table.add_row(str(count), command, reason)
+        console.print(table)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="命令审批策略")
+    subparsers = parser.add_subparsers(dest="action", required=True)
+    init_parser = subparsers.add_parser("init", help="导出默认策略到策略文件，便于修改")
+    init_parser.add_argument("--force", action="store_true", help="覆盖已有的策略文件")
+    check_parser = subparsers.add_parser("check", help="评估一条命令")
+    check_parser.add_argument("command")
+    check_parser.add_argument("--dir", default=os.getcwd(), help="安装目录（默认当前目录）")
+    dry_parser = subparsers.add_parser("dry-run", help="用会话库中记录的命令试运行当前策略")
+    dry_parser.add_argument("--days", type=float, default=30, help="统计最近多少天（默认 30）")
+    dry_parser.add_argument("--repo", help="只统计某个仓库（repo 或 owner/repo）")
+    dry_parser.add_argument("--policy", help="策略文件路径")
+    dry_parser.add_argument("--db", help="数据库路径")
+    args = parser.parse_args()
+
+    if args.action == "init":
+        path = get_policy_path()
+        if os.path.exists(path) and not args.force:
+            console.print(f"[WARN] {path} 已存在，使用 --force 覆盖。")
+            return
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(DEFAULT_POLICY, f, ensure_ascii=False, indent=2)
+        console.print(f"[INFO] 默认策略已写入 {path}")
+    elif args.action == "check":
+        policy = load_policy(args.dir)
+        if not policy:
+            console.print("[INFO] 命令审批策略已关闭，所有命令都需要确认。")
+            return
+        action, reason = policy.evaluate(args.command)
+        console.print(f"{action}: {reason}")
+    elif args.action == "dry-run":
+        dry_run(args.policy, args.db, args.days, args.repo)
+
+
+if __name__ == "__main__":
+    main()
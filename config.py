@@ -2,9 +2,12 @@ import os
 import dashscope
 import google.generativeai as genai  
 from dotenv import load_dotenv
-from rich.console import Console
+from interaction import ConsoleProxy, ask
 
-console = Console()
+console = ConsoleProxy()
+
+# select_api_provider 返回该值表示组合使用所有可用的API
+MULTI_PROVIDER = "multi"
 
 def load_environment_variables():
     """Loads environment variables from .env file."""
@@ -22,6 +25,8 @@ def get_available_apis():
             available_apis['qwen'] = {
                 'name': '通义千问',
                 'model': os.getenv("QWEN_MODEL_NAME", "qwen-plus-latest"),
+                # 可选的快速模型，简单的修复轮次使用（如 qwen-turbo）
+                'fast_model': os.getenv("QWEN_FAST_MODEL_NAME"),
                 'client': None  # dashscope使用全局配置
             }
             console.print("[INFO] 通义千问 API 配置成功。")
@@ -43,11 +48,23 @@ def get_available_apis():
         available_apis['gemini'] = {
             'name': 'Google Gemini',
             'model': model_name,
+            'fast_model': os.getenv("GEMINI_FAST_MODEL_NAME"),
             'instance': model  # 更清晰的命名，避免歧义
         }
         console.print("[INFO] Google Gemini API 配置成功。")
      except Exception as e:
         console.print(f"[WARN] Google Gemini API 配置失败: {e}")
+
+    # 检查 OpenAI 兼容接口（llama.cpp server、vLLM、Ollama 等本地模型）
+    openai_base_url = os.getenv("OPENAI_COMPAT_BASE_URL")
+    if openai_base_url:
+        available_apis['openai_compat'] = {
+            'name': f'OpenAI 兼容接口 ({openai_base_url})',
+            'model': os.getenv("OPENAI_COMPAT_MODEL_NAME", "auto"),
+            'fast_model': os.getenv("OPENAI_COMPAT_FAST_MODEL_NAME"),
+            'base_url': openai_base_url
+        }
+        console.print("[INFO] OpenAI 兼容接口配置成功。")
     
     return available_apis
 
@@ -65,15 +82,19 @@ def select_api_provider(available_apis):
     console.print("\n[INFO] 检测到多个可用的API，请选择:")
     for i, (key, value) in enumerate(available_apis.items(), 1):
         console.print(f"  {i}. {value['name']} (模型: {value['model']})")
+    console.print(f"  {len(available_apis) + 1}. 同时使用全部 (初始命令竞速，出错或超时自动切换)")
     
     while True:
         try:
-            choice = int(input("请输入选择 (数字): ")) - 1
+            choice = int(ask("provider", "请输入选择 (数字): ", options=list(available_apis) + [MULTI_PROVIDER])) - 1
             providers = list(available_apis.keys())
             if 0 <= choice < len(providers):
                 selected = providers[choice]
                 console.print(f"[INFO] 已选择: {available_apis[selected]['name']}")
                 return selected
+            elif choice == len(providers):
+                console.print("[INFO] 已选择: 同时使用全部API")
+                return MULTI_PROVIDER
             else:
                 console.print("[ERROR] 无效选择，请重新输入。")
         except ValueError:
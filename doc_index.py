@@ -0,0 +1,164 @@
+import math
+import os
+import re
+from collections import Counter
+from typing import List, Dict, Optional
+
+from readme_processor import split_sections
+
+DOC_EXTENSIONS = (".md", ".rst", ".txt", ".markdown")
+# 这些目录下的文档才会被索引（另外还包括仓库根目录的文档文件）
+DOC_DIRECTORIES = ("docs", "doc", "documentation", "install", "installation", "guide", "guides")
+SKIP_DIRECTORIES = {".git", "node_modules", "site-packages", "__pycache__", ".venv", "venv", "build", "dist", ".tox"}
+MAX_FILE_BYTES = 512 * 1024
+MAX_FILES = 300
+CHUNK_CHARS = 1200
+
+WORD_PATTERN = re.compile(r"[a-z0-9][a-z0-9_.+\-]*")
+CJK_PATTERN = re.compile(r"[一-鿿]")
+
+
+def tokenize(text: str) -> List[str]:
+    """分词：英文按单词（保留 . + - 以匹配包名和版本），中文按单字和双字组合"""
+    text = text.lower()
+    tokens = WORD_PATTERN.findall(text)
+    # 带点号的词同时拆成子词，如 torch.cuda -> torch, cuda
+    tokens.extend(part for token in tokens if "." in token for part in token.split(".") if part)
+    cjk = CJK_PATTERN.findall(text)
+    tokens.extend(cjk)
+    tokens.extend(a + b for a, b in zip(cjk, cjk[1:]))
+    return tokens
+
+
+def chunk_document(text: str, max_chars: int = CHUNK_CHARS) -> List[str]:
+    """按章节切分文档，过长的章节再按段落切成不超过 max_chars 的块，每块带上章节标题"""
+    chunks = []
+    for section in split_sections(text):
+        heading = section["heading"]
+        paragraphs = [p for p in re.split(r"\n\s*\n", section["body"]) if p.strip()]
+        current = ""
+        for paragraph in paragraphs:
+            if current and len(current) + len(paragraph) > max_chars:
+                chunks.append(f"{heading}\n{current}".strip())
+                current = ""
+            current = f"{current}\n\n{paragraph}" if current else paragraph[:max_chars * 2]
+        if current or heading:
+            chunks.append(f"{heading}\n{current}".strip())
+    return [chunk for chunk in chunks if len(chunk) > 20]
+
+
+class DocIndex:
+    """基于 BM25 的本地文档检索索引，不依赖第三方库"""
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.chunks: List[Dict] = []
+        self.term_freqs: List[Counter] = []
+        self.doc_freq: Counter = Counter()
+        self.avg_length = 0.0
+
+    def add_document(self, source: str, text: str):
+        """切块并加入索引"""
+        for chunk in chunk_document(text):
+            tokens = tokenize(chunk)
+            if not tokens:
+                continue
+            freqs = Counter(tokens)
+            self.chunks.append({"id": len(self.chunks), "source": source, "text": chunk, "length": len(tokens)})
+            self.term_freqs.append(freqs)
+            self.doc_freq.update(freqs.keys())
+        if self.chunks:
+            self.avg_length = sum(chunk["length"] for chunk in self.chunks) / len(self.chunks)
+
+    def __len__(self):
+        return len(self.chunks)
+
+    def search(self, query: str, top_k: int = 3, exclude_ids: Optional[set] = None) -> List[Dict]:
+        """返回与查询最相关的 top_k 个文档块，exclude_ids 中的块不返回"""
+        query_terms = set(tokenize(query))
+        if not query_terms or not self.chunks:
+            return []
+        total = len(self.chunks)
+        scores = []
+        for chunk, freqs in zip(self.chunks, self.term_freqs):
+            if exclude_ids and chunk["id"] in exclude_ids:
+                continue
+            score = 0.0
+            norm = self.k1 * (1 - self.b + self.b * chunk["length"] / self.avg_length)
+            for term in query_terms:
+                tf = freqs.get(term)
+                if not tf:
+                    continue
+                df = self.doc_freq[term]
+                idf = math.log(1 + (total - df + 0.5) / (df + 0.5))
+                score += idf * tf * (self.k1 + 1) / (tf + norm)
+            if score > 0:
+                scores.append((score, chunk))
+        scores.sort(key=lambda item: -item[0])
+        return [dict(chunk, score=score) for score, chunk in scores[:top_k]]
+
+    @classmethod
+    def from_files(cls, files: Dict[str, str]) -> "DocIndex":
+        """从 {路径: 内容} 构建索引"""
+        index = cls()
+        for path, text in files.items():
+            index.add_document(path, text)
+        return index
+
+    @classmethod
+    def from_directory(cls, root: str) -> "DocIndex":
+        """从本地克隆的仓库构建索引：根目录的文档文件以及文档目录下的所有文档"""
+        return cls.from_files(collect_doc_files(root))
+
+
+def is_doc_path(relative_path: str) -> bool:
+    """判断仓库内的相对路径是否是需要索引的文档"""
+    relative_path = relative_path.replace("\\", "/")
+    if not relative_path.lower().endswith(DOC_EXTENSIONS):
+        return False
+    parts = relative_path.split("/")
+    if any(part in SKIP_DIRECTORIES for part in parts[:-1]):
+        return False
+    if len(parts) == 1:
+        return parts[0].lower() not in ("requirements.txt", "license.txt", "changelog.md", "changes.rst")
+    return parts[0].lower() in DOC_DIRECTORIES
+
+
+def collect_doc_files(root: str) -> Dict[str, str]:
+    """读取仓库目录中的文档文件"""
+    files = {}
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = [d for d in dirnames if d not in SKIP_DIRECTORIES]
+        for filename in filenames:
+            path = os.path.join(dirpath, filename)
+            relative_path = os.path.relpath(path, root)
+            if not is_doc_path(relative_path):
+                continue
+            try:
+                if os.path.getsize(path) > MAX_FILE_BYTES:
+                    continue
+                with open(path, "r", encoding="utf-8", errors="ignore") as f:
+                    files[relative_path] = f.read()
+            except OSError:
+                continue
+            if len(files) >= MAX_FILES:
+                return files
+    return files
+
+
+def format_chunks(chunks: List[Dict], max_chars: int) -> str:
+    """将检索结果格式化为提示词片段，总长度不超过 max_chars"""
+    parts = []
+    used = 0
+    for chunk in chunks:
+        block = f"[{chunk['source']}]\n{chunk['text']}"
+        if used + len(block) > max_chars:
+            block = block[:max_chars - used]
+        if not block.strip():
+            break
+        parts.append(block)
+        used += len(block)
+        if used >= max_chars:
+            break
+    return "\n\n".join(parts)
@@ -0,0 +1,355 @@
+import argparse
+import json
+import os
+import re
+import shlex
+import shutil
+import subprocess
+import threading
+import time
+import uuid
+from typing import List, Dict, Optional
+
+from rich.table import Table
+
+from fix_trials import rename_conda_envs
+from preflight import PreflightChecker
+from uv_fast_path import split_and
+from interaction import ConsoleProxy, emit, get_interaction, use_interaction
+
+console = ConsoleProxy()
+
+# 预热环境的名称前缀，完整名称如 installer-pool-py3.10-1a2b3c4d
+POOL_PREFIX = "installer-pool-"
+# 环境根目录下的标记文件：创建完成、可以领取的环境有 READY_MARKER，领取时原子地改名为 CLAIMED_MARKER
+READY_MARKER = ".installer-pool-ready"
+CLAIMED_MARKER = ".installer-pool-claimed"
+# 每个预热环境都预装的包
+BASE_PACKAGES = ["pip", "setuptools", "wheel"]
+# conda create 中可以由预热环境代替的参数，带有其他参数（--file、-p、--clone 等）的命令原样执行
+CREATE_FLAGS = {"-y", "--yes", "-q", "--quiet"}
+CREATE_OPTIONS = {"-n", "--name", "-c", "--channel"}
+# python=3.10、python==3.10、python=3.10.*；指定了补丁版本的不使用预热环境
+PYTHON_SPEC = re.compile(r"^python={1,2}(\d+\.\d+)(?:\.\*)?$")
+
+
+def parse_conda_create(segment: str) -> Optional[Dict]:
+    """
+    解析 conda/mamba create 段，返回 {tool, name, python, packages, channels}；
+    不是 conda create、没有指定 Python 版本或带有不支持的参数时返回 None。
+    """
+    try:
+        tokens = shlex.split(segment)
+    except ValueError:
+        return None
+    if len(tokens) < 2 or os.path.basename(tokens[0]) not in ("conda", "mamba") or tokens[1] != "create":
+        return None
+    parsed = {"tool": tokens[0], "name": None, "python": None, "packages": [], "channels": []}
+    index = 2
+    while index < len(tokens):
+        token = tokens[index]
+        option, _, value = token.partition("=")
+        if token in CREATE_FLAGS:
+            pass
+        elif option in CREATE_OPTIONS:
+            if not value:
+                index += 1
+                if index >= len(tokens):
+                    return None
+                value = tokens[index]
+            if option in ("-n", "--name"):
+                parsed["name"] = value
+            else:
+                parsed["channels"].append(value)
+        elif token.startswith("-"):
+            return None
+        else:
+            match = PYTHON_SPEC.match(token)
+            if match:
+                parsed["python"] = match.group(1)
+            elif token != "python":
+                parsed["packages"].append(token)
+        index += 1
+    if not parsed["name"] or not parsed["python"]:
+        return None
+    return parsed
+
+
+class EnvPool:
+    """
+    预热的 conda 环境池：为每个常用的 Python 版本预先创建 size 个装好 pip/setuptools/wheel（以及 ENV_POOL_PACKAGES）的环境。
+    计划中的 conda create 遇到池中有对应版本的环境时直接领取并改名为计划中的环境名；
+    领取后在后台线程中补充。环境保存在 conda 的环境目录中，多个进程共用，领取通过标记文件改名保证只有一方成功。
+    """
+
+    def __init__(self, size: int, pythons: List[str], packages: List[str], preflight=None):
+        self.size = size
+        self.pythons = pythons
+        self.packages = packages
+        self.preflight = preflight or PreflightChecker()
+        self.conda = shutil.which("conda") or os.getenv("CONDA_EXE") or shutil.which("mamba")
+        self.build_timeout = float(os.getenv("ENV_POOL_BUILD_TIMEOUT", "3600"))
+        self._lock = threading.Lock()
+        self._refill_requested = threading.Event()
+        self._worker: Optional[threading.Thread] = None
+        # 创建失败的版本，本进程中不再重试
+        self._failed_versions = set()
+
+    def _pool_envs(self) -> Dict[str, str]:
+        """池中的环境（包括已领取的）：{环境名: 路径}。直接查看 conda 的环境目录，不启动 conda"""
+        envs = {}
+        for envs_dir in self.preflight._envs_dirs():
+            try:
+                names = os.listdir(envs_dir)
+            except OSError:
+                continue
+            for name in names:
+                path = os.path.join(envs_dir, name)
+                if name.startswith(POOL_PREFIX) and name not in envs and os.path.isdir(os.path.join(path, "conda-meta")):
+                    envs[name] = path
+        return envs
+
+    @staticmethod
+    def _read_marker(path: str, marker: str) -> Optional[Dict]:
+        try:
+            with open(os.path.join(path, marker), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def ready_envs(self, envs: Optional[Dict[str, str]] = None) -> Dict[str, List[str]]:
+        """{Python 版本: [可领取的环境名]}，只统计预装包与当前配置一致的环境"""
+        ready: Dict[str, List[str]] = {version: [] for version in self.pythons}
+        for name, path in (envs if envs is not None else self._pool_envs()).items():
+            info = self._read_marker(path, READY_MARKER)
+            if info and info.get("python") in ready and info.get("packages") == self.packages:
+                ready[info["python"]].append(name)
+        return ready
+
+    def _remove_stale(self):
+        """删除创建中断（超过 ENV_POOL_BUILD_TIMEOUT 仍没有标记文件）的环境"""
+        for name, path in self._pool_envs().items():
+            if os.path.exists(os.path.join(path, READY_MARKER)) or os.path.exists(os.path.join(path, CLAIMED_MARKER)):
+                continue
+            try:
+                age = time.time() - os.stat(path).st_mtime
+            except OSError:
+                continue
+            if age > self.build_timeout:
+                console.print(f"[dim][INFO] 删除创建中断的预热环境 {name}[/dim]")
+                subprocess.run([self.conda, "env", "remove", "-n", name, "-y", "--quiet"], capture_output=True)
+
+    def _create(self, version: str) -> bool:
+        name = f"{POOL_PREFIX}py{version}-{uuid.uuid4().hex[:8]}"
+        command = [self.conda, "create", "-n", name, f"python={version}", *BASE_PACKAGES, *self.packages, "-y", "--quiet"]
+        start = time.monotonic()
+        try:
+            result = subprocess.run(command, capture_output=True, text=True, timeout=self.build_timeout)
+        except subprocess.TimeoutExpired:
+            result = None
+        path = self.preflight._find_conda_env(name, os.getcwd())
+        if not result or result.returncode != 0 or not path:
+            error = result.stderr.strip()[-300:] if result else "超时"
+            console.print(f"[WARN] 创建 Python {version} 的预热环境失败: {error}")
+            subprocess.run([self.conda, "env", "remove", "-n", name, "-y", "--quiet"], capture_output=True)
+            return False
+        with open(os.path.join(path, READY_MARKER), "w", encoding="utf-8") as f:
+            json.dump({"python": version, "packages": self.packages, "created_at": time.time()}, f)
+        console.print(f"[dim][INFO] 预热环境 {name} 已就绪（{time.monotonic() - start:.0f}s）[/dim]")
+        return True
+
+    def fill(self):
+        """把每个版本的可领取环境补充到 size 个（同步执行）"""
+        self._remove_stale()
+        for version, names in self.ready_envs().items():
+            for _ in range(self.size - len(names)):
+                if version in self._failed_versions:
+                    break
+                if not self._create(version):
+                    self._failed_versions.add(version)
+
+    def _refill_loop(self, interaction):
+        # 消息通过启动线程时的交互实现输出（无界面模式下不能直接写到标准输出）；
+        # 不沿用调用方的日志通道，补充线程比启动它的会话活得久
+        with use_interaction(interaction):
+            self._refill_forever()
+
+    def _refill_forever(self):
+        while True:
+            self._refill_requested.wait()
+            self._refill_requested.clear()
+            try:
+                self.fill()
+            except Exception as e:
+                console.print(f"[WARN] 补充预热环境时出错: {e}")
+
+    def start(self):
+        """启动后台补充线程，并立即检查一次"""
+        with self._lock:
+            if not self._worker:
+                self._worker = threading.Thread(target=self._refill_loop, args=(get_interaction(),), daemon=True)
+                self._worker.start()
+        self._refill_requested.set()
+
+    def claim(self, python: str) -> Optional[str]:
+        """领取一个指定 Python 版本的环境，返回环境名；池中没有时返回 None。领取后在后台补充"""
+        if python not in self.pythons:
+            return None
+        envs = self._pool_envs()
+        claimed = None
+        for name in self.ready_envs(envs).get(python, []):
+            path = envs[name]
+            try:
+                # 改名是原子操作：多个会话或进程同时领取时只有一方成功
+                os.rename(os.path.join(path, READY_MARKER), os.path.join(path, CLAIMED_MARKER))
+            except OSError:
+                continue
+            claimed = name
+            break
+        if self._worker:
+            self._refill_requested.set()
+        return claimed
+
+    def rename(self, env: str, name: str) -> bool:
+        """把领取的环境改名为计划中的环境名（conda rename，conda 22.11 起支持）；已有同名环境或改名失败时返回 False"""
+        if self.preflight._find_conda_env(name, os.getcwd()):
+            return False
+        try:
+            result = subprocess.run([self.conda, "rename", "-n", env, name], capture_output=True, text=True, timeout=self.build_timeout)
+        except (OSError, subprocess.TimeoutExpired):
+            return False
+        if result.returncode != 0:
+            console.print(f"[dim][INFO] 无法把预热环境 {env} 改名为 {name}，命令中的环境名将被改写: {result.stderr.strip()[-200:]}[/dim]")
+            return False
+        path = self.preflight._find_conda_env(name, os.getcwd())
+        if path:
+            try:
+                os.remove(os.path.join(path, CLAIMED_MARKER))
+            except OSError:
+                pass
+        return True
+
+    def session(self) -> "EnvPoolSession":
+        return EnvPoolSession(self)
+
+
+class EnvPoolSession:
+    """
+    一次安装会话中领取的环境。领取后先用 conda rename 改为计划中的环境名，之后的命令、计划缓存和安装记录都不需要改写；
+    不能改名时（conda 版本过旧等）记录 计划中的环境名 -> 领取的环境名，执行前改写命令中的环境名，
+    执行后把输出中的环境名还原，大模型始终看到计划中的名称。
+    """
+
+    def __init__(self, pool: EnvPool):
+        self.pool = pool
+        self.env_map: Dict[str, str] = {}
+
+    def _rewrite_create(self, segment: str) -> Optional[str]:
+        """用预热环境代替 conda create，返回替换后的段；不能代替时返回 None"""
+        parsed = parse_conda_create(segment)
+        if not parsed:
+            return None
+        name = parsed["name"]
+        # 重新创建同名环境：之前领取的映射失效
+        self.env_map.pop(name, None)
+        env = self.pool.claim(parsed["python"])
+        if not env:
+            return None
+        if self.pool.rename(env, name):
+            console.print(f"[INFO] 使用预热环境作为 conda 环境 {name}（Python {parsed['python']}），跳过创建。")
+            target = name
+        else:
+            self.env_map[name] = env
+            console.print(f"[INFO] 使用预热环境 {env} 作为 conda 环境 {name}（Python {parsed['python']}），跳过创建。")
+            target = env
+        emit("env_pool_claimed", name=name, env=target, python=parsed["python"])
+        extra = [p for p in parsed["packages"] if p not in BASE_PACKAGES and p not in self.pool.packages]
+        if not extra:
+            return f'echo "conda 环境 {name} 已就绪"'
+        channels = "".join(f" -c {shlex.quote(channel)}" for channel in parsed["channels"])
+        return f"{parsed['tool']} install -n {target} -y{channels} {' '.join(shlex.quote(p) for p in extra)}"
+
+    def rename(self, command: str) -> str:
+        """只按已领取的映射改写环境名，不领取新的环境"""
+        return rename_conda_envs(command, self.env_map) if self.env_map else command
+
+    def rewrite(self, command: str) -> str:
+        """执行前改写命令：conda create 尽量由预热环境代替，其余段中的环境名替换为领取的环境"""
+        segments = split_and(command)
+        rewritten = [self._rewrite_create(segment) for segment in segments]
+        if any(rewritten):
+            command = " && ".join(new if new else old.strip() for old, new in zip(segments, rewritten))
+        return self.rename(command)
+
+    def restore(self, text: str) -> str:
+        for name, env in self.env_map.items():
+            text = text.replace(env, name)
+        return text
+
+    def report(self):
+        """会话结束时说明计划中的环境名实际对应的环境"""
+        for name, env in self.env_map.items():
+            console.print(f"[INFO] conda 环境 {name} 使用的是预热环境，请用 conda activate {env} 激活。")
+
+
+def create_env_pool(preflight=None) -> Optional[EnvPool]:
+    """ENV_POOL_SIZE=N（N >= 1）且找到 conda 时启用，启动后台补充线程"""
+    try:
+        size = int(os.getenv("ENV_POOL_SIZE", "0"))
+    except ValueError:
+        size = 0
+    if size < 1:
+        return None
+    pythons = [v.strip() for v in os.getenv("ENV_POOL_PYTHONS", "3.10,3.11").split(",") if v.strip()]
+    packages = os.getenv("ENV_POOL_PACKAGES", "").split()
+    pool = EnvPool(size, pythons, packages, preflight)
+    if not pool.conda:
+        console.print("[WARN] 已设置 ENV_POOL_SIZE，但没有找到 conda，不使用预热环境池。")
+        return None
+    pool.start()
+    return pool
+
+
+def display_status(pool: EnvPool):
+    ready = pool.ready_envs()
+    claimed = [name for name, path in pool._pool_envs().items() if os.path.exists(os.path.join(path, CLAIMED_MARKER))]
+    table = Table(title="预热环境池", style="cyan")
+    table.add_column("Python", style="magenta")
+    table.add_column("可领取", justify="right")
+    table.add_column("目标", justify="right")
+    table.add_column("环境")
+    for version, names in ready.items():
+        table.add_row(version, str(len(names)), str(pool.size), ", ".join(names))
+    console.print(table)
+    console.print(f"[INFO] 已领取的环境 {len(claimed)} 个（归安装的项目使用，不会被自动删除）。")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="预热的 conda 环境池（ENV_POOL_SIZE、ENV_POOL_PYTHONS、ENV_POOL_PACKAGES）")
+    subparsers = parser.add_subparsers(dest="action", required=True)
+    fill_parser = subparsers.add_parser("fill", help="把环境池补充到目标数量（同步执行，可放在定时任务中）")
+    fill_parser.add_argument("--size", type=int, help="每个 Python 版本的环境数（默认 ENV_POOL_SIZE，未设置时为 2）")
+    subparsers.add_parser("status", help="查看环境池")
+    subparsers.add_parser("clear", help="删除所有可领取的环境")
+    args = parser.parse_args()
+
+    size = args.size if getattr(args, "size", None) else int(os.getenv("ENV_POOL_SIZE", "0") or 0) or 2
+    pythons = [v.strip() for v in os.getenv("ENV_POOL_PYTHONS", "3.10,3.11").split(",") if v.strip()]
+    pool = EnvPool(size, pythons, os.getenv("ENV_POOL_PACKAGES", "").split())
+    if not pool.conda:
+        console.print("[ERROR] 没有找到 conda。")
+        return
+    if args.action == "fill":
+        pool.fill()
+        display_status(pool)
+    elif args.action == "status":
+        display_status(pool)
+    elif args.action == "clear":
+        for names in pool.ready_envs().values():
+            for name in names:
+                subprocess.run([pool.conda, "env", "remove", "-n", name, "-y", "--quiet"], capture_output=True)
+                console.print(f"[INFO] 已删除 {name}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,241 @@
+import hashlib
+import json
+import os
+import re
+import shutil
+import subprocess
+import threading
+import time
+from typing import List, Dict, Optional, Tuple
+
+from app_paths import get_data_path
+from interaction import ConsoleProxy
+
+console = ConsoleProxy()
+
+# 认为是"错误行"的关键词，用于从输出中提取指纹
+ERROR_LINE_PATTERN = re.compile(
+    r"error|fatal|exception|traceback|not found|no such file|denied|cannot|can't|could not|couldn't|failed|"
+    r"unable to|no module named|not recognized|invalid|refused|timed out|错误|失败|找不到|拒绝",
+    re.IGNORECASE,
+)
+PATH_PATTERN = re.compile(r"(?:[A-Za-z]:)?(?:[\\/][^\s'\"<>:,()\[\]]+)+")
+HEX_PATTERN = re.compile(r"\b0x[0-9a-fA-F]+\b|\b[0-9a-f]{12,}\b")
+NUMBER_PATTERN = re.compile(r"\d+(?:\.\d+)*")
+MAX_SIGNATURE_LINES = 3
+
+# 学习到的修复命令中用这些标记代替具体的安装目录和失败的命令，便于在其他安装目录复用
+INSTALL_DIR_TOKEN = "@@INSTALL_DIR@@"
+FAILED_COMMAND_TOKEN = "@@FAILED_COMMAND@@"
+
+# 常见的 import 名与 pip 包名不一致的情况
+MODULE_PACKAGE_NAMES = {
+    "cv2": "opencv-python",
+    "PIL": "pillow",
+    "sklearn": "scikit-learn",
+    "skimage": "scikit-image",
+    "yaml": "pyyaml",
+    "bs4": "beautifulsoup4",
+    "dotenv": "python-dotenv",
+    "Crypto": "pycryptodome",
+    "attr": "attrs",
+    "google.protobuf": "protobuf",
+    "jwt": "pyjwt",
+    "serial": "pyserial",
+    "usb": "pyusb",
+    "magic": "python-magic",
+    "fitz": "pymupdf",
+    "docx": "python-docx",
+}
+
+
+def split_prefix(command: str) -> Tuple[str, str]:
+    """将 "cd x && conda activate env && python a.py" 拆成前置命令 "cd x && conda activate env && " 和最后一段"""
+    parts = command.rsplit("&&", 1)
+    if len(parts) == 1:
+        return "", command.strip()
+    return parts[0].rstrip() + " && ", parts[1].strip()
+
+
+def _conda_hook_fix(match, command, stdout, stderr):
+    if os.name == "nt":
+        return [f"call conda activate base && {command}"]
+    return [f'eval "$(conda shell.bash hook)" && {command}']
+
+
+def _missing_module_fix(match, command, stdout, stderr):
+    module = match.group(1)
+    package = MODULE_PACKAGE_NAMES.get(module) or MODULE_PACKAGE_NAMES.get(module.split(".")[0]) or module.split(".")[0]
+    prefix, _ = split_prefix(command)
+    return [f"{prefix}pip install {package}", command]
+
+
+def _detect_cuda_tag() -> str:
+    """读取 nvidia-smi 报告的 CUDA 版本，返回 PyTorch 轮子索引的后缀（如 cu121），没有 GPU 时返回 cpu"""
+    if not shutil.which("nvidia-smi"):
+        return "cpu"
+    try:
+        output = subprocess.run(["nvidia-smi"], capture_output=True, text=True, timeout=5).stdout
+    except (OSError, subprocess.SubprocessError):
+        return "cpu"
+    match = re.search(r"CUDA Version:\s*(\d+)\.(\d+)", output)
+    if not match:
+        return "cpu"
+    major, minor = int(match.group(1)), int(match.group(2))
+    # PyTorch 只为部分 CUDA 版本发布轮子，选择不高于驱动支持版本的最新一个
+    for tag_major, tag_minor in [(12, 4), (12, 1), (11, 8)]:
+        if (major, minor) >= (tag_major, tag_minor):
+            return f"cu{tag_major}{tag_minor}"
+    return "cpu"
+
+
+def _cuda_mismatch_fix(match, command, stdout, stderr):
+    prefix, _ = split_prefix(command)
+    tag = _detect_cuda_tag()
+    return [
+        f"{prefix}pip install --force-reinstall torch torchvision torchaudio --index-url https://download.pytorch.org/whl/{tag}",
+        command,
+    ]
+
+
+def _ssh_clone_fix(match, command, stdout, stderr):
+    fixed = re.sub(r"git@github\.com:([^\s]+?)(?:\.git)?(?=\s|$)", r"https://github.com/\1.git", command)
+    if fixed == command:
+        return []
+    return [fixed]
+
+
+# 内置的常见错误：pattern 在输出中匹配，fix 根据匹配结果和失败的命令生成修复命令
+SEED_RULES = [
+    {
+        "id": "conda-init",
+        "description": "非交互式 shell 中 conda 未初始化",
+        "pattern": re.compile(r"conda init.*before.*conda activate|CondaError: Run 'conda init'|conda activate.*shell.*not.*configured", re.IGNORECASE),
+        "fix": _conda_hook_fix,
+    },
+    {
+        "id": "missing-module",
+        "description": "缺少 Python 模块",
+        "pattern": re.compile(r"No module named ['\"]?([A-Za-z0-9_.]+)['\"]?"),
+        "fix": _missing_module_fix,
+    },
+    {
+        "id": "cuda-mismatch",
+        "description": "PyTorch 与 CUDA 版本不匹配",
+        "pattern": re.compile(
+            r"Torch not compiled with CUDA enabled|no kernel image is available for execution|"
+            r"libcudart\.so\.\d+.*cannot open shared object file|"
+            r"The detected CUDA version \(.*\) mismatches the version that was used to compile PyTorch|"
+            r"CUDA driver version is insufficient for CUDA runtime version",
+            re.IGNORECASE,
+        ),
+        "fix": _cuda_mismatch_fix,
+    },
+    {
+        "id": "ssh-clone",
+        "description": "git@ 克隆地址需要 SSH 密钥，改用 HTTPS",
+        "pattern": re.compile(r"Permission denied \(publickey\)|Host key verification failed", re.IGNORECASE),
+        "fix": _ssh_clone_fix,
+    },
+]
+
+
+def extract_error_lines(text: str) -> List[str]:
+    """提取输出中的关键错误行，没有明显错误行时取最后几行"""
+    lines = [line.strip() for line in text.splitlines() if line.strip()]
+    error_lines = [line for line in lines if ERROR_LINE_PATTERN.search(line)]
+    return (error_lines or lines)[-MAX_SIGNATURE_LINES:]
+
+
+def normalize_line(line: str) -> str:
+    """去掉路径、十六进制、数字等易变部分"""
+    line = PATH_PATTERN.sub("<path>", line)
+    line = HEX_PATTERN.sub("<hex>", line)
+    line = NUMBER_PATTERN.sub("<n>", line)
+    return re.sub(r"\s+", " ", line).strip().lower()
+
+
+def fingerprint(stdout: str, stderr: str) -> Tuple[str, str]:
+    """将命令输出规范化为错误指纹，返回 (签名, 规范化后的关键错误行)"""
+    text = stderr if stderr and stderr.strip() else stdout or ""
+    key = "\n".join(normalize_line(line) for line in extract_error_lines(text))
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()[:16], key
+
+
+class ErrorKnowledgeBase:
+    """本地错误知识库：内置常见错误的修复规则，并从成功的修复中学习，按错误签名索引"""
+
+    def __init__(self, path: str = None):
+        self.path = path or get_data_path("error_kb.json")
+        self.lock = threading.Lock()
+        self.entries: Dict[str, Dict] = self._load()
+
+    def _load(self) -> Dict[str, Dict]:
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save(self):
+        try:
+            with open(self.path, "w", encoding="utf-8") as f:
+                json.dump(self.entries, f, ensure_ascii=False, indent=2)
+        except OSError as e:
+            console.print(f"[WARN] 保存错误知识库失败: {e}")
+
+    def lookup(self, command: str, stdout: str, stderr: str, install_directory: str) -> Optional[Dict]:
+        """
+        查找已知修复。优先使用学习到的、成功率不低于一半的修复，其次是内置规则。
+        返回 {'signature', 'source', 'description', 'commands'}，没有命中返回 None。
+        """
+        signature, key = fingerprint(stdout, stderr)
+        entry = self.entries.get(signature)
+        if entry and entry["successes"] * 2 >= entry["uses"]:
+            commands = [
+                fix.replace(INSTALL_DIR_TOKEN, install_directory).replace(FAILED_COMMAND_TOKEN, command)
+                for fix in entry["fixes"]
+            ]
+            return {"signature": signature, "source": "learned", "description": entry["key"].splitlines()[-1], "commands": commands}
+
+        text = f"{stdout or ''}\n{stderr or ''}"
+        for rule in SEED_RULES:
+            match = rule["pattern"].search(text)
+            if not match:
+                continue
+            commands = rule["fix"](match, command, stdout, stderr)
+            if commands:
+                return {"signature": signature, "source": "seed", "description": rule["description"], "commands": commands}
+        return None
+
+    def learn(self, stdout: str, stderr: str, failed_command: str, fix_commands: List[str], install_directory: str):
+        """记录一次成功的修复：失败输出的签名 -> 修复命令"""
+        signature, key = fingerprint(stdout, stderr)
+        if not key or not fix_commands:
+            return
+        fixes = []
+        for fix in fix_commands:
+            fix = fix.replace(failed_command, FAILED_COMMAND_TOKEN) if failed_command else fix
+            fixes.append(fix.replace(install_directory, INSTALL_DIR_TOKEN) if install_directory else fix)
+        with self.lock:
+            entry = self.entries.get(signature)
+            if entry and entry["fixes"] == fixes:
+                entry["uses"] += 1
+                entry["successes"] += 1
+            else:
+                entry = {"key": key, "fixes": fixes, "uses": 1, "successes": 1}
+            entry["updated"] = time.time()
+            self.entries[signature] = entry
+            self._save()
+
+    def record_outcome(self, signature: str, success: bool):
+        """记录一次直接使用知识库修复的结果"""
+        with self.lock:
+            entry = self.entries.get(signature)
+            if not entry:
+                return
+            entry["uses"] += 1
+            if success:
+                entry["successes"] += 1
+            entry["updated"] = time.time()
+            self._save()
@@ -0,0 +1,152 @@
+import json
+import os
+import re
+import threading
+import time
+from collections import deque
+from typing import List, Dict, Optional
+
+from app_paths import get_data_path
+from command_policy import split_command
+from interaction import ConsoleProxy
+
+console = ConsoleProxy()
+
+# 出现后命令注定失败、但进程往往还会继续清理或重试一段时间的输出
+DEFAULT_FATAL_PATTERNS = [
+    {"name": "pip-no-version", "pattern": r"ERROR: (Could not find a version that satisfies the requirement|No matching distribution found for)", "description": "pip 找不到满足要求的版本"},
+    {"name": "pip-build-failed", "pattern": r"ERROR: Failed building wheel for|error: subprocess-exited-with-error", "description": "pip 构建 wheel 失败",
+     # pip 常常还会回退到 setup.py install 或继续构建其他包，只记录、不提前终止
+     "abort": False},
+    {"name": "pip-resolution-impossible", "pattern": r"ERROR: ResolutionImpossible|ERROR: Cannot install .* because these package versions have conflicting dependencies", "description": "pip 依赖冲突"},
+    {"name": "git-repo-not-found", "pattern": r"fatal: repository '.*' not found|ERROR: Repository not found", "description": "git 仓库不存在或无权访问"},
+    {"name": "git-auth", "pattern": r"Permission denied \(publickey\)|Host key verification failed|fatal: Could not read from remote repository|fatal: Authentication failed", "description": "git 认证失败"},
+    {"name": "conda-packages-not-found", "pattern": r"PackagesNotFoundError|ResolvePackageNotFound|LibMambaUnsatisfiableError|UnsatisfiableError", "description": "conda 找不到包或依赖无法满足"},
+    {"name": "conda-env-not-found", "pattern": r"EnvironmentNameNotFound|Could not find conda environment", "description": "conda 环境不存在"},
+    {"name": "npm-not-found", "pattern": r"npm ERR! (code E404|404 Not Found)|npm ERR! code ERESOLVE", "description": "npm 包不存在或依赖冲突"},
+    # 不包括 "No CUDA runtime is found"：这是 torch.utils.cpp_extension 在只有 CPU 的构建中打印的警告，构建之后仍会成功
+    {"name": "cuda-home", "pattern": r"CUDA_HOME environment variable is not set|nvcc fatal", "description": "缺少 CUDA 编译环境"},
+    {"name": "disk-full", "pattern": r"No space left on device", "description": "磁盘空间不足"},
+]
+
+CONTEXT_BEFORE = 8
+CONTEXT_AFTER = 6
+# 匹配后再等待一小段时间收集后续几行（错误详情通常紧随其后），然后终止
+GRACE_SECONDS = 2.0
+MAX_EXCERPT_CHARS = 1200
+
+
+def get_patterns_path() -> str:
+    return os.getenv("FATAL_PATTERNS_FILE") or get_data_path("fatal_patterns.json")
+
+
+def load_fatal_patterns(path: str = None) -> List[Dict]:
+    """
+    默认规则加上配置文件中的规则；配置文件中与默认规则同名的规则会覆盖默认规则，
+    "enabled": false 可禁用，"abort": false 表示只记录匹配的输出、不提前终止
+    """
+    patterns = {pattern["name"]: dict(pattern) for pattern in DEFAULT_FATAL_PATTERNS}
+    path = path or get_patterns_path()
+    if os.path.exists(path):
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                for pattern in json.load(f):
+                    patterns[pattern["name"]] = dict(patterns.get(pattern["name"], {}), **pattern)
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            console.print(f"[WARN] 读取致命错误规则 {path} 失败，使用默认规则: {e}")
+    result = []
+    for pattern in patterns.values():
+        if not pattern.get("enabled", True) or not pattern.get("pattern"):
+            continue
+        try:
+            re.compile(pattern["pattern"])
+        except re.error as e:
+            console.print(f"[WARN] 致命错误规则 {pattern['name']} 的正则无效，已忽略: {e}")
+            continue
+        result.append(pattern)
+    return result
+
+
+class FatalOutputClassifier:
+    """
+    在输出读取线程中逐行匹配致命错误规则。每条规则单独编译（比合并成一个大的选择分支快数倍，
+    因为大多数规则以固定文本开头，可以使用正则引擎的前缀快速查找）。
+    匹配后收集前后几行作为摘录；需要提前终止时 termination() 返回终止原因。
+    只记录的规则匹配后仍继续匹配需要终止的规则，后者命中时替换之前的匹配。
+    record_only 时所有规则都只记录、不终止。
+    """
+
+    def __init__(self, patterns: List[Dict], record_only: bool = False):
+        if record_only:
+            patterns = [dict(pattern, abort=False) for pattern in patterns]
+        self.patterns = patterns
+        self.regexes = [(pattern, re.compile(pattern["pattern"])) for pattern in patterns]
+        self.lock = threading.Lock()
+        self.context = deque(maxlen=CONTEXT_BEFORE)
+        self.recent = deque(maxlen=CONTEXT_BEFORE)
+        self.match: Optional[Dict] = None
+        self.after: List[str] = []
+        self.matched_at = 0.0
+
+    def feed(self, line: str):
+        """读取线程每收到一行输出调用一次"""
+        if not self.regexes:
+            return
+        with self.lock:
+            if self.match and len(self.after) < CONTEXT_AFTER:
+                self.after.append(line)
+            if not self.match or not self.match.get("abort", True):
+                for pattern, regex in self.regexes:
+                    if self.match and not pattern.get("abort", True):
+                        continue
+                    if regex.search(line):
+                        self.match = dict(pattern, line=line.strip())
+                        self.matched_at = time.monotonic()
+                        self.context = deque(self.recent, maxlen=CONTEXT_BEFORE)
+                        self.after = []
+                        break
+            self.recent.append(line)
+
+    def excerpt(self) -> str:
+        with self.lock:
+            text = "".join(list(self.context) + [self.match["line"] + "\n"] + self.after) if self.match else ""
+        return text[-MAX_EXCERPT_CHARS:].strip()
+
+    def describe(self) -> str:
+        """匹配结果的说明（含输出摘录），没有匹配时返回空字符串"""
+        if not self.match:
+            return ""
+        return f"[致命错误] 输出中检测到{self.match.get('description', self.match['name'])}（规则 {self.match['name']}），相关输出：\n{self.excerpt()}"
+
+    def termination(self) -> Optional[Dict]:
+        """匹配到需要提前终止的规则，且已收集完后续几行或等待超过宽限时间时返回终止原因"""
+        with self.lock:
+            if not self.match or not self.match.get("abort", True):
+                return None
+            if len(self.after) < CONTEXT_AFTER and time.monotonic() - self.matched_at < GRACE_SECONDS:
+                return None
+        return {"reason": "fatal_pattern", "name": self.match["name"], "message": self.describe() + "\n命令已被提前终止。"}
+
+
+_patterns_cache: Dict[str, List[Dict]] = {}
+
+
+def has_fallback(command_str: str) -> bool:
+    """命令中有 cmd1 || fallback：前面的命令失败是预期之内的，不能因为它的输出终止整条命令"""
+    try:
+        return any("||" in operator for operator, _ in split_command(command_str))
+    except ValueError:
+        return "||" in command_str
+
+
+def create_fatal_classifier(command_str: str = None) -> Optional[FatalOutputClassifier]:
+    """
+    FATAL_PATTERNS=0 时关闭；规则文件每个进程只读取一次。
+    command_str 中有 || 时所有规则都只记录，不提前终止。
+    """
+    if os.getenv("FATAL_PATTERNS", "1") == "0":
+        return None
+    path = get_patterns_path()
+    if path not in _patterns_cache:
+        _patterns_cache[path] = load_fatal_patterns(path)
+    return FatalOutputClassifier(_patterns_cache[path], record_only=bool(command_str) and has_fallback(command_str))
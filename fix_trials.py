@@ -0,0 +1,401 @@
+import contextvars
+import os
+import platform
+import queue
+import re
+import shutil
+import subprocess
+import threading
+import time
+import uuid
+from typing import List, Dict, Optional, Tuple
+
+from rich.table import Table
+
+from command_executor import run_command
+from fatal_patterns import create_fatal_classifier
+from output_view import StreamOutputView
+from preflight import PreflightChecker
+from process_watchdog import create_watchdog, describe_termination
+from structured_output import DONE_MARKER, commands_to_response
+from readme_processor import FULL_README_MARKER
+from interaction import ConsoleProxy, ask, emit
+from log_channels import child_channel
+
+console = ConsoleProxy()
+
+# 命令中引用的 conda 环境名：activate 的参数，以及 conda/mamba 命令的 -n/--name 参数
+CONDA_ENV_PATTERNS = [
+    re.compile(r"\b(?:conda|mamba|micromamba|source)\s+activate\s+([A-Za-z0-9_.\-]+)"),
+    re.compile(r"\b(?:conda|mamba|micromamba)\b[^&|;\n]*?\s(?:-n|--name)(?:\s+|=)([A-Za-z0-9_.\-]+)"),
+]
+# 各试验共用、不复制的环境
+SHARED_ENVS = {"base"}
+# 路径分隔符或命令中路径结束的位置
+PATH_END = r"(?=$|[/\\\s'\";&|)])"
+# 等待被取消的试验结束的最长时间（秒）
+CANCEL_JOIN_TIMEOUT = 30.0
+# 安装到 Python 环境中的命令：没有指定（非共用的）conda 环境时会修改各试验共用的当前环境
+ENV_INSTALL = re.compile(
+    r"\b(?:pip3?|uv\s+pip|conda|mamba|micromamba|poetry)\s+(?:install|uninstall|add|remove|update|upgrade)\b"
+    r"|\bpython[\d.]*\s+-m\s+pip\s+(?:install|uninstall)\b|\bsetup\.py\s+(?:install|develop)\b"
+)
+# 查找副本中的虚拟环境时的最大深度和跳过的目录
+VENV_SEARCH_DEPTH = 3
+VENV_SEARCH_SKIP = {".git", "node_modules", "__pycache__"}
+
+
+def get_trial_count() -> int:
+    """FIX_TRIALS=K（K >= 2）时启用并行试验，每次请求 K 个候选修复方案"""
+    try:
+        count = int(os.getenv("FIX_TRIALS", "0"))
+    except ValueError:
+        return 0
+    return count if count >= 2 else 0
+
+
+def conda_env_names(command: str) -> List[str]:
+    names = []
+    for pattern in CONDA_ENV_PATTERNS:
+        for match in pattern.finditer(command):
+            if match.group(1) not in names:
+                names.append(match.group(1))
+    return names
+
+
+def rename_conda_envs(command: str, mapping: Dict[str, str]) -> str:
+    """把命令中引用的 conda 环境名按 mapping 替换"""
+    def replace(match):
+        name = match.group(1)
+        start = match.start(1) - match.start(0)
+        return match.group(0)[:start] + mapping.get(name, name)
+    for pattern in CONDA_ENV_PATTERNS:
+        command = pattern.sub(replace, command)
+    return command
+
+
+def find_venvs(directory: str, depth: int = VENV_SEARCH_DEPTH) -> List[str]:
+    """目录中的虚拟环境（含 pyvenv.cfg 的目录）"""
+    venvs = []
+    root_depth = directory.rstrip(os.sep).count(os.sep)
+    for root, dirs, files in os.walk(directory):
+        if "pyvenv.cfg" in files:
+            venvs.append(root)
+            dirs[:] = []
+            continue
+        if root.count(os.sep) - root_depth >= depth:
+            dirs[:] = []
+        else:
+            dirs[:] = [d for d in dirs if d not in VENV_SEARCH_SKIP]
+    return venvs
+
+
+def _copy_file(src: str, dst: str):
+    """git 对象不会被原地修改，用硬链接代替复制；其他文件复制，避免试验中的修改影响原目录"""
+    if f"{os.sep}.git{os.sep}objects{os.sep}" in src:
+        try:
+            os.link(src, dst)
+            return dst
+        except OSError:
+            pass
+    return shutil.copy2(src, dst)
+
+
+def _reflink_tree(src: str, dst: str) -> bool:
+    """在支持写时复制的文件系统（btrfs、XFS、APFS）上用 cp 克隆目录，几乎不占用时间和空间"""
+    system = platform.system()
+    if system == "Linux":
+        command = ["cp", "-a", "--reflink=always", src, dst]
+    elif system == "Darwin":
+        command = ["cp", "-c", "-R", "-p", src, dst]
+    else:
+        return False
+    try:
+        if subprocess.run(command, capture_output=True).returncode == 0:
+            return True
+    except OSError:
+        pass
+    shutil.rmtree(dst, ignore_errors=True)
+    return False
+
+
+def clone_tree(src: str, dst: str):
+    """复制目录：优先写时复制，否则逐个复制文件（git 对象用硬链接）"""
+    if os.path.isdir(src) and not os.path.islink(src):
+        if not _reflink_tree(src, dst):
+            shutil.copytree(src, dst, symlinks=True, copy_function=_copy_file)
+    else:
+        shutil.copy2(src, dst, follow_symlinks=False)
+
+
+class _CancellableWatchdog:
+    """包装 CommandWatchdog：其他方案已经成功时终止本方案正在执行的命令"""
+
+    def __init__(self, watchdog, cancelled: threading.Event):
+        self.watchdog = watchdog
+        self.cancelled = cancelled
+
+    def output(self):
+        if self.watchdog:
+            self.watchdog.output()
+
+    def check(self, pid: int) -> Optional[Dict]:
+        if self.cancelled.is_set():
+            return {"reason": "cancelled", "message": "[终止] 其他方案已先成功，本方案被取消。"}
+        return self.watchdog.check(pid) if self.watchdog else None
+
+
+class FixTrial:
+    """
+    一个候选方案的试验：在安装目录的副本中执行，引用的 conda 环境替换为本试验专用的克隆，
+    失败时输出中的副本路径和环境名还原为原来的形式，便于发给大模型。
+    """
+
+    def __init__(self, index: int, commands: List[str], install_directory: str, workspace: str):
+        self.index = index
+        self.commands = commands
+        self.install_directory = install_directory
+        self.workspace = workspace
+        self.env_map: Dict[str, str] = {}
+        self.status = "pending"
+        self.completed = 0
+        self.failed_command = None
+        self.stdout = ""
+        self.stderr = ""
+        self.exit_code = None
+        self.duration = 0.0
+        self.path_pattern = re.compile(re.escape(install_directory) + PATH_END)
+
+    def workdir(self, cwd: str) -> str:
+        """命令在副本中的执行目录：安装器的当前目录在安装目录内时对应到副本中的同一位置，否则为副本的根目录"""
+        relative = os.path.relpath(cwd, self.install_directory)
+        if relative == "." or relative.startswith(".."):
+            return self.workspace
+        path = os.path.join(self.workspace, relative)
+        return path if os.path.isdir(path) else self.workspace
+
+    def rewrite(self, command: str) -> str:
+        command = self.path_pattern.sub(lambda m: self.workspace, command)
+        return rename_conda_envs(command, self.env_map)
+
+    def restore(self, text: str) -> str:
+        text = text.replace(self.workspace, self.install_directory)
+        for name, trial_name in self.env_map.items():
+            text = text.replace(trial_name, name)
+        return text
+
+
+class FixTrialRunner:
+    """
+    并行试验多个候选修复方案：每个方案在安装目录的副本（只复制命令引用到的顶层条目和项目目录）中执行，
+    引用的已有 conda 环境克隆一份（base 环境共用），最先全部成功的方案胜出，其余方案被终止。
+    副本和克隆的环境在后台清理；胜出方案随后由调用方在真实的安装目录中执行，
+    因为可编辑安装、环境中的脚本等会记录副本的路径，不能直接把副本搬回来。
+    """
+
+    def __init__(self, install_directory: str, repo_name: str, policy=None, preflight=None, recorder=None):
+        self.install_directory = os.path.abspath(install_directory).rstrip("/\\")
+        self.repo_name = repo_name
+        self.policy = policy
+        self.preflight = preflight or PreflightChecker()
+        self.recorder = recorder
+        self.conda = shutil.which("conda") or os.getenv("CONDA_EXE") or shutil.which("mamba")
+        self.cancelled = threading.Event()
+
+    def _workspace_entries(self, candidates: List[List[str]]) -> List[str]:
+        """需要复制到副本中的顶层条目：项目目录以及命令中以安装目录开头的路径"""
+        entries = [self.repo_name]
+        pattern = re.compile(re.escape(self.install_directory) + r"[/\\]([^/\\\s'\";&|)]+)")
+        for command in (c for candidate in candidates for c in candidate):
+            for match in pattern.finditer(command):
+                if match.group(1) not in entries:
+                    entries.append(match.group(1))
+        return [entry for entry in entries if os.path.lexists(os.path.join(self.install_directory, entry))]
+
+    def isolation_problem(self, candidates: List[List[str]]) -> Optional[str]:
+        """
+        无法保证各试验互相隔离、不修改真实环境时返回原因：
+        副本中有虚拟环境（复制后脚本的 shebang 和 activate 仍指向原环境），
+        或方案在没有指定 conda 环境（或指定了共用的 base）的情况下安装包（会修改当前环境）
+        """
+        for entry in self._workspace_entries(candidates):
+            path = os.path.join(self.install_directory, entry)
+            venvs = find_venvs(path) if os.path.isdir(path) and not os.path.islink(path) else []
+            if venvs:
+                return f"安装目录中有虚拟环境 {venvs[0]}，副本中的脚本仍会修改原环境"
+        for command in (c for candidate in candidates for c in candidate):
+            if ENV_INSTALL.search(command) and not set(conda_env_names(command)) - SHARED_ENVS:
+                return f"命令 `{command}` 会安装到当前的 Python 环境，各方案无法隔离"
+        return None
+
+    def _prepare(self, trial: FixTrial, entries: List[str], existing_envs: Dict[str, str]):
+        """复制工作区并克隆方案中引用的已有 conda 环境；方案中新建的环境只改名"""
+        os.makedirs(trial.workspace)
+        for entry in entries:
+            clone_tree(os.path.join(self.install_directory, entry), os.path.join(trial.workspace, entry))
+        for name in {n for command in trial.commands for n in conda_env_names(command)} - SHARED_ENVS:
+            trial_name = f"{name}-trial{trial.index}"
+            if name in existing_envs and self.conda:
+                result = subprocess.run([self.conda, "create", "--clone", name, "-n", trial_name, "-y", "--quiet"], capture_output=True, text=True)
+                if result.returncode != 0:
+                    raise RuntimeError(f"克隆 conda 环境 {name} 失败: {result.stderr.strip()[-500:]}")
+            trial.env_map[name] = trial_name
+
+    def _run_trial(self, trial: FixTrial, entries: List[str], existing_envs: Dict[str, str], results: queue.Queue):
+        # 每个方案一个日志通道：并行的方案的消息和输出带上前缀显示在终端，并写入会话日志
+        with child_channel(f"方案{trial.index}", echo_output=True):
+            self._run_trial_commands(trial, entries, existing_envs, results)
+
+    def _run_trial_commands(self, trial: FixTrial, entries: List[str], existing_envs: Dict[str, str], results: queue.Queue):
+        start = time.monotonic()
+        try:
+            self._prepare(trial, entries, existing_envs)
+            trial.status = "running"
+            for command in trial.commands:
+                if self.cancelled.is_set():
+                    trial.status = "cancelled"
+                    break
+                if self.policy:
+                    action, reason = self.policy.evaluate(command)
+                    if action == "deny":
+                        trial.status, trial.failed_command = "failed", command
+                        trial.stderr = f"命令被安全策略拒绝，未执行（{reason}）。"
+                        break
+                trial_command = trial.rewrite(command)
+                console.print(f"[dim][TRIAL {trial.index}] {command}[/dim]")
+                emit("command_started", command=command, trial=trial.index)
+                started_at = time.time()
+                command_start = time.monotonic()
+                # 会话记录和学习到的超时都使用原来的命令，不包含副本目录和克隆环境的名字
+                watchdog = _CancellableWatchdog(create_watchdog(command, self.recorder.store if self.recorder else None), self.cancelled)
+                view = StreamOutputView(trial_command, lambda line, stream: None)
+                stdout, stderr, returncode, termination = run_command(trial_command, view=view, watchdog=watchdog, classifier=create_fatal_classifier(trial_command),
+                                                                      interactive=False, cwd=trial.workdir(os.getcwd()))
+                if termination:
+                    stderr = f"{stderr.rstrip()}\n{describe_termination(termination)}".lstrip()
+                command_duration = time.monotonic() - command_start
+                if self.recorder and not (termination and termination["reason"] == "cancelled"):
+                    self.recorder.record_command(command, started_at, command_duration, returncode, trial.restore(stdout), trial.restore(stderr))
+                emit("command_finished", command=command, trial=trial.index, exit_code=returncode, success=returncode == 0, duration=round(command_duration, 3))
+                if termination and termination["reason"] == "cancelled":
+                    trial.status = "cancelled"
+                    break
+                if returncode != 0:
+                    trial.status, trial.failed_command, trial.exit_code = "failed", command, returncode
+                    trial.stdout, trial.stderr = trial.restore(stdout), trial.restore(stderr)
+                    break
+                trial.completed += 1
+            else:
+                trial.status = "succeeded"
+        except Exception as e:
+            trial.status, trial.stderr = "failed", f"准备试验环境时出错: {e}"
+            trial.failed_command = trial.failed_command or (trial.commands[0] if trial.commands else "")
+        trial.duration = time.monotonic() - start
+        results.put(trial)
+
+    def _cleanup(self, trials: List[FixTrial]):
+        """删除副本和克隆的环境（后台执行，不阻塞安装流程）"""
+        for trial in trials:
+            shutil.rmtree(trial.workspace, ignore_errors=True)
+            if self.conda:
+                for trial_name in trial.env_map.values():
+                    subprocess.run([self.conda, "env", "remove", "-n", trial_name, "-y", "--quiet"], capture_output=True)
+
+    def run(self, candidates: List[List[str]]) -> Tuple[Optional[FixTrial], List[FixTrial]]:
+        """同时试验所有方案，返回 (胜出的方案, 全部试验)；没有方案成功时胜出方案为 None"""
+        tag = uuid.uuid4().hex[:8]
+        parent = os.path.dirname(self.install_directory)
+        base = os.path.basename(self.install_directory)
+        trials = []
+        for index, candidate in enumerate(candidates, 1):
+            commands = [c for c in candidate if c.upper() not in (DONE_MARKER, FULL_README_MARKER)]
+            # 副本放在安装目录旁边，与原目录在同一个文件系统上，写时复制才能生效
+            trials.append(FixTrial(index, commands, self.install_directory, os.path.join(parent, f".{base}-trial-{tag}-{index}")))
+        entries = self._workspace_entries(candidates)
+        existing_envs = self.preflight.conda_envs() or {}
+        console.print(f"[INFO] 在 {len(trials)} 个副本中并行试验候选方案（复制: {', '.join(entries) or '无'}）...")
+
+        results: queue.Queue = queue.Queue()
+        threads = []
+        for trial in trials:
+            # 在调用方的上下文中执行，试验的输出与调用方写到同一个控制台
+            thread = threading.Thread(target=contextvars.copy_context().run, args=(self._run_trial, trial, entries, existing_envs, results), daemon=True)
+            thread.start()
+            threads.append(thread)
+
+        winner = None
+        for _ in trials:
+            trial = results.get()
+            console.print(f"[INFO] 方案 {trial.index}: {trial.status}（{trial.duration:.1f}s）")
+            if trial.status == "succeeded":
+                winner = trial
+                self.cancelled.set()
+                break
+        deadline = time.monotonic() + CANCEL_JOIN_TIMEOUT
+        for thread in threads:
+            thread.join(timeout=max(0.0, deadline - time.monotonic()))
+        threading.Thread(target=self._cleanup, args=(trials,)).start()
+        _display_trials(trials)
+        emit("fix_trials_finished", winner=winner.index if winner else None,
+             trials=[{"index": t.index, "status": t.status, "duration": round(t.duration, 3), "failed_command": t.failed_command} for t in trials])
+        return winner, trials
+
+
+def _display_trials(trials: List[FixTrial]):
+    table = Table(title="候选方案试验结果", style="cyan")
+    table.add_column("方案", justify="right")
+    table.add_column("状态", style="magenta")
+    table.add_column("完成命令", justify="right")
+    table.add_column("用时(s)", justify="right")
+    table.add_column("失败的命令", overflow="fold", max_width=60)
+    for trial in trials:
+        table.add_row(str(trial.index), trial.status, f"{trial.completed}/{len(trial.commands)}", f"{trial.duration:.1f}", trial.failed_command or "")
+    console.print(table)
+
+
+def _summarize_failures(trials: List[FixTrial]) -> str:
+    lines = [f"并行试验的 {len(trials)} 个方案都失败了（试验在副本中进行，安装目录仍是试验前的状态）："]
+    for trial in trials:
+        error = (trial.stderr or trial.stdout or "").strip().splitlines()
+        lines.append(f"方案 {trial.index} 在 `{trial.failed_command}` 失败: {error[-1][:300] if error else '无输出'}")
+    lines.append("请换一种思路给出修复命令。")
+    return "\n".join(lines)
+
+
+def run_fix_trials(llm_provider, message_history: List[Dict], failed_command: str, stdout: str, stderr: str, exit_code: Optional[int],
+                   count: int, install_directory: str, repo_name: str, policy=None, preflight=None, recorder=None,
+                   env_session=None) -> Tuple[List[str], List[Dict]]:
+    """
+    命令失败时的并行试验模式：一次请求 count 个修复方案，在隔离的副本中同时试验。
+    返回 (要在安装目录中执行的命令, 消息历史)：有方案成功时为该方案；用户不同意试验或无法保证隔离时为第一个方案；
+    全部失败时把各方案的失败原因反馈给大模型，返回新的修复命令。
+    env_session 为 env_pool.EnvPoolSession，设置后试验中的环境名按会话领取的预热环境改写。
+    """
+    candidates, message_history = llm_provider.generate_candidate_fixes(message_history, failed_command, stdout, stderr, count, exit_code)
+    if len(candidates) < 2:
+        return (candidates[0] if candidates else []), message_history
+
+    runner = FixTrialRunner(install_directory, repo_name, policy, preflight, recorder)
+    trial_candidates = [[env_session.rename(c) for c in candidate] for candidate in candidates] if env_session else candidates
+    problem = runner.isolation_problem(trial_candidates)
+    if problem:
+        console.print(f"\n[INFO] 大模型给出了 {len(candidates)} 个候选方案，但不能并行试验（{problem}），直接执行方案 1。")
+        chosen = candidates[0]
+    else:
+        console.print(f"\n[INFO] 大模型给出了 {len(candidates)} 个候选方案，是否在安装目录的副本中并行试验？")
+        console.print("[dim]试验中需要确认的命令视为已批准，被安全策略拒绝的命令不会执行。[/dim]")
+        console.print("[bold green]请选择操作：[/bold green][yellow](y)[/yellow] 并行试验  [yellow](n)[/yellow] 直接执行方案 1")
+        chosen = candidates[0]
+        if ask("fix_trials", "请输入 (y/n): ", candidates=candidates).strip().lower() == "y":
+            restore = env_session.restore if env_session else (lambda text: text)
+            winner, trials = runner.run(trial_candidates)
+            if not winner:
+                best = max(trials, key=lambda t: t.completed)
+                console.print("\n[INFO] 所有候选方案都失败了，将失败原因反馈给大模型...")
+                return llm_provider.generate_next_commands(message_history, restore(best.failed_command), restore(best.stdout), restore(best.stderr),
+                                                           restore(_summarize_failures(trials)), best.exit_code)
+            console.print(f"\n[INFO] 方案 {winner.index} 在副本中成功（{winner.duration:.1f}s），在安装目录中执行该方案。")
+            chosen = candidates[winner.index - 1]
+    # 消息历史中只保留采用的方案，之后的对话与普通的修复轮次一致
+    message_history[-1]["content"] = commands_to_response(chosen) if llm_provider.structured_output else "\n".join(chosen)
+    return chosen, message_history
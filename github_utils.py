@@ -1,8 +1,11 @@
+import os
 import re
 import requests
-from rich.console import Console
 
-console = Console()
+from doc_index import is_doc_path
+from interaction import ConsoleProxy
+
+console = ConsoleProxy()
 
 def get_github_readme_content(github_url):
     """
@@ -26,7 +29,7 @@ def get_github_readme_content(github_url):
 
     for branch in branches_to_try:
         for filename in readme_filenames:
-            raw_url = f"https://raw.githubusercontent.com/{owner}/{repo_cleaned}/{branch}/{filename}"
+            raw_url = f"{_github_raw_url()}/{owner}/{repo_cleaned}/{branch}/{filename}"
             try:
                 response = requests.get(raw_url, timeout=10)
                 response.raise_for_status()
@@ -49,3 +52,68 @@ def get_github_readme_content(github_url):
         console.print("请检查链接、项目结构或主分支名（尝试了 master/main）。")
         
     return owner, repo_cleaned, content
+
+
+def _github_api_url():
+    """GitHub API 地址（GitHub Enterprise、镜像或压测用的模拟服务可替换）。调用时读取，.env 中的设置也能生效"""
+    return os.getenv("GITHUB_API_URL", "https://api.github.com").rstrip("/")
+
+
+def _github_raw_url():
+    """GitHub 原始文件地址，调用时读取 GITHUB_RAW_URL"""
+    return os.getenv("GITHUB_RAW_URL", "https://raw.githubusercontent.com").rstrip("/")
+
+
+def _github_api_headers():
+    """GitHub API 请求头，设置了 GITHUB_TOKEN 时带上认证以提高速率限制"""
+    headers = {"Accept": "application/vnd.github+json"}
+    token = os.getenv("GITHUB_TOKEN")
+    if token:
+        headers["Authorization"] = f"Bearer {token}"
+    return headers
+
+
+def fetch_repo_docs(owner, repo, max_files=40):
+    """
+    通过 GitHub API 获取仓库的文件树，下载其中的文档文件（项目尚未克隆时使用）。
+    返回 {路径: 内容}。
+    """
+    files = {}
+    try:
+        response = requests.get(f"{_github_api_url()}/repos/{owner}/{repo}", headers=_github_api_headers(), timeout=10)
+        response.raise_for_status()
+        branch = response.json().get("default_branch", "main")
+        response = requests.get(
+            f"{_github_api_url()}/repos/{owner}/{repo}/git/trees/{branch}?recursive=1",
+            headers=_github_api_headers(), timeout=15,
+        )
+        response.raise_for_status()
+        paths = [item["path"] for item in response.json().get("tree", []) if item.get("type") == "blob" and is_doc_path(item["path"])]
+    except (requests.exceptions.RequestException, ValueError) as e:
+        console.print(f"[WARN] 获取仓库文档列表失败: {e}")
+        return files
+
+    for path in paths[:max_files]:
+        raw_url = f"{_github_raw_url()}/{owner}/{repo}/{branch}/{path}"
+        try:
+            response = requests.get(raw_url, timeout=10)
+            response.raise_for_status()
+            files[path] = response.text
+        except requests.exceptions.RequestException as e:
+            console.print(f"[WARN] 下载文档 {path} 失败: {e}")
+    console.print(f"[INFO] 从 GitHub 获取了 {len(files)} 个文档文件。")
+    return files
+
+
+def get_github_commit_sha(owner, repo):
+    """获取仓库默认分支最新提交的 SHA，失败返回 None"""
+    try:
+        headers = _github_api_headers()
+        headers["Accept"] = "application/vnd.github.sha"
+        response = requests.get(f"{_github_api_url()}/repos/{owner}/{repo}/commits/HEAD", headers=headers, timeout=10)
+        response.raise_for_status()
+        sha = response.text.strip()
+        return sha if re.fullmatch(r"[0-9a-f]{40}", sha) else None
+    except requests.exceptions.RequestException as e:
+        console.print(f"[WARN] 获取最新提交失败: {e}")
+        return None
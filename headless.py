@@ -0,0 +1,151 @@
+import json
+import os
+import sys
+import threading
+import time
+from typing import List, Tuple
+
+from rich.errors import MarkupError
+from rich.markup import render
+
+from interaction import Interaction
+from output_view import StreamOutputView
+
+# 命令输出合并成 command_output 事件的时间间隔（秒）和单个事件的最大字符数
+OUTPUT_CHUNK_INTERVAL = 0.2
+OUTPUT_CHUNK_MAX_CHARS = 64 * 1024
+
+
+class NullConsole:
+    """不渲染任何内容的控制台；[WARN] / [ERROR] 消息转换为 log 事件"""
+
+    def __init__(self, interaction: "JsonLinesInteraction"):
+        self.interaction = interaction
+
+    def print(self, *objects, **kwargs):
+        if len(objects) != 1 or not isinstance(objects[0], str):
+            return
+        text = objects[0]
+        for level in ("ERROR", "WARN"):
+            if f"[{level}]" in text:
+                try:
+                    text = render(text).plain
+                except MarkupError:
+                    pass
+                self.interaction.emit("log", level=level.lower(), message=text.strip())
+                return
+
+    def __getattr__(self, name):
+        # rule() 等其他输出方法都不做任何事
+        return lambda *args, **kwargs: None
+
+
+class JsonLinesOutputView(StreamOutputView):
+    """命令输出按固定间隔合并成 command_output 事件（同一流的连续行合并为一个事件），完整输出仍写入日志文件"""
+
+    def __init__(self, command: str, interaction: "JsonLinesInteraction"):
+        super().__init__(command, self._buffer)
+        self.interaction = interaction
+        self.interval = float(os.getenv("HEADLESS_OUTPUT_INTERVAL", OUTPUT_CHUNK_INTERVAL))
+        self.pending: List[Tuple[str, str]] = []
+        self.pending_chars = 0
+        self.pending_lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.flusher = None
+
+    def _buffer(self, line: str, stream: str):
+        with self.pending_lock:
+            self.pending.append((stream, line))
+            self.pending_chars += len(line)
+            full = self.pending_chars >= OUTPUT_CHUNK_MAX_CHARS
+        if full:
+            self._flush()
+
+    def _flush(self):
+        with self.pending_lock:
+            pending, self.pending, self.pending_chars = self.pending, [], 0
+        chunk_stream, chunk = None, []
+        for stream, line in pending + [(None, "")]:
+            if stream != chunk_stream and chunk:
+                self.interaction.emit("command_output", command=self.command, stream=chunk_stream, text="".join(chunk))
+                chunk = []
+            chunk_stream = stream
+            chunk.append(line)
+
+    def _run_flusher(self):
+        while not self.stopped.wait(self.interval):
+            self._flush()
+
+    def __enter__(self):
+        super().__enter__()
+        self.flusher = threading.Thread(target=self._run_flusher, daemon=True)
+        self.flusher.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stopped.set()
+        self.flusher.join()
+        self._flush()
+        return super().__exit__(exc_type, exc, tb)
+
+
+class JsonLinesInteraction(Interaction):
+    """
+    无界面模式：不使用 rich 渲染，会话事件以 JSON 行写到标准输出，形如 {"event": "command_started", "time": ..., ...}。
+    需要决定时写出 {"event": "input_needed", "id": N, "key": ..., "prompt": ..., ...}，
+    然后从标准输入读取一行 {"id": N, "value": "..."}（id 可省略）作为回答；格式不对时写出 protocol_error 事件并继续等待。
+    """
+
+    terminal = False
+
+    def __init__(self, stdin=None, stdout=None):
+        super().__init__(NullConsole(self))
+        self.stdin = stdin or sys.stdin
+        self.stdout = stdout or sys.stdout
+        self.lock = threading.Lock()
+        self.secrets: List[str] = []
+        self.request_id = 0
+
+    def emit(self, event: str, **data):
+        line = json.dumps({"event": event, "time": round(time.time(), 3), **data}, ensure_ascii=False, default=str)
+        for secret in self.secrets:
+            line = line.replace(secret, "******")
+        with self.lock:
+            self.stdout.write(line + "\n")
+            self.stdout.flush()
+
+    def ask(self, key: str, prompt: str, **context) -> str:
+        self.request_id += 1
+        request_id = self.request_id
+        self.emit("input_needed", id=request_id, key=key, prompt=prompt, **context)
+        while True:
+            line = self.stdin.readline()
+            if not line:
+                raise EOFError("标准输入已关闭，无法继续回答询问")
+            if not line.strip():
+                continue
+            try:
+                decision = json.loads(line)
+            except ValueError as e:
+                self.emit("protocol_error", id=request_id, message=f"不是合法的 JSON: {e}")
+                continue
+            if not isinstance(decision, dict) or "value" not in decision:
+                self.emit("protocol_error", id=request_id, message='回答必须是包含 "value" 的 JSON 对象')
+                continue
+            if decision.get("id", request_id) != request_id:
+                self.emit("protocol_error", id=request_id, message=f"回答的 id {decision['id']} 与当前询问 {request_id} 不匹配")
+                continue
+            return str(decision["value"])
+
+    def add_secret(self, value: str):
+        # 按 JSON 转义后的形式匹配，事件中的值已经过转义
+        escaped = json.dumps(value, ensure_ascii=False)[1:-1]
+        if escaped and escaped not in self.secrets:
+            self.secrets.append(escaped)
+
+    def output_view(self, command: str):
+        return JsonLinesOutputView(command, self)
+
+    def session_log(self, label: str):
+        # 事件流本身就是会话的记录，[WARN] / [ERROR] 消息需要经过 NullConsole 转换为 log 事件，不使用日志通道
+        return None
@@ -0,0 +1,202 @@
+import fnmatch
+import json
+import os
+import re
+import subprocess
+import threading
+import time
+from typing import List, Dict, Optional, Tuple
+
+from rich.table import Table
+
+from app_paths import get_data_path
+from command_executor import execute_command_interactive
+from command_policy import load_policy
+from fix_trials import rename_conda_envs
+from placeholders import extract_placeholders, fill_placeholders, resolve_placeholders
+from session_store import SessionStore
+from interaction import ConsoleProxy, ask
+
+console = ConsoleProxy()
+
+NATIVE_SOURCES = ["*.c", "*.cc", "*.cpp", "*.cxx", "*.cu", "*.h", "*.hpp", "*.pyx", "*.pxd"]
+
+# (命令中最后一段的正则, 触发重新执行的文件模式)；模式为 None 表示用正则捕获的文件路径
+STEP_TRIGGERS = [
+    (re.compile(r"\bpip3?\s+install\b.*?(?:-r|--requirement)\s+(\S+)"), None),
+    (re.compile(r"\b(?:conda|mamba)\s+env\s+(?:create|update)\b.*?(?:-f|--file)\s+(\S+)"), None),
+    (re.compile(r"\bpip3?\s+install\b.*?(?:-e|--editable)?\s+\.(?:\[[^\]]*\])?(?:\s|$)"), ["setup.py", "setup.cfg", "pyproject.toml", "MANIFEST.in"] + NATIVE_SOURCES),
+    (re.compile(r"\bpython3?\s+setup\.py\s+(?:install|develop|build\w*)"), ["setup.py", "setup.cfg", "pyproject.toml"] + NATIVE_SOURCES),
+    (re.compile(r"\bpoetry\s+install\b"), ["pyproject.toml", "poetry.lock"]),
+    (re.compile(r"\buv\s+sync\b"), ["pyproject.toml", "uv.lock"]),
+    (re.compile(r"\b(?:npm\s+(?:install|ci|i)|yarn(?:\s+install)?|pnpm\s+install)\b"), ["package.json", "package-lock.json", "yarn.lock", "pnpm-lock.yaml"]),
+    (re.compile(r"\bcargo\s+(?:build|install)\b"), ["Cargo.toml", "Cargo.lock", "*.rs"]),
+    (re.compile(r"\bgo\s+(?:build|install|mod\s+download)\b"), ["go.mod", "go.sum", "*.go"]),
+    (re.compile(r"\b(?:cmake|make|ninja)\b"), ["CMakeLists.txt", "*.cmake", "Makefile", "*.mk"] + NATIVE_SOURCES),
+]
+
+
+def last_segment(command: str) -> str:
+    """取 && 连接的命令中真正执行操作的最后一段"""
+    return command.rsplit("&&", 1)[-1].strip()
+
+
+def rerun_command(command: str) -> str:
+    """调整需要重新执行的命令：环境已存在，conda env create 改为 conda env update"""
+    return re.sub(r"\b(conda|mamba)\s+env\s+create\b", r"\1 env update", command)
+
+
+def git_head(clone_directory: str) -> Optional[str]:
+    try:
+        result = subprocess.run(["git", "-C", clone_directory, "rev-parse", "HEAD"], capture_output=True, text=True, timeout=10)
+    except (OSError, subprocess.SubprocessError):
+        return None
+    return result.stdout.strip() if result.returncode == 0 else None
+
+
+def changed_files(clone_directory: str, old_sha: str, new_sha: str) -> List[str]:
+    result = subprocess.run(["git", "-C", clone_directory, "diff", "--name-only", old_sha, new_sha], capture_output=True, text=True, timeout=30)
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip() or "git diff 失败")
+    return [line.strip() for line in result.stdout.splitlines() if line.strip()]
+
+
+def _matches(changed_file: str, pattern: str) -> bool:
+    """文件模式匹配：带路径的模式按路径后缀匹配，否则按文件名匹配"""
+    changed_file = changed_file.replace("\\", "/")
+    pattern = pattern.replace("\\", "/").strip("'\"")
+    if pattern.startswith("./"):
+        pattern = pattern[2:]
+    if "/" in pattern:
+        return changed_file == pattern or changed_file.endswith("/" + pattern)
+    return fnmatch.fnmatch(os.path.basename(changed_file), pattern)
+
+
+def affected_steps(commands: List[str], changed: List[str]) -> List[Tuple[int, str, List[str]]]:
+    """返回受改动影响需要重新执行的步骤 [(下标, 命令, 触发的文件)]"""
+    steps = []
+    for index, command in enumerate(commands):
+        segment = last_segment(command)
+        for pattern, file_patterns in STEP_TRIGGERS:
+            match = pattern.search(segment)
+            if not match:
+                continue
+            patterns = file_patterns if file_patterns is not None else [match.group(1)]
+            triggers = [f for f in changed if any(_matches(f, p) for p in patterns)]
+            if triggers:
+                steps.append((index, command, triggers))
+            break
+    return steps
+
+
+class InstallRegistry:
+    """记录每个本地克隆目录最近一次成功安装的提交和命令序列"""
+
+    def __init__(self, path: str = None):
+        self.path = path or get_data_path("installs.json")
+        self.lock = threading.Lock()
+        self.installs: Dict[str, Dict] = self._load()
+
+    def _load(self) -> Dict[str, Dict]:
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save(self):
+        try:
+            with open(self.path, "w", encoding="utf-8") as f:
+                json.dump(self.installs, f, ensure_ascii=False, indent=2)
+        except OSError as e:
+            console.print(f"[WARN] 保存安装记录失败: {e}")
+
+    def get(self, clone_directory: str) -> Optional[Dict]:
+        return self.installs.get(os.path.abspath(clone_directory))
+
+    def record(self, clone_directory: str, owner: str, repo_name: str, commit_sha: str, install_directory: str, commands: List[str],
+               env_map: Optional[Dict[str, str]] = None):
+        """
+        记录一次成功安装；commands 为占位符替换前的命令。
+        env_map 为命令中的 conda 环境名实际对应的环境（env_pool 中无法改名的预热环境），重新执行时按它改写。
+        """
+        with self.lock:
+            self.installs[os.path.abspath(clone_directory)] = {
+                "owner": owner,
+                "repo": repo_name,
+                "commit": commit_sha,
+                "install_directory": install_directory,
+                "commands": commands,
+                "env_map": env_map or {},
+                "updated": time.time(),
+            }
+            self._save()
+
+
+def run_update(clone_directory: str, execute=execute_command_interactive) -> bool:
+    """
+    增量更新：对比上次安装的提交和当前检出的提交，只重新执行受依赖文件/构建配置改动影响的步骤。
+    返回是否成功完成。
+    """
+    registry = InstallRegistry()
+    record = registry.get(clone_directory)
+    if not record:
+        console.print(f"[ERROR] 没有找到 {clone_directory} 的安装记录，请先完整安装一次。")
+        return False
+
+    new_sha = git_head(clone_directory)
+    if not new_sha:
+        console.print(f"[ERROR] 无法读取 {clone_directory} 的当前提交。")
+        return False
+    if new_sha == record["commit"]:
+        console.print("[INFO] 当前检出的提交与上次安装时相同。")
+        if ask("git_pull", "是否执行 git pull 获取更新？(y/n): ").strip().lower() != 'y':
+            return True
+        subprocess.run(["git", "-C", clone_directory, "pull", "--ff-only"])
+        new_sha = git_head(clone_directory)
+        if new_sha == record["commit"]:
+            console.print("[INFO] 没有新的提交，无需更新。")
+            return True
+
+    try:
+        changed = changed_files(clone_directory, record["commit"], new_sha)
+    except (RuntimeError, OSError, subprocess.SubprocessError) as e:
+        console.print(f"[ERROR] 无法比较提交 {record['commit'][:7]}..{new_sha[:7]}: {e}")
+        return False
+
+    steps = affected_steps(record["commands"], changed)
+    console.print(f"[INFO] {record['owner']}/{record['repo']}: {record['commit'][:7]} → {new_sha[:7]}，改动了 {len(changed)} 个文件。")
+    if not steps:
+        console.print("[INFO] 依赖文件和构建配置没有变化，无需重新执行任何步骤。")
+        registry.record(clone_directory, record["owner"], record["repo"], new_sha, record["install_directory"], record["commands"], record.get("env_map"))
+        return True
+
+    table = Table(title="需要重新执行的步骤", style="cyan", show_lines=True)
+    table.add_column("步骤", justify="right")
+    table.add_column("命令", style="magenta", overflow="fold", max_width=80)
+    table.add_column("触发文件", overflow="fold")
+    for index, command, triggers in steps:
+        table.add_row(str(index + 1), command, "\n".join(triggers[:5]) + ("\n..." if len(triggers) > 5 else ""))
+    console.print(table)
+
+    recorder = SessionStore().start_session(record["owner"], record["repo"], new_sha, "update", "-", record["install_directory"])
+    # 与完整安装相同，占位符需要重新提供；在执行前一次性解析
+    placeholder_values = resolve_placeholders(extract_placeholders([command for _, command, _ in steps]), f"{record['owner']}/{record['repo']}")
+    for value in placeholder_values.values():
+        recorder.add_secret(value)
+    policy = load_policy(record["install_directory"])
+    for index, command, _ in steps:
+        command = fill_placeholders(rename_conda_envs(rerun_command(command), record.get("env_map") or {}), placeholder_values)
+        stdout, stderr, success, quit_script, exit_code = execute(command, recorder, policy)
+        if quit_script:
+            recorder.end_session("aborted")
+            return False
+        if not success:
+            console.print(f"[ERROR] 步骤 {index + 1} 执行失败，安装记录保持在 {record['commit'][:7]}。可以重新运行完整安装让大模型处理。")
+            recorder.end_session("failed")
+            return False
+
+    registry.record(clone_directory, record["owner"], record["repo"], new_sha, record["install_directory"], record["commands"], record.get("env_map"))
+    recorder.end_session("success")
+    console.print(f"[INFO] 增量更新完成，安装记录已更新到 {new_sha[:7]}。")
+    return True
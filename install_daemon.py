@@ -0,0 +1,570 @@
+import argparse
+import io
+import json
+import os
+import queue
+import secrets
+import sys
+import threading
+import time
+import traceback
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urlparse, parse_qs
+
+from rich.console import Console
+from rich.markup import escape
+
+from app_paths import get_data_path
+from config import load_environment_variables, get_available_apis, MULTI_PROVIDER
+from llm_providers import LLMProvider, create_llm_provider, create_multi_provider
+from install_session import SharedResources, run_install_session
+from interaction import ConsoleProxy, Interaction, get_interaction, use_interaction
+from log_channels import TerminalSink, get_channel, open_session_log
+from output_view import StreamOutputView
+
+console = ConsoleProxy()
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+# 需要用户确认的命令（策略结果为 ask）的自动处理方式
+ON_ASK_ANSWERS = {"approve": "y", "skip": "n", "abort": "q"}
+FINISHED_STATES = ("success", "failed", "aborted", "incomplete", "error", "cancelled")
+
+
+def get_token_path() -> str:
+    return os.getenv("INSTALLER_DAEMON_TOKEN_FILE") or get_data_path("daemon_token")
+
+
+def create_daemon_token() -> str:
+    """
+    服务的访问令牌：设置了 INSTALLER_DAEMON_TOKEN 时使用它，否则每次启动时生成一个新令牌，
+    写入只有当前用户可读的令牌文件，本机的 submit 从该文件读取
+    """
+    token = os.getenv("INSTALLER_DAEMON_TOKEN")
+    if token:
+        return token
+    token = secrets.token_urlsafe(32)
+    path = get_token_path()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    if os.path.exists(path):
+        os.remove(path)
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    with os.fdopen(fd, "w") as f:
+        f.write(token)
+    return token
+
+
+def read_daemon_token() -> Optional[str]:
+    token = os.getenv("INSTALLER_DAEMON_TOKEN")
+    if token:
+        return token
+    try:
+        with open(get_token_path(), "r") as f:
+            return f.read().strip() or None
+    except OSError:
+        return None
+
+
+class JobInputError(Exception):
+    """任务需要的输入（占位符的值等）没有随任务提供"""
+
+
+class JobLog(io.TextIOBase):
+    """任务日志：写入文件，同时保留在内存中，供 HTTP 接口按偏移量读取和跟随"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.file = open(path, "w", encoding="utf-8", errors="replace")
+        self.text = io.StringIO()
+        self.size = 0
+        self.finished = False
+        self.secrets: List[str] = []
+        self.condition = threading.Condition()
+
+    def write(self, text: str) -> int:
+        for secret in self.secrets:
+            text = text.replace(secret, "******")
+        with self.condition:
+            if self.file.closed:
+                return len(text)
+            self.text.write(text)
+            self.size += len(text)
+            self.file.write(text)
+            self.condition.notify_all()
+        return len(text)
+
+    def flush(self):
+        with self.condition:
+            if not self.file.closed:
+                self.file.flush()
+
+    def isatty(self) -> bool:
+        return False
+
+    def read_from(self, offset: int) -> Tuple[str, int]:
+        """返回 offset 之后的内容和新的偏移量"""
+        with self.condition:
+            return self.text.getvalue()[offset:], self.size
+
+    def wait(self, offset: int, timeout: float) -> bool:
+        """等待新的内容，返回是否可能还有更多内容"""
+        with self.condition:
+            if self.size <= offset and not self.finished:
+                self.condition.wait(timeout)
+            return self.size > offset or not self.finished
+
+    def finish(self):
+        with self.condition:
+            self.finished = True
+            self.file.close()
+            self.condition.notify_all()
+
+
+class Job:
+    """一个安装任务：参数、状态、日志和结果"""
+
+    def __init__(self, request: Dict, provider: str):
+        self.id = uuid.uuid4().hex[:12]
+        self.repo_url = request["repo_url"]
+        self.install_directory = os.path.abspath(request["install_directory"])
+        self.provider = provider
+        self.policy = request.get("policy")
+        self.on_ask = request.get("on_ask", "abort")
+        self.placeholders: Dict[str, str] = {str(k): str(v) for k, v in (request.get("placeholders") or {}).items()}
+        self.prompt = request.get("prompt") or ""
+        self.replay = request.get("replay", True)
+        self.use_known_fixes = request.get("use_known_fixes", True)
+        self.status = "queued"
+        self.created = time.time()
+        self.started: Optional[float] = None
+        self.finished: Optional[float] = None
+        self.result: Optional[Dict] = None
+        self.error: Optional[str] = None
+        log_dir = get_data_path("jobs")
+        os.makedirs(log_dir, exist_ok=True)
+        self.log = JobLog(os.path.join(log_dir, f"{self.id}.log"))
+        self.log.secrets.extend(value for value in self.placeholders.values() if value)
+
+    def to_dict(self) -> Dict:
+        return {
+            "id": self.id,
+            "status": self.status,
+            "repo_url": self.repo_url,
+            "install_directory": self.install_directory,
+            "provider": self.provider,
+            "policy": self.policy,
+            "on_ask": self.on_ask,
+            "created": self.created,
+            "started": self.started,
+            "finished": self.finished,
+            "result": self.result,
+            "error": self.error,
+            "log_path": self.log.path,
+            "log_size": self.log.size,
+        }
+
+
+class JobLogSink:
+    """会话日志通道的输出：消息和命令输出按顺序写入任务日志，并行试验时带上方案前缀"""
+
+    def __init__(self, log: JobLog):
+        self.log = log
+
+    def __call__(self, channel, kind: str, text: str, prefixed: bool):
+        prefix = f"[{channel.relative_prefix}] " if prefixed and channel.relative_prefix else ""
+        self.log.write(f"{prefix}{text}\n")
+
+
+class JobInteraction(Interaction):
+    """按任务参数自动作答的交互实现，所有输出写入任务日志；tail 为同时显示在服务终端上的输出"""
+
+    terminal = False
+
+    def __init__(self, job: Job, tail: Optional[TerminalSink] = None):
+        super().__init__(Console(file=job.log, width=120, force_terminal=False, color_system=None, highlight=False))
+        self.job = job
+        self.tail = tail
+
+    def ask(self, key: str, prompt: str, **context) -> str:
+        answer = self._answer(key, context)
+        shown = "******" if key == "placeholder" else answer
+        # 经过会话的日志通道输出，与之前排队的消息保持顺序
+        console.print(f"{escape(prompt + shown)}  [dim]（任务自动作答）[/dim]")
+        return answer
+
+    def _answer(self, key: str, context: Dict) -> str:
+        job = self.job
+        if key == "confirm_command":
+            return ON_ASK_ANSWERS[job.on_ask]
+        if key == "placeholder":
+            value = job.placeholders.get(context["name"], job.placeholders.get(context["placeholder"]))
+            if value is None:
+                raise JobInputError(f"任务没有提供占位符 {context['placeholder']} 的值（placeholders 中的 {context['name']}）")
+            return value
+        if key == "extra_prompt":
+            return "y" if job.prompt else "n"
+        if key == "extra_prompt_text":
+            return job.prompt
+        if key == "replay":
+            return "y" if job.replay else "n"
+        if key == "use_known_fix":
+            return "y" if job.use_known_fixes else "n"
+        if key == "fix_trials":
+            # 试验中需要确认的命令视为已批准，只有自动批准命令的任务才并行试验
+            return "y" if job.on_ask == "approve" else "n"
+        if key in ("save_placeholders", "fix_prompt"):
+            return "n"
+        raise JobInputError(f"任务无法回答询问: {key}")
+
+    def add_secret(self, value: str):
+        if value and value not in self.job.log.secrets:
+            self.job.log.secrets.append(value)
+
+    def output_view(self, command: str):
+        if get_channel():
+            # 输出经日志通道写入任务日志
+            return StreamOutputView(command, lambda line, stream: None)
+        return StreamOutputView(command, lambda line, stream: self.job.log.write(line))
+
+    def session_log(self, label: str):
+        sinks = [JobLogSink(self.job.log)] + ([self.tail] if self.tail else [])
+        session = open_session_log(f"{self.job.id[:6]} {label}", sinks)
+        for value in self.job.log.secrets:
+            session.add_secret(value)
+        return session
+
+
+class InstallDaemon:
+    """
+    本地安装服务：任务进入队列，由固定数量的工作线程执行。
+    大模型客户端按提供商只创建一次，计划缓存、错误知识库、会话库和预检缓存由所有任务共用。
+    """
+
+    def __init__(self, workers: int = 2, tail: bool = False):
+        load_environment_variables()
+        # tail 时所有任务的消息带上任务前缀显示在服务终端上
+        self.tail = TerminalSink(get_interaction().console, include_session=True, mask=True) if tail else None
+        self.available_apis = get_available_apis()
+        self.resources = SharedResources()
+        self.jobs: Dict[str, Job] = {}
+        self.queue: "queue.Queue[Job]" = queue.Queue()
+        self.lock = threading.Lock()
+        self.providers: Dict[str, LLMProvider] = {}
+        self.provider_locks: Dict[str, threading.Lock] = {}
+        self.workers = [threading.Thread(target=self._worker, name=f"install-worker-{i}", daemon=True) for i in range(workers)]
+
+    def start(self):
+        for worker in self.workers:
+            worker.start()
+        default = self.default_provider()
+        if default:
+            # 提前创建默认提供商的客户端，第一个任务也不需要等待
+            self.warm_provider(default)
+
+    def default_provider(self) -> Optional[str]:
+        if os.getenv("DAEMON_PROVIDER"):
+            return os.getenv("DAEMON_PROVIDER")
+        return next(iter(self.available_apis), None)
+
+    def available_providers(self) -> List[str]:
+        return list(self.available_apis) + ([MULTI_PROVIDER] if len(self.available_apis) > 1 else [])
+
+    def warm_provider(self, name: str) -> Optional[LLMProvider]:
+        """返回该提供商预热的实例（每个提供商只创建一次），任务通过 for_session 复制使用"""
+        with self.lock:
+            lock = self.provider_locks.setdefault(name, threading.Lock())
+        with lock:
+            if name not in self.providers:
+                if name == MULTI_PROVIDER:
+                    provider = create_multi_provider(self.available_apis)
+                else:
+                    provider = create_llm_provider(name, self.available_apis[name])
+                if not provider:
+                    return None
+                self.providers[name] = provider
+                console.print(f"[INFO] 已创建 {name} 提供商的客户端（{provider.model_name}）。")
+            return self.providers[name]
+
+    def submit(self, request: Dict) -> Job:
+        """校验任务参数并放入队列，参数有误时抛出 ValueError"""
+        if not isinstance(request, dict):
+            raise ValueError("请求体必须是 JSON 对象")
+        for field in ("repo_url", "install_directory"):
+            if not isinstance(request.get(field), str) or not request[field].strip():
+                raise ValueError(f"缺少 {field}")
+        provider = request.get("provider") or self.default_provider()
+        if provider not in self.available_providers():
+            raise ValueError(f"提供商不可用: {provider}（可用: {', '.join(self.available_providers())}）")
+        if request.get("on_ask", "abort") not in ON_ASK_ANSWERS:
+            raise ValueError(f"on_ask 必须是 {' / '.join(ON_ASK_ANSWERS)} 之一")
+        if request.get("policy") is not None and not isinstance(request["policy"], str):
+            raise ValueError("policy 必须是策略文件的路径")
+        if not isinstance(request.get("placeholders") or {}, dict):
+            raise ValueError("placeholders 必须是 {名称: 值} 对象")
+        job = Job(request, provider)
+        with self.lock:
+            self.jobs[job.id] = job
+        self.queue.put(job)
+        console.print(f"[INFO] 任务 {job.id} 已加入队列: {job.repo_url} → {job.install_directory}（{provider}）")
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def list_jobs(self) -> List[Job]:
+        with self.lock:
+            return sorted(self.jobs.values(), key=lambda job: job.created)
+
+    def cancel(self, job_id: str) -> bool:
+        """取消排队中的任务；已经开始执行的任务不能取消，返回 False"""
+        job = self.get(job_id)
+        with self.lock:
+            if not job or job.status != "queued":
+                return False
+            job.status = "cancelled"
+            job.finished = time.time()
+        job.log.finish()
+        return True
+
+    def stats(self) -> Dict:
+        jobs = self.list_jobs()
+        return {
+            "workers": len(self.workers),
+            "queued": sum(job.status == "queued" for job in jobs),
+            "running": sum(job.status == "running" for job in jobs),
+            "finished": sum(job.status in FINISHED_STATES for job in jobs),
+            "providers": {name: provider.model_name for name, provider in self.providers.items()},
+            "available_providers": self.available_providers(),
+        }
+
+    def _worker(self):
+        while True:
+            job = self.queue.get()
+            with self.lock:
+                if job.status != "queued":
+                    continue
+                job.status = "running"
+                job.started = time.time()
+            try:
+                self._run(job)
+            finally:
+                job.finished = time.time()
+                job.log.finish()
+                console.print(f"[INFO] 任务 {job.id} 结束: {job.status}（{job.finished - job.started:.1f}s）")
+
+    def _run(self, job: Job):
+        with use_interaction(JobInteraction(job, self.tail)):
+            try:
+                base = self.warm_provider(job.provider)
+                if not base:
+                    raise RuntimeError(f"无法创建 {job.provider} 提供商")
+                os.makedirs(job.install_directory, exist_ok=True)
+                llm_provider = base.for_session(job.install_directory)
+                job.result = run_install_session(llm_provider, job.provider, job.repo_url, job.install_directory, self.resources, job.policy)
+                job.error = job.result.get("error")
+                job.status = job.result["outcome"]
+            except JobInputError as e:
+                console.print(f"[ERROR] {e}")
+                job.status, job.error = "failed", str(e)
+            except Exception as e:
+                console.print(f"[ERROR] 任务执行出错: {e}\n{traceback.format_exc()}")
+                job.status, job.error = "error", f"{type(e).__name__}: {e}"
+
+
+class DaemonRequestHandler(BaseHTTPRequestHandler):
+    """
+    GET /health、GET /jobs、POST /jobs、GET /jobs/<id>、DELETE /jobs/<id>、
+    GET /jobs/<id>/log?offset=N[&follow=1]（follow 时持续输出直到任务结束）
+    """
+
+    server_version = "LLMGithubInstaller"
+
+    @property
+    def install_daemon(self) -> InstallDaemon:
+        return self.server.install_daemon
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status: int, data):
+        body = json.dumps(data, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _authorized(self) -> bool:
+        # 浏览器发出的请求都带 Origin：网页不能借用户的浏览器向本机服务提交任务
+        if self.headers.get("Origin"):
+            self._send_json(403, {"error": "不接受浏览器发出的请求"})
+            return False
+        token = self.server.token
+        if not token or secrets.compare_digest(self.headers.get("Authorization", ""), f"Bearer {token}"):
+            return True
+        self._send_json(401, {"error": "未授权"})
+        return False
+
+    def _route(self) -> Tuple[List[str], Dict[str, List[str]]]:
+        url = urlparse(self.path)
+        return [part for part in url.path.split("/") if part], parse_qs(url.query)
+
+    def do_GET(self):
+        if not self._authorized():
+            return
+        parts, query = self._route()
+        if parts == ["health"]:
+            return self._send_json(200, self.install_daemon.stats())
+        if parts == ["jobs"]:
+            return self._send_json(200, [job.to_dict() for job in self.install_daemon.list_jobs()])
+        job = self.install_daemon.get(parts[1]) if len(parts) >= 2 and parts[0] == "jobs" else None
+        if not job:
+            return self._send_json(404, {"error": "不存在"})
+        if len(parts) == 2:
+            return self._send_json(200, job.to_dict())
+        if parts[2:] == ["log"]:
+            offset = query.get("offset", ["0"])[0]
+            if not offset.isdigit():
+                return self._send_json(400, {"error": "offset 必须是非负整数"})
+            return self._send_log(job, int(offset), query.get("follow", ["0"])[0] == "1")
+        return self._send_json(404, {"error": "不存在"})
+
+    def _send_log(self, job: Job, offset: int, follow: bool):
+        text, new_offset = job.log.read_from(offset)
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; charset=utf-8")
+        if not follow:
+            body = text.encode("utf-8")
+            self.send_header("X-Log-Offset", str(new_offset))
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+        # 跟随模式不设置 Content-Length，任务结束后关闭连接
+        self.send_header("Connection", "close")
+        self.end_headers()
+        try:
+            while True:
+                if text:
+                    self.wfile.write(text.encode("utf-8"))
+                    self.wfile.flush()
+                offset = new_offset
+                if not job.log.wait(offset, timeout=1.0):
+                    break
+                text, new_offset = job.log.read_from(offset)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def do_POST(self):
+        if not self._authorized():
+            return
+        parts, _ = self._route()
+        if parts != ["jobs"]:
+            return self._send_json(404, {"error": "不存在"})
+        # 只接受 JSON：text/plain 等"简单请求"不经过 CORS 预检
+        if self.headers.get("Content-Type", "").split(";")[0].strip().lower() != "application/json":
+            return self._send_json(415, {"error": "Content-Type 必须是 application/json"})
+        try:
+            length = int(self.headers.get("Content-Length", "0"))
+            job = self.install_daemon.submit(json.loads(self.rfile.read(length) or b"null"))
+        except ValueError as e:
+            return self._send_json(400, {"error": str(e)})
+        self._send_json(202, job.to_dict())
+
+    def do_DELETE(self):
+        if not self._authorized():
+            return
+        parts, _ = self._route()
+        job = self.install_daemon.get(parts[1]) if len(parts) == 2 and parts[0] == "jobs" else None
+        if not job:
+            return self._send_json(404, {"error": "不存在"})
+        if not self.install_daemon.cancel(job.id):
+            return self._send_json(409, {"error": f"任务状态为 {job.status}，只能取消排队中的任务"})
+        self._send_json(200, job.to_dict())
+
+
+def serve(host: str, port: int, workers: int, tail: bool = False):
+    daemon = InstallDaemon(workers, tail)
+    if not daemon.available_apis:
+        console.print("[ERROR] 没有可用的API配置。需要设置 DASHSCOPE_API_KEY、GOOGLE_API_KEY 或 OPENAI_COMPAT_BASE_URL")
+        return
+    daemon.start()
+    server = ThreadingHTTPServer((host, port), DaemonRequestHandler)
+    server.daemon_threads = True
+    server.install_daemon = daemon
+    server.token = create_daemon_token()
+    if not os.getenv("INSTALLER_DAEMON_TOKEN"):
+        console.print(f"[INFO] 访问令牌已写入 {get_token_path()}（仅当前用户可读），本机的 submit 会自动读取。")
+    console.print(f"[INFO] 安装服务已启动: http://{host}:{port}（{workers} 个工作线程）")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        console.print("\n[INFO] 安装服务已停止。")
+    finally:
+        server.server_close()
+
+
+def submit(server_url: str, request: Dict, follow: bool) -> int:
+    """提交任务；follow 时输出日志直到任务结束，返回进程退出码（成功为 0）"""
+    import requests
+
+    token = read_daemon_token()
+    headers = {"Authorization": f"Bearer {token}"} if token else {}
+    response = requests.post(f"{server_url}/jobs", json=request, headers=headers, timeout=30)
+    job = response.json()
+    if response.status_code != 202:
+        console.print(f"[ERROR] 提交失败: {job.get('error')}")
+        return 2
+    console.print(f"[INFO] 任务 {job['id']} 已提交。")
+    if not follow:
+        print(json.dumps(job, ensure_ascii=False))
+        return 0
+    with requests.get(f"{server_url}/jobs/{job['id']}/log", params={"follow": 1}, headers=headers, stream=True, timeout=None) as log:
+        for chunk in log.iter_content(chunk_size=None, decode_unicode=True):
+            sys.stdout.write(chunk)
+            sys.stdout.flush()
+    job = requests.get(f"{server_url}/jobs/{job['id']}", headers=headers, timeout=30).json()
+    print(json.dumps(job, ensure_ascii=False))
+    return 0 if job["status"] == "success" else 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本地安装服务：通过 HTTP/JSON 接口提交和查看安装任务")
+    sub = parser.add_subparsers(dest="action", required=True)
+    serve_parser = sub.add_parser("serve", help="启动服务")
+    serve_parser.add_argument("--host", default=os.getenv("INSTALLER_DAEMON_HOST", DEFAULT_HOST))
+    serve_parser.add_argument("--port", type=int, default=int(os.getenv("INSTALLER_DAEMON_PORT", DEFAULT_PORT)))
+    serve_parser.add_argument("--workers", type=int, default=int(os.getenv("DAEMON_WORKERS", "2")), help="同时执行的任务数")
+    serve_parser.add_argument("--tail", action="store_true", help="在服务终端上显示所有任务的消息（带任务前缀）")
+    submit_parser = sub.add_parser("submit", help="提交安装任务")
+    submit_parser.add_argument("repo_url")
+    submit_parser.add_argument("--dir", required=True, help="安装目录")
+    submit_parser.add_argument("--provider", help="qwen / gemini / multi，默认使用服务的默认提供商")
+    submit_parser.add_argument("--policy", help="命令审批策略文件")
+    submit_parser.add_argument("--on-ask", choices=list(ON_ASK_ANSWERS), default="abort", help="策略要求确认的命令：执行 / 跳过 / 终止任务")
+    submit_parser.add_argument("--placeholder", action="append", default=[], metavar="NAME=VALUE", help="占位符的值，可重复")
+    submit_parser.add_argument("--prompt", help="给大模型的额外提示")
+    submit_parser.add_argument("--follow", action="store_true", help="输出任务日志直到任务结束")
+    submit_parser.add_argument("--server", default=os.getenv("INSTALLER_DAEMON_URL", f"http://{DEFAULT_HOST}:{DEFAULT_PORT}"))
+    args = parser.parse_args()
+
+    if args.action == "serve":
+        serve(args.host, args.port, args.workers, args.tail)
+        return
+    request = {
+        "repo_url": args.repo_url,
+        "install_directory": args.dir,
+        "provider": args.provider,
+        "policy": args.policy,
+        "on_ask": args.on_ask,
+        "placeholders": dict(item.split("=", 1) for item in args.placeholder),
+        "prompt": args.prompt,
+    }
+    sys.exit(submit(args.server, request, args.follow))
+
+
+if __name__ == "__main__":
+    main()
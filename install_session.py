@@ -0,0 +1,319 @@
+import os
+import time
+from typing import Dict, Optional
+
+from github_utils import get_github_readme_content, fetch_repo_docs, get_github_commit_sha
+from doc_index import DocIndex
+from error_kb import ErrorKnowledgeBase, fingerprint
+from plan_cache import PlanCache, dedupe_commands
+from session_store import SessionStore
+from command_executor import execute_command_interactive
+from command_policy import load_policy
+from preflight import create_preflight_checker
+from incremental_update import InstallRegistry, git_head
+from placeholders import extract_placeholders, fill_placeholders, resolve_placeholders, restore_placeholders
+from fix_trials import get_trial_count, run_fix_trials
+from workspace_snapshot import create_workspace_snapshots
+from env_pool import create_env_pool
+from interaction import ConsoleProxy, ask, emit, get_interaction
+from log_channels import flush_logs, log_secret, use_channel
+
+console = ConsoleProxy()
+
+
+class SharedResources:
+    """
+    可以在多次安装会话之间共享的缓存和存储（各自带锁，可在多个线程中使用）。
+    命令行每次运行创建一份；守护进程只创建一份，所有任务共用，省去每次的加载和冷启动。
+    """
+
+    def __init__(self):
+        self.plan_cache = PlanCache()
+        self.knowledge_base = ErrorKnowledgeBase()
+        self.session_store = SessionStore()
+        self.install_registry = InstallRegistry()
+        # conda 环境列表等查询结果缓存在检查器中
+        self.preflight = create_preflight_checker()
+        # 预热的 conda 环境池（ENV_POOL_SIZE），后台补充
+        self.env_pool = create_env_pool(self.preflight)
+
+
+def refresh_doc_index(llm_provider, install_directory, owner, repo_name, allow_fetch=False):
+    """
+    项目克隆到本地后用本地文档建立索引；尚未克隆且 allow_fetch 时从 GitHub 获取文档建立索引。
+    本地索引记录建立时的 HEAD（不是 git 仓库时记为空字符串），HEAD 不变时不再重新扫描，
+    包括项目没有文档、索引为空的情况。
+    """
+    clone_directory = os.path.join(install_directory, repo_name)
+    if os.path.isdir(clone_directory):
+        head = git_head(clone_directory) or ""
+        if llm_provider.doc_index_head == head:
+            return
+        llm_provider.doc_index_head = head
+        doc_index = DocIndex.from_directory(clone_directory)
+        if len(doc_index):
+            llm_provider.attach_doc_index(doc_index, "local")
+        return
+    if allow_fetch and llm_provider.doc_index_source is None and os.getenv("DOC_INDEX_FETCH", "1") != "0":
+        doc_index = DocIndex.from_files(fetch_repo_docs(owner, repo_name))
+        # 即使没有获取到文档也记录来源，避免每次失败都重新请求
+        llm_provider.attach_doc_index(doc_index, "remote")
+
+def propose_known_fix(knowledge_base, command, stdout, stderr, install_directory):
+    """查询本地错误知识库，命中时显示修复命令并询问是否采用，不采用或未命中返回 None"""
+    known_fix = knowledge_base.lookup(command, stdout, stderr, install_directory)
+    if not known_fix:
+        return None
+    source = "学习到的修复" if known_fix["source"] == "learned" else "内置规则"
+    console.print(f"\n[INFO] 命中本地错误知识库（{source}）: {known_fix['description']}")
+    for fix_command in known_fix["commands"]:
+        console.print(f"  [cyan]{fix_command}[/cyan]")
+    choice = ask("use_known_fix", "使用该修复 (y) / 询问大模型 (n) [y]: ", commands=known_fix["commands"]).strip().lower()
+    return known_fix if choice in ("", "y") else None
+
+def fix_commands_to_learn(failed_command, commands, max_commands=5):
+    """取修复批次中到重新执行失败命令为止的部分作为可复用的修复，最多 max_commands 条"""
+    commands = [c for c in commands if c.upper() != "DONE_SETUP_COMMANDS"]
+    if failed_command in commands:
+        commands = commands[:commands.index(failed_command) + 1]
+    return commands[:max_commands]
+
+def confirm_replay(cached_plan, commit_sha):
+    """显示缓存的安装计划并询问是否直接重放"""
+    console.print(f"\n[INFO] 发现该项目在提交 {commit_sha[:7]} 上的成功安装记录（{len(cached_plan)} 条命令）:")
+    for i, command in enumerate(cached_plan, 1):
+        console.print(f"  {i}. [cyan]{command}[/cyan]")
+    choice = ask("replay", "直接重放这些命令 (y) / 重新询问大模型 (n) [y]: ", commands=cached_plan).strip().lower()
+    return choice in ("", "y")
+
+def run_install_session(llm_provider, provider_name: str, github_project_url: str, install_directory: str,
+                        resources: SharedResources = None, policy_path: str = None) -> Dict:
+    """
+    执行一次完整的安装会话：获取 README、生成并执行命令、失败时修复，直到完成或用户退出。
+    需要用户决定的地方通过 interaction.ask 询问，会话结束时发出 session_finished 事件。
+    返回 {"outcome": success/failed/aborted/incomplete, "owner", "repo", "commit", "session_id", "commands", "error"}。
+    """
+    # 会话的日志通道：会话中的输出由后台线程写出，并写入 gzip 压缩的会话日志
+    label = github_project_url.rstrip("/").split("/")[-1].removesuffix(".git") or "session"
+    session_log = get_interaction().session_log(label)
+    try:
+        with use_channel(session_log):
+            result = _run_install_session(llm_provider, provider_name, github_project_url, install_directory, resources, policy_path)
+            if session_log:
+                console.print(f"[dim][INFO] 会话日志（gzip）: {session_log.path}[/dim]")
+    finally:
+        flush_logs()
+    emit("session_finished", **result)
+    return result
+
+def _run_install_session(llm_provider, provider_name, github_project_url, install_directory, resources, policy_path) -> Dict:
+    resources = resources or SharedResources()
+    result: Dict[str, Optional[object]] = {"outcome": "failed", "owner": None, "repo": None, "commit": None, "session_id": None, "commands": [], "error": None}
+
+    # 获取README内容
+    owner, repo_name, readme = get_github_readme_content(github_project_url)
+    if not readme:
+        console.print("无法获取 README，脚本终止。")
+        result["error"] = "无法获取 README"
+        return result
+    result.update(owner=owner, repo=repo_name)
+
+    console.print(f"[INFO] 成功获取项目信息: {owner}/{repo_name}")
+
+    # 同一提交在同一平台上已成功安装过时，可以直接重放缓存的命令
+    plan_cache = resources.plan_cache
+    commit_sha = get_github_commit_sha(owner, repo_name)
+    result["commit"] = commit_sha
+    cached_plan = plan_cache.get(owner, repo_name, commit_sha, install_directory) if commit_sha else None
+    replaying = bool(cached_plan) and confirm_replay(cached_plan, commit_sha)
+
+    # 记录会话、大模型轮次和命令执行情况，供 session_store.py report 统计
+    recorder = resources.session_store.start_session(owner, repo_name, commit_sha, provider_name, llm_provider.model_name, install_directory)
+    llm_provider.recorder = recorder
+    result["session_id"] = recorder.session_id
+    emit("session_started", session_id=recorder.session_id, owner=owner, repo=repo_name, commit=commit_sha,
+         provider=provider_name, model=llm_provider.model_name, install_directory=install_directory)
+
+    if replaying:
+        current_commands = cached_plan + ["DONE_SETUP_COMMANDS"]
+        # 重放时不与大模型对话，出现分歧时再根据缓存的计划构造消息历史
+        message_history = None
+        emit("commands_proposed", source="replay", commands=current_commands)
+    else:
+        # 获取初始命令
+        current_commands, message_history = llm_provider.generate_initial_commands(readme, owner, repo_name)
+
+        if not message_history and not current_commands:
+            console.print("无法初始化与大模型的会话或获取初始命令，脚本终止。")
+            recorder.end_session("failed")
+            result["error"] = "无法获取初始命令"
+            return result
+        if not current_commands:
+            console.print("大模型未能生成初始命令，脚本终止。")
+            recorder.end_session("failed")
+            result["error"] = "大模型未能生成初始命令"
+            return result
+        emit("commands_proposed", source="llm", commands=current_commands)
+
+    # 命令审批策略：安全的命令自动执行，危险的命令直接拒绝并交给修复流程
+    policy = load_policy(install_directory, policy_path)
+    # 执行前检查：确定会失败的命令不执行，直接把原因交给修复流程
+    preflight = resources.preflight
+    # 安装、构建命令执行前为项目目录和相关环境建立快照，失败时恢复
+    snapshots = create_workspace_snapshots(install_directory, repo_name, preflight)
+    # conda create 尽量使用预热环境，命令中的环境名改写为领取的环境
+    env_session = resources.env_pool.session() if resources.env_pool else None
+
+    # 成功执行过的命令（占位符替换前的形式），安装完成后写入计划缓存
+    executed_trace = []
+
+    knowledge_base = resources.knowledge_base
+    # 正在验证的修复批次：整批成功后记入错误知识库
+    pending_fix = None
+    # 本次会话中已经尝试过知识库修复的错误签名，再次出现时直接询问大模型
+    tried_signatures = set()
+    # 本次会话中已解析的占位符值，同一占位符只询问一次
+    placeholder_values = {}
+
+    def finish_pending_fix():
+        nonlocal pending_fix
+        if pending_fix:
+            knowledge_base.learn(pending_fix["stdout"], pending_fix["stderr"], pending_fix["failed_command"], pending_fix["commands"], install_directory)
+            pending_fix = None
+
+    # 主执行循环
+    outcome = "incomplete"
+    command_index = 0
+    while True:
+        if current_commands and current_commands[command_index].upper() == "DONE_SETUP_COMMANDS":
+            finish_pending_fix()
+            if replaying:
+                plan_cache.record_replay(owner, repo_name, commit_sha, True)
+            if commit_sha:
+                plan_cache.save(owner, repo_name, commit_sha, executed_trace, install_directory)
+            clone_directory = os.path.join(install_directory, repo_name)
+            installed_sha = git_head(clone_directory) if os.path.isdir(clone_directory) else None
+            if installed_sha:
+                resources.install_registry.record(clone_directory, owner, repo_name, installed_sha, install_directory, dedupe_commands(executed_trace),
+                                                      env_session.env_map if env_session else None)
+            outcome = "success"
+            console.print("\n[INFO] 大模型认为设置已完成。")
+            break
+        if not current_commands:
+            console.print("\n[INFO] 大模型未提供更多命令，或认为设置已完成。")
+            break
+        if command_index >= len(current_commands):
+            console.print("\n[INFO] 当前批次命令已处理完毕。")
+            break
+
+        command = current_commands[command_index]
+
+        # 批次中的占位符在执行第一条命令前一次性解析，之后整批命令可以无人值守地执行
+        batch_placeholders = extract_placeholders(current_commands[command_index:])
+        if any(p not in placeholder_values for p in batch_placeholders):
+            placeholder_values = resolve_placeholders(batch_placeholders, f"{owner}/{repo_name}", placeholder_values)
+            for value in placeholder_values.values():
+                recorder.add_secret(value)
+                get_interaction().add_secret(value)
+                log_secret(value)
+        command = fill_placeholders(command, placeholder_values)
+        if env_session:
+            command = env_session.rewrite(command)
+
+        # 执行命令
+        executed = []
+        preflight_error = preflight.check(command) if preflight else None
+        if preflight_error:
+            console.print(f"\n[bold red][PREFLIGHT] 预检未通过，命令未执行:[/bold red] [cyan]{command}[/cyan]\n{preflight_error}")
+            emit("command_blocked", command=command, source="preflight", reason=preflight_error)
+            recorder.record_command(command, time.time(), 0.0, None, "", preflight_error)
+            stdout, stderr, success, quit_script, exit_code = "", f"执行前检查未通过，命令没有执行: {preflight_error}", False, False, None
+        else:
+            stdout, stderr, success, quit_script, exit_code = execute_command_interactive(command, recorder, policy, snapshots, executed)
+        if env_session:
+            stdout, stderr = env_session.restore(stdout), env_session.restore(stderr)
+
+        if quit_script:
+            outcome = "aborted"
+            break
+
+        last_executed_command_for_ai = current_commands[command_index]
+        if executed and executed[-1] != command:
+            # 用户在确认时编辑过命令：计划缓存、安装记录和后续请求都使用实际执行的命令（去掉密钥和领取的环境名）
+            edited = env_session.restore(executed[-1]) if env_session else executed[-1]
+            last_executed_command_for_ai = restore_placeholders(edited, placeholder_values)
+        refresh_doc_index(llm_provider, install_directory, owner, repo_name, allow_fetch=not success)
+
+        if success:
+            if exit_code is not None:
+                executed_trace.append(last_executed_command_for_ai)
+            command_index += 1
+            if command_index >= len(current_commands):
+                finish_pending_fix()
+                if message_history is None:
+                    message_history = llm_provider.build_history_from_plan(readme, owner, repo_name, cached_plan)
+                console.print("\n[INFO] 当前批次命令已成功处理，询问大模型是否有后续步骤...")
+                new_commands, message_history = llm_provider.generate_next_commands(message_history, last_executed_command_for_ai, stdout, stderr, exit_code=exit_code)
+                emit("commands_proposed", source="llm", commands=new_commands)
+                current_commands = new_commands
+                command_index = 0
+        else:
+            if replaying:
+                console.print("\n[INFO] 重放的命令执行失败，与缓存的安装记录出现分歧，转由大模型继续...")
+                plan_cache.record_replay(owner, repo_name, commit_sha, False)
+                replaying = False
+                message_history = llm_provider.build_history_from_plan(readme, owner, repo_name, cached_plan)
+            if pending_fix and pending_fix["source"] == "learned":
+                knowledge_base.record_outcome(pending_fix["signature"], False)
+            pending_fix = None
+
+            # 先查本地错误知识库，命中则直接使用已知修复，并继续执行本批次剩余命令
+            signature, _ = fingerprint(stdout, stderr)
+            known_fix = None
+            if signature not in tried_signatures:
+                known_fix = propose_known_fix(knowledge_base, last_executed_command_for_ai, stdout, stderr, install_directory)
+            if known_fix:
+                tried_signatures.add(signature)
+                pending_fix = {
+                    "source": known_fix["source"], "signature": signature, "stdout": stdout, "stderr": stderr,
+                    "failed_command": last_executed_command_for_ai, "commands": known_fix["commands"],
+                }
+                current_commands = known_fix["commands"] + current_commands[command_index + 1:]
+                emit("commands_proposed", source="known_fix", commands=current_commands)
+                command_index = 0
+                continue
+
+            console.print("\n[INFO] 命令执行失败，将输出反馈给大模型请求修正...")
+
+            trial_count = get_trial_count()
+            if trial_count:
+                # 并行试验模式：一次请求多个方案，在安装目录的副本中同时试验，采用最先成功的方案
+                new_commands, message_history = run_fix_trials(
+                    llm_provider, message_history, last_executed_command_for_ai, stdout, stderr, exit_code,
+                    trial_count, install_directory, repo_name, policy, preflight, recorder, env_session,
+                )
+            else:
+                new_commands, message_history = llm_provider.generate_next_commands(message_history, last_executed_command_for_ai, stdout, stderr, exit_code=exit_code)
+                console.print("\n[INFO] 大模型生成了新的命令。")
+                console.print("是否需要添加prompt来帮助生成命令？")
+                console.print("[bold green]请选择操作：[/bold green][yellow](y)[/yellow] 是  [yellow](n)[/yellow] 不需要")
+                yes_or_no = ask("fix_prompt", "请输入 (y/n): ", command=last_executed_command_for_ai).strip().lower()
+                if yes_or_no == 'y':
+                    user_prompt = ask("fix_prompt_text", "请输入prompt: ")
+                    new_commands, message_history = llm_provider.generate_next_commands(message_history, last_executed_command_for_ai, stdout, stderr, user_prompt, exit_code)
+            emit("commands_proposed", source="llm", commands=new_commands)
+            if new_commands:
+                pending_fix = {
+                    "source": "llm", "signature": signature, "stdout": stdout, "stderr": stderr,
+                    "failed_command": last_executed_command_for_ai,
+                    "commands": fix_commands_to_learn(last_executed_command_for_ai, new_commands),
+                }
+            current_commands = new_commands
+            command_index = 0
+
+    if env_session:
+        env_session.report()
+    recorder.end_session(outcome)
+    llm_provider.report_stats()
+    result.update(outcome=outcome, commands=executed_trace)
+    return result
@@ -0,0 +1,89 @@
+import contextvars
+from contextlib import contextmanager
+
+from rich.console import Console
+
+from log_channels import TerminalSink, flush_logs, get_channel, open_session_log
+
+
+class Interaction:
+    """
+    会话与用户之间的交互：需要用户决定的地方调用 ask()，输出通过 console 显示，命令输出通过 output_view() 显示，
+    会话中的关键节点（大模型轮次、命令开始/结束等）通过 emit() 通知。
+    默认实现是终端交互（rich 控制台 + input()）；守护进程、无界面模式在各自的线程中替换为自己的实现。
+    """
+
+    # 命令能否使用安装器的控制终端（sudo 密码、git 凭据等提示）；没有人在终端前的实现设为 False
+    terminal = True
+
+    def __init__(self, console: Console = None):
+        self.console = console or Console()
+
+    def ask(self, key: str, prompt: str, **context) -> str:
+        """
+        请求用户输入。key 标识询问的类型（如 confirm_command、placeholder），context 为附加信息，
+        非终端的实现根据它们自动作答；返回输入的原始文本。
+        """
+        # 先写出后台队列中的日志，提示出现在之前的输出之后
+        flush_logs()
+        return input(prompt)
+
+    def emit(self, event: str, **data):
+        """会话事件；终端中已经通过控制台显示，不需要额外处理"""
+        pass
+
+    def add_secret(self, value: str):
+        """登记需要在输出中隐藏的值（占位符的值）；终端中由用户自己输入，不需要隐藏"""
+        pass
+
+    def output_view(self, command: str):
+        """命令输出的视图，默认在终端中限速刷新"""
+        from output_view import LiveOutputView
+        return LiveOutputView(command, target_console=self.console)
+
+    def session_log(self, label: str):
+        """
+        打开会话的日志通道（log_channels.SessionLog）：会话中的输出写入 gzip 压缩的会话日志，并由后台线程显示在终端；
+        不需要通道的实现返回 None，输出直接写到 console。
+        """
+        return open_session_log(label, [TerminalSink(self.console)])
+
+
+_default_interaction = Interaction()
+_current_interaction = contextvars.ContextVar("interaction", default=None)
+
+
+def get_interaction() -> Interaction:
+    return _current_interaction.get() or _default_interaction
+
+
+@contextmanager
+def use_interaction(interaction: Interaction):
+    """在当前线程（上下文）中使用指定的交互实现"""
+    token = _current_interaction.set(interaction)
+    try:
+        yield interaction
+    finally:
+        _current_interaction.reset(token)
+
+
+def ask(key: str, prompt: str, **context) -> str:
+    return get_interaction().ask(key, prompt, **context)
+
+
+def emit(event: str, **data):
+    get_interaction().emit(event, **data)
+
+
+class ConsoleProxy:
+    """
+    模块级的 console：每次调用转发到当前交互实现的控制台，
+    守护进程中并发执行的任务因此各自输出到自己的日志。
+    当前上下文打开了日志通道（会话、命令、并行试验的方案）时写入该通道，由后台线程写出并加上通道前缀。
+    """
+
+    def __getattr__(self, name):
+        interaction = get_interaction()
+        channel = get_channel()
+        console = channel.console_for(interaction.console) if channel else interaction.console
+        return getattr(console, name)
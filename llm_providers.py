@@ -1,32 +1,86 @@
+import contextvars
+import copy
 import os
+import json
 import platform
 import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 from abc import ABC, abstractmethod
 from typing import List, Tuple, Optional, Dict, Any
 
 try:
-    from rich.console import Console
-    from rich.panel import Panel
     from rich.table import Table
 except ImportError:
     import subprocess
     subprocess.check_call(["python", "-m", "pip", "install", "rich"])
-    from rich.console import Console
-    from rich.panel import Panel
     from rich.table import Table
 
-console = Console()
+from app_paths import get_data_path
+from readme_processor import condense_readme, FULL_README_MARKER
+from doc_index import DocIndex, format_chunks
+from structured_output import RESPONSE_SCHEMA, STRUCTURED_RULES, parse_structured_response, commands_to_response, salvage_commands, split_candidates
+from error_kb import fingerprint
+from interaction import ConsoleProxy, ask, emit
+
+console = ConsoleProxy()
+
+CJK_PATTERN = re.compile(r"[\u3000-\u303f\u4e00-\u9fff\uff00-\uffef]")
+
+
+def estimate_tokens(text: str) -> int:
+    """粗略估算 token 数：中日韩字符每个约 1 个 token，其余字符约每 4 个算 1 个 token"""
+    if not text:
+        return 0
+    cjk_count = len(CJK_PATTERN.findall(text))
+    return cjk_count + (len(text) - cjk_count + 3) // 4
+
 
 class LLMProvider(ABC):
     """抽象基类，定义LLM提供商的通用接口"""
+
+    # 子类支持原生 JSON 输出（结构化输出模式）时设为 True
+    supports_structured_output = False
+    # 快速模型（如 qwen-turbo）；设置了 router 时，简单的修复轮次使用快速模型，其余轮次使用 model_name（强模型）
+    fast_model_name = None
+    router = None
     
     def __init__(self, api_key: str, model_name: str, install_directory: str = None):
         self.api_key = api_key
         self.model_name = model_name
-        self.install_directory = install_directory or os.getcwd()
         self.system_info = self._get_system_info()
+        # 结构化输出模式：要求大模型返回 JSON 格式的步骤，文本解析只作为兜底
+        self.structured_output = self.supports_structured_output and os.getenv("STRUCTURED_OUTPUT", "1") != "0"
+        self._reset_session(install_directory)
+
+    def _reset_session(self, install_directory: str = None):
+        """初始化与单次安装会话相关的状态"""
+        self.install_directory = install_directory or os.getcwd()
+        self.full_readme = ""
+        self.legacy_history_tokens = 0
+        self.doc_index = None
+        self.doc_index_source = None
+        # 本地文档索引建立时克隆目录的 HEAD，None 表示尚未扫描过
+        self.doc_index_head = None
+        self.sent_doc_chunks = set()
+        # 会话记录器（session_store.SessionRecorder），设置后记录每轮请求的耗时
+        self.recorder = None
+        # 模型路由的会话状态：已请求的修复轮次、连续失败次数、出现过的错误签名，以及上一轮命令由哪个模型生成
+        self.fix_turns = 0
+        self.consecutive_failures = 0
+        self.seen_signatures = set()
+        self.last_route = None
         console.print(f"[INFO] 使用的安装目录: {self.install_directory}")
 
+    def for_session(self, install_directory: str) -> "LLMProvider":
+        """
+        复制出用于新会话的实例：共享已经初始化的 API 客户端（及其连接池），会话状态重新初始化。
+        守护进程用它让多个任务复用预热的客户端。
+        """
+        session = copy.copy(self)
+        session._reset_session(install_directory)
+        return session
     
     def _get_system_info(self) -> Dict[str, str]:
         """获取系统信息"""
@@ -36,86 +90,72 @@ class LLMProvider(ABC):
             "python_version": platform.python_version()
         }
     
+    def _get_system_prompt(self) -> str:
+        """获取系统提示词：所有规则只在这里出现一次，每次请求作为 system 消息发送"""
+        install_dir = self.install_directory
+        rules = [
+            f"所有操作都在用户指定的安装目录 {install_dir} 中进行；克隆项目时先 cd 到该目录，再用 && 串联 git clone，例如：cd {install_dir} && git clone URL",
+            f"每一行命令都会在新的终端中执行，所以每条命令都要带上它的前置命令（cd 进入项目所在文件夹、激活环境等）并用 && 连接，例如：cd {install_dir} && conda activate myenv && pip install -r requirements.txt",
+            "生成 pip install 或 conda install 命令前必须先激活环境",
+            "如果项目有requirements.txt，使用pip安装依赖，推荐使用conda或者uv创建虚拟环境；如果没有说要安装python环境，则不需要用conda",
+            f"命令应该适用于{self.system_info['os']}系统，如果是Linux系统，请使用bash，或者使用bash -c命令来完成",
+            "每行只包含一个命令；尽量将命令拆分开来（用&&连接的前置命令除外）",
+            "如果需要用户提供信息（API密钥、路径等自定义内容），使用<YOUR_XXX_HERE>格式占位符；多个API密钥或配置项请分成独立的命令，每条命令只设置一个",
+            "如果项目需要特殊配置，请明确指出",
+            "如果上一个命令执行失败，请提供修复命令；找不到文件之类的错误通常是缺少 cd 或激活环境等前置命令",
+        ]
+        if self.structured_output:
+            rules.extend(STRUCTURED_RULES)
+        else:
+            rules.extend([
+                f"如果需要查看完整的README才能继续，请只返回一行 \"{FULL_README_MARKER}\"",
+                "如果所有步骤都已完成，最后一行返回 \"DONE_SETUP_COMMANDS\"",
+                "直接返回命令列表，每行一个命令，不要添加额外的解释文本",
+            ])
+        if self.system_info['os'] == "Windows":
+            rules.append("Windows系统下，cd 命令使用 cd /d 并带上盘符，路径以\\结尾，例如：cd /d d:\\myproject\\ && conda activate myenv && pip install ...")
+        lines = [
+            "你是一个专业的开发环境配置助手，根据GitHub项目的README和命令执行结果，为用户生成安装和配置命令序列。",
+            f"系统信息：操作系统 {self.system_info['os']}，架构 {self.system_info['architecture']}，Python {self.system_info['python_version']}，安装目录 {install_dir}",
+            "规则：",
+        ]
+        lines.extend(f"{i}. {rule}" for i, rule in enumerate(rules, 1))
+        return "\n".join(lines)
+
     def _get_initial_prompt(self, readme_content: str, owner: str, repo_name: str) -> str:
-        """获取初始安装命令的提示词"""
-        return f"""你是一个专业的开发环境配置助手。请根据GitHub项目的README文件，为用户生成详细的安装和配置命令序列。
-
-                    当前系统信息：
-                    - 操作系统: {self.system_info['os']}
-                    - 架构: {self.system_info['architecture']}
-                    - Python版本: {self.system_info['python_version']}
-                    - 用户指定的安装目录: {self.install_directory}
-
-                    请遵循以下规则：
-                    1.第一步请获得git clone的URL，也就是git clone git@github.com:{owner}/{repo_name}.git
-                    2. 如果项目有requirements.txt，使用pip安装依赖,推荐使用conda或者uv创建虚拟环境。如果没有说要安装python环境，则不需要用conda
-                    3. 如果项目需要特殊配置，请明确指出
-                    4. 命令应该适用于{self.system_info['os']}系统，如果是Linux系统，请将shell变成bash，或者使用bash -c命令来完成
-                    5. 每行只包含一个命令
-                    6. 如果需要用户提供信息（如API密钥等），使用<YOUR_XXX_HERE>格式占位符
-                    7. 如果设置完成，最后一行返回 "DONE_SETUP_COMMANDS"
-                    8. ***重要：所有操作都应该在用户指定的安装目录 {self.install_directory} 中进行
-                    9. 重要：你的每一行都会新开一个terminal，这会导致原本这一行的命令出现问题，所以请你把原本命令所需要的一些前置命令都输出(就像第9条规则，或者cd命令进入安装目录然后），并且用&&进行连接，
-                    10. 前一个规则基础上***请检查所有生成的命令：每一个命令都需要重新进入项目所在的文件夹，然后，每当生成pip install 或者 conda install 命令时，请先激活环境，并用&&把所有的命令连接起来，例如：cd {self.install_directory} && conda activate myenv && pip install -r requirements.txt
-                    11. 在前一个规则基础上***如果需要克隆项目，请克隆到指定的安装目录 {self.install_directory} 中，另外你在git clone的时候需要先用cd命令进入这个文件夹，然后再通过&&把git clone在后面串联起来（比如cd install_directory && git clone URL)，或者对于pip install -r requirements.txt，你需要先cd到这个文件夹下，然后在cd命令后加上&& pip install ...
-                    12. 尽量将命令拆分开来（如果要用&&连接则不用拆分）
-                    13. windows系统下，所有cd 命令之前，都需要再加上一个目录名字，例如你想进入d盘，请使用cd /d d:\,请注意是所有命令，包括类似 cd /d d:\ && conda activate myenv && pip install 这样的命令都需要在前面加上cd /d d:\. 另外在地址最后加上'/'，例如 cd /d d:\myproject\，然后和后续命令用&&连接起来，
-                    14. 如果需要用户输入一些api，路径之类的自定义的内容,请用 <YOUR_VALUE_HERE>，便于识别和重新生成！
-                    15. ***如果项目需要多个API密钥或配置项，请将每个API的设置分成独立的命令。例如：
-                        - 错误示例：export API_KEY1=<YOUR_API_KEY1_HERE> && export API_KEY2=<YOUR_API_KEY2_HERE>
-                        - 正确示例：
-                          export API_KEY1=<YOUR_API_KEY1_HERE>
-                          export API_KEY2=<YOUR_API_KEY2_HERE>
-                          如果要把API存储，请你写下进一步的命令
-                    
-                    
-                    仔细阅读下面项目README内容，提取出重要安装信息：
-                    {readme_content}
-
-                    请分析该项目并生成安装配置命令序列，直接返回命令列表，每行一个命令，不要添加额外的解释文本："""
-
-    def _get_continue_prompt(self, last_command: str, stdout: str, stderr: str, prompt_form_user: str) -> str:
-        """获取继续执行的提示词"""
-        base_prompt = f"""你是一个专业的开发环境配置助手。基于上一个命令的执行结果，请继续为用户生成后续的安装和配置命令序列。
-
-                    当前系统信息：
-                    - 操作系统: {self.system_info['os']}
-                    - 架构: {self.system_info['architecture']}
-                    - Python版本: {self.system_info['python_version']}
-                    - 用户指定的安装目录: {self.install_directory}
-
-                    请遵循以下规则：
-                    1. 如果项目有requirements.txt，使用pip安装依赖,推荐使用conda或者uv创建虚拟环境。如果没有说要安装python环境，则不需要用conda
-                    2. 如果项目需要特殊配置，请明确指出
-                    3. 命令应该适用于{self.system_info['os']}系统，如果是Linux系统，请将shell变成bash，或者使用bash -c命令来完成
-                    4. 每行只包含一个命令
-                    5. 如果需要用户提供信息（如API密钥等），使用<YOUR_XXX_HERE>格式占位符
-                    6. 如果设置完成，最后一行返回 "DONE_SETUP_COMMANDS"
-                    7. ***重要：所有操作都应该在用户指定的安装目录 {self.install_directory} 中进行
-                    8. 重要：你的每一行都会新开一个terminal，这会导致原本这一行的命令出现问题，所以请你把原本命令所需要的一些前置命令都输出，并且用&&进行连接
-                    9. ***请检查所有生成的命令：每一个命令都需要重新进入项目所在的文件夹，然后，每当生成pip install 或者 conda install 命令时，请先激活环境，并用&&把所有的命令连接起来，例如：cd {self.install_directory} && conda activate myenv && pip install -r requirements.txt
-                    10. 尽量将命令拆分开来（如果要用&&连接则不用拆分）
-                    11. windows系统下，所有cd 命令之前，都需要再加上一个目录名字，例如你想进入d盘，请使用cd /d d:\,请注意是所有命令，包括类似 cd /d d:\ && conda activate myenv && pip install 这样的命令都需要在前面加上cd /d d:\. 另外在地址最后加上'/'，例如 cd /d d:\myproject\，然后和后续命令用&&连接起来，
-                    12. 如果需要用户输入一些api，路径之类的自定义的内容,请用 <YOUR_VALUE_HERE>，便于识别和重新生成！
-                    13. ***如果项目需要多个API密钥或配置项，请将每个API的设置分成独立的命令
-                    
-                    上一个命令执行情况：
-                    命令: {last_command}
-                    执行结果:
-                    stdout: {stdout}
-                    stderr: {stderr}
-                    
-                    请基于执行结果决定下一步操作：
-                    1. 如果执行成功且还需要更多步骤，请提供下一批命令
-                    2. 如果执行失败，请提供修复命令,如果返回的错误是找不到文件，请注意，每一次运行命令时，都会相当于新建一个终端，因此需要该命令的所有前置命令，比如需要重新进入项目所在的文件夹，而且每当生成pip install 或者 conda install 命令时，请先激活环境。所以，在原来的命令上，用&&把所有的命令连接起来，例如：cd {self.install_directory} && conda activate myenv && pip install -r requirements.txt
-                    3. 如果所有步骤都已完成，请返回 "DONE_SETUP_COMMANDS"
-                    4. ***重要：记住用户指定的安装目录是 {self.install_directory}，所有必须要在这个目录下运行的命令都需要在前面加上(cd install_directory && command...)
-                    
-                    请直接返回命令列表，每行一个命令，不要添加额外的解释文本："""
-        
+        """获取初始安装命令的提示词（规则在系统提示词中）"""
+        return (
+            f"项目: {owner}/{repo_name}\n"
+            f"第一步请克隆项目: git clone git@github.com:{owner}/{repo_name}.git\n"
+            f"README（可能只保留了与安装相关的章节）：\n{readme_content.strip()}\n\n"
+            "请生成安装配置命令序列："
+        )
+
+    def _trim_output(self, text: str, max_chars: int = None) -> str:
+        """截断过长的命令输出，保留开头和更重要的结尾部分"""
+        if max_chars is None:
+            max_chars = int(os.getenv("CONTINUE_OUTPUT_MAX_CHARS", "2000"))
+        text = text.strip()
+        if len(text) <= max_chars:
+            return text
+        head = max_chars // 4
+        tail = max_chars - head
+        return f"{text[:head]}\n...[省略 {len(text) - max_chars} 字符]...\n{text[-tail:]}"
+
+    def _get_continue_prompt(self, last_command: str, stdout: str, stderr: str, prompt_form_user: str, exit_code: Optional[int] = None) -> str:
+        """获取继续执行的提示词：只包含上一条命令、返回码和截断后的输出"""
+        parts = [
+            f"命令: {last_command}",
+            f"返回码: {exit_code if exit_code is not None else '无（未执行或执行异常）'}",
+        ]
+        if stdout and stdout.strip():
+            parts.append(f"stdout:\n{self._trim_output(stdout)}")
+        if stderr and stderr.strip():
+            parts.append(f"stderr:\n{self._trim_output(stderr)}")
         if prompt_form_user:
-            return base_prompt + f"\n同时请注意：{prompt_form_user}"
-        return base_prompt
+            parts.append(f"同时请注意：{prompt_form_user}")
+        return "\n".join(parts)
+
     def _parse_commands(self, response_text: str) -> List[str]:
         """解析响应文本，提取命令列表"""
         lines = response_text.strip().split('\n')
@@ -164,9 +204,95 @@ class LLMProvider(ABC):
         console.print(table)
     
     @abstractmethod
-    def _call_api(self, prompt: str, message_history: List[Dict] = None) -> str:
-        """调用API的抽象方法，由子类实现"""
+    def _call_api(self, prompt: str, message_history: List[Dict] = None, system_prompt: str = None, tier: str = "strong") -> str:
+        """
+        调用API的抽象方法，由子类实现；system_prompt 使用各API原生的系统角色发送，
+        tier 为 fast 时使用快速模型（见 model_for）
+        """
         pass
+
+    def model_for(self, tier: str) -> str:
+        """tier（fast / strong）对应的模型名，没有配置快速模型时都使用 model_name"""
+        if tier == "fast" and self.fast_model_name:
+            return self.fast_model_name
+        return self.model_name
+
+    def _request(self, prompt: str, message_history: Optional[List[Dict]], system_prompt: str, kind: str, tier: str = "strong") -> str:
+        """调用API并把本轮耗时记录到会话记录器和模型路由统计"""
+        model = self.model_for(tier)
+        emit("llm_turn_started", kind=kind, model=model, tier=tier)
+        started_at = time.time()
+        start = time.monotonic()
+        response_text = self._call_api(prompt, message_history, system_prompt, tier)
+        duration = time.monotonic() - start
+        if self.recorder:
+            prompt_tokens = estimate_tokens(system_prompt) + estimate_tokens(prompt) + sum(
+                estimate_tokens(msg.get("content", "")) for msg in message_history or []
+            )
+            self.recorder.record_llm_turn(kind, model, started_at, duration, prompt_tokens, response_text)
+        if self.router:
+            self.last_route = f"{tier}:{model}"
+            self.router.stats.record(self.last_route, duration, bool(response_text) and self._parses_to_commands(response_text))
+        emit("llm_turn_finished", kind=kind, model=model, tier=tier, duration=round(duration, 3), success=bool(response_text), response_chars=len(response_text or ""))
+        return response_text
+
+    def _request_commands(self, prompt: str, message_history: Optional[List[Dict]], system_prompt: str, kind: str, tier: str = "strong") -> Tuple[str, List[str]]:
+        """
+        请求并解析命令，返回 (响应文本, 命令列表)。
+        结构化输出模式下校验 JSON，不合格时带上错误请求修正一次，仍不合格则只取出 JSON 中的命令字符串（不是 JSON 时用文本解析兜底）。
+        快速模型没有返回可用的命令时，改用强模型重新请求。
+        """
+        response_text = self._request(prompt, message_history, system_prompt, kind, tier)
+        if tier == "fast" and not (response_text and self._parses_to_commands(response_text)):
+            console.print(f"[AI] 快速模型 {self.model_for(tier)} 未返回可用的命令，升级到强模型 {self.model_name} 重新请求...")
+            return self._request_commands(prompt, message_history, system_prompt, kind)
+        if not response_text:
+            return "", []
+        if not self.structured_output:
+            return response_text, self._parse_commands(response_text)
+        commands, error = parse_structured_response(response_text, self.system_info["os"])
+        if commands is not None:
+            return response_text, commands
+
+        console.print(f"[WARN] 大模型的结构化输出不合格（{error}），请求修正...")
+        repair_history = list(message_history or []) + [
+            {"role": "user", "content": prompt},
+            {"role": "assistant", "content": response_text},
+        ]
+        repair_prompt = f"上一条回复不符合要求的 JSON 格式：{error}。请按系统提示中的格式重新返回完整的 JSON 对象。"
+        repaired_text = self._request(repair_prompt, repair_history, system_prompt, f"{kind}_repair")
+        commands, error = parse_structured_response(repaired_text, self.system_info["os"]) if repaired_text else (None, "空响应")
+        if commands is not None:
+            return repaired_text, commands
+        for text in (repaired_text, response_text):
+            salvaged = salvage_commands(text) if text else None
+            if salvaged is not None:
+                console.print(f"[WARN] 修正后仍不合格（{error}），只使用 JSON 中能识别的命令（{len(salvaged)} 条）。")
+                return text, salvaged
+        console.print(f"[WARN] 修正后仍不合格（{error}），按文本格式解析。")
+        return response_text, self._parse_commands(response_text)
+
+    def _parses_to_commands(self, response_text: str) -> bool:
+        """响应能否解析出命令（不请求修正），用于判断调用是否有效"""
+        if self.structured_output:
+            if parse_structured_response(response_text, self.system_info["os"])[0]:
+                return True
+            salvaged = salvage_commands(response_text)
+            if salvaged is not None:
+                return bool(salvaged)
+        return bool(self._parse_commands(response_text))
+
+    def _report_token_usage(self, system_prompt: str, message_history: List[Dict], prompt: str, legacy_prompt_tokens: int):
+        """
+        估算本轮请求的 token 数，并与旧格式（每轮都重复全部规则、输出不截断）对比。
+        legacy_prompt_tokens 为本轮用户消息在旧格式下的 token 数。
+        """
+        system_tokens = estimate_tokens(system_prompt)
+        history_tokens = sum(estimate_tokens(msg.get("content", "")) for msg in message_history or [])
+        new_tokens = system_tokens + history_tokens + estimate_tokens(prompt)
+        old_tokens = self.legacy_history_tokens + system_tokens + legacy_prompt_tokens
+        saved = (1 - new_tokens / old_tokens) * 100 if old_tokens else 0.0
+        console.print(f"[INFO] 本轮请求 token 估算: 旧格式 ≈ {old_tokens}，新格式 ≈ {new_tokens}（减少 {saved:.0f}%）")
     
     def generate_initial_commands(self, readme_content: str, owner: str, repo_name: str) -> Tuple[List[str], List[Dict]]:
         """生成初始命令序列"""
@@ -174,58 +300,170 @@ class LLMProvider(ABC):
         
         # 询问用户是否要添加额外的提示
         console.print("[bold cyan]是否需要添加额外的提示来帮助大模型更好地生成命令？[/bold cyan]")
-        user_wants_prompt = input("请选择 (y/n): ").strip().lower() == 'y'
+        user_wants_prompt = ask("extra_prompt", "请选择 (y/n): ").strip().lower() == 'y'
         
         user_additional_prompt = ""
         if user_wants_prompt:
-            user_additional_prompt = input("请输入您的额外提示: ").strip()
+            user_additional_prompt = ask("extra_prompt_text", "请输入您的额外提示: ").strip()
         
-        prompt = self._get_initial_prompt(readme_content, owner, repo_name)
+        self.full_readme = readme_content
+        condensed_readme = condense_readme(readme_content)
+        if len(condensed_readme) < len(readme_content.strip()):
+            console.print(f"[INFO] README 已精简为安装相关章节: {len(readme_content)} → {len(condensed_readme)} 字符")
+        prompt = self._get_initial_prompt(condensed_readme, owner, repo_name)
         if user_additional_prompt:
             prompt += f"\n\n用户额外要求：{user_additional_prompt}"
         
-        response_text = self._call_api(prompt)
+        system_prompt = self._get_system_prompt()
+        self.legacy_history_tokens = 0
+        self._report_token_usage(system_prompt, [], prompt, estimate_tokens(prompt))
+        response_text, commands = self._request_commands(prompt, None, system_prompt, "initial")
         
         if not response_text:
             return [], []
-        
-        commands = self._parse_commands(response_text)
-        
-        # 显示命令
-        self._display_commands(commands)
+        self.legacy_history_tokens += estimate_tokens(system_prompt) + estimate_tokens(prompt) + estimate_tokens(response_text)
         
         # 初始化消息历史
         initial_message = {"role": "user", "content": prompt}
         assistant_message = {"role": "assistant", "content": response_text}
         message_history = [initial_message, assistant_message]
+        commands, message_history = self._provide_full_readme_if_requested(commands, message_history)
+        
+        # 显示命令
+        self._display_commands(commands)
         
         return commands, message_history
     
-    def generate_next_commands(self, message_history: List[Dict], last_command: str, stdout: str, stderr: str,prompt_form_user=None) -> Tuple[List[str], List[Dict]]:
-        """基于执行结果生成下一批命令"""
-        prompt = self._get_continue_prompt(last_command, stdout, stderr,prompt_form_user)
-        response_text = self._call_api(prompt, message_history)
+    def _route_next_turn(self, stdout: str, stderr: str, exit_code: Optional[int], prompt_form_user=None) -> str:
+        """
+        记录上一轮命令的执行结果，并为本轮选择模型，返回 tier（fast / strong）。
+        用户补充提示时是重新请求同一轮，不计入结果，沿用强模型。
+        """
+        if not self.router or self.model_for("fast") == self.model_for("strong"):
+            return "strong"
+        if prompt_form_user or exit_code is None:
+            # 命令没有执行（被跳过或预检未通过），无法判断上一轮命令的效果
+            return "strong"
+        failed = exit_code != 0
+        if self.last_route:
+            self.router.stats.record_outcome(self.last_route, not failed)
+            self.last_route = None
+        if not failed:
+            self.consecutive_failures = 0
+            return "strong"
+        self.fix_turns += 1
+        self.consecutive_failures += 1
+        signature, _ = fingerprint(stdout, stderr)
+        repeated = signature in self.seen_signatures
+        self.seen_signatures.add(signature)
+        tier, reason = self.router.choose(stdout, stderr, self.fix_turns, self.consecutive_failures, repeated)
+        console.print(f"[AI] 本轮使用{'快速' if tier == 'fast' else '强'}模型 {self.model_for(tier)}（{reason}）")
+        return tier
+
+    def generate_next_commands(self, message_history: List[Dict], last_command: str, stdout: str, stderr: str,prompt_form_user=None, exit_code: Optional[int] = None, instruction: str = None) -> Tuple[List[str], List[Dict]]:
+        """基于执行结果生成下一批命令；instruction 为附加在提示词末尾的要求"""
+        tier = self._route_next_turn(stdout, stderr, exit_code, prompt_form_user)
+        prompt = self._get_continue_prompt(last_command, stdout, stderr,prompt_form_user, exit_code)
+        doc_context = self._retrieve_doc_context(last_command, stdout, stderr, exit_code)
+        if doc_context:
+            prompt += f"\n项目文档中的相关片段：\n{doc_context}"
+        if instruction:
+            prompt += f"\n{instruction}"
+        system_prompt = self._get_system_prompt()
+        # 旧格式下本轮用户消息包含未截断的完整输出
+        legacy_prompt_tokens = sum(estimate_tokens(text or "") for text in (last_command, stdout, stderr, prompt_form_user, doc_context))
+        self._report_token_usage(system_prompt, message_history, prompt, legacy_prompt_tokens)
+        response_text, commands = self._request_commands(prompt, message_history, system_prompt, "next", tier)
         
         if not response_text:
             return [], message_history
-        
-        commands = self._parse_commands(response_text)
+        self.legacy_history_tokens += estimate_tokens(system_prompt) + legacy_prompt_tokens + estimate_tokens(response_text)
         
         # 更新消息历史
         user_message = {"role": "user", "content": prompt}
         assistant_message = {"role": "assistant", "content": response_text}
         message_history.extend([user_message, assistant_message])
+        commands, message_history = self._provide_full_readme_if_requested(commands, message_history)
         
         if commands:
             self._display_commands(commands)
         
         return commands, message_history
-    
 
+    def generate_candidate_fixes(self, message_history: List[Dict], last_command: str, stdout: str, stderr: str, count: int, exit_code: Optional[int] = None) -> Tuple[List[List[str]], List[Dict]]:
+        """
+        一次请求 count 个思路不同的修复方案（供 fix_trials 并行试验），返回 (方案列表, 消息历史)。
+        方案之间用 "# 方案 N" 分隔，兼容结构化输出和文本格式；模型没有按要求分隔时只返回一个方案。
+        """
+        separator = "单独一个步骤" if self.structured_output else "单独一行"
+        instruction = (
+            f"请给出 {count} 个思路不同、互相独立的修复方案，它们会在安装目录的副本中同时试验，采用最先成功的一个。"
+            f"每个方案以{separator} \"# 方案 N\"（N 从 1 开始）开头，后面是该方案完整的命令；不要使用 depends_on。"
+        )
+        commands, message_history = self.generate_next_commands(message_history, last_command, stdout, stderr, exit_code=exit_code, instruction=instruction)
+        return split_candidates(commands), message_history
+
+    def build_history_from_plan(self, readme_content: str, owner: str, repo_name: str, commands: List[str]) -> List[Dict]:
+        """用缓存的安装计划构造消息历史，重放出现分歧时据此继续与大模型对话"""
+        self.full_readme = readme_content
+        prompt = self._get_initial_prompt(condense_readme(readme_content), owner, repo_name)
+        self.legacy_history_tokens = estimate_tokens(self._get_system_prompt()) + estimate_tokens(prompt)
+        return [
+            {"role": "user", "content": prompt},
+            {"role": "assistant", "content": commands_to_response(commands) if self.structured_output else "\n".join(commands)},
+        ]
+
+    def attach_doc_index(self, doc_index: DocIndex, source: str):
+        """设置项目文档索引，source 为 local（本地克隆）或 remote（从 GitHub 获取）"""
+        self.doc_index = doc_index
+        self.doc_index_source = source
+        self.sent_doc_chunks = set()
+        console.print(f"[INFO] 已建立项目文档索引（{source}），共 {len(doc_index)} 个片段。")
+
+    def _retrieve_doc_context(self, last_command: str, stdout: str, stderr: str, exit_code: Optional[int]) -> str:
+        """命令失败时，用错误信息检索最相关的文档片段；已发送过的片段不再重复发送"""
+        if not self.doc_index or exit_code in (0, None):
+            return ""
+        error_text = (stderr or stdout or "")[-1500:]
+        top_k = int(os.getenv("DOC_INDEX_TOP_K", "3"))
+        chunks = self.doc_index.search(f"{last_command}\n{error_text}", top_k, exclude_ids=self.sent_doc_chunks)
+        if not chunks:
+            return ""
+        self.sent_doc_chunks.update(chunk["id"] for chunk in chunks)
+        console.print(f"[INFO] 附加了 {len(chunks)} 个相关文档片段: {', '.join(chunk['source'] for chunk in chunks)}")
+        return format_chunks(chunks, int(os.getenv("DOC_INDEX_MAX_CHARS", "1500")))
+
+    def _provide_full_readme_if_requested(self, commands: List[str], message_history: List[Dict]) -> Tuple[List[str], List[Dict]]:
+        """模型返回 NEED_FULL_README 时，补发完整README并重新获取命令（每个会话只补发一次）"""
+        if not any(command.upper() == FULL_README_MARKER for command in commands):
+            return commands, message_history
+        if not self.full_readme:
+            console.print("[WARN] 大模型请求完整README，但完整README已提供过或不可用。")
+            return [c for c in commands if c.upper() != FULL_README_MARKER], message_history
+
+        console.print("[AI] 大模型请求完整README，正在补发...")
+        prompt = f"以下是项目完整的README内容：\n{self.full_readme}\n\n请基于完整README重新生成安装配置命令序列："
+        self.full_readme = ""
+        response_text, commands = self._request_commands(prompt, message_history, self._get_system_prompt(), "full_readme")
+        if not response_text:
+            return [], message_history
+        message_history.extend([
+            {"role": "user", "content": prompt},
+            {"role": "assistant", "content": response_text},
+        ])
+        commands = [c for c in commands if c.upper() != FULL_README_MARKER]
+        return commands, message_history
+
+    def report_stats(self):
+        """输出本次会话的调用统计：启用模型路由时显示快速模型与强模型的延迟和成功率"""
+        if self.router and self.model_for("fast") != self.model_for("strong"):
+            self.router.stats.display([f"{tier}:{self.model_for(tier)}" for tier in ("strong", "fast")])
 
 
 class DashScopeProvider(LLMProvider):
     """通义千问API提供商"""
+
+    supports_structured_output = True
     
     def __init__(self, api_key: str, model_name: str = "qwen-turbo", install_directory: str = None):
         super().__init__(api_key, model_name, install_directory)
@@ -237,25 +475,30 @@ class DashScopeProvider(LLMProvider):
             console.print("[ERROR] 未安装 dashscope 库，请运行: pip install dashscope")
             raise
     
-    def _call_api(self, prompt: str, message_history: List[Dict] = None) -> str:
+    def _call_api(self, prompt: str, message_history: List[Dict] = None, system_prompt: str = None, tier: str = "strong") -> str:
         """调用通义千问API"""
         try:
-            if message_history:
-                # 使用对话历史
-                messages = message_history.copy()
+            # 结构化输出模式使用 JSON Mode（提示词中需要包含 JSON 字样，系统提示词已包含）
+            extra = {"response_format": {"type": "json_object"}} if self.structured_output else {}
+            if message_history or system_prompt:
+                # 使用对话历史，系统提示词作为 system 角色放在最前面
+                messages = [{"role": "system", "content": system_prompt}] if system_prompt else []
+                messages.extend(message_history or [])
                 messages.append({"role": "user", "content": prompt})
                 
                 response = self.dashscope.Generation.call(
-                    model=self.model_name,
+                    model=self.model_for(tier),
                     messages=messages,
-                    result_format='message'
+                    result_format='message',
+                    **extra
                 )
             else:
                 # 单次请求
                 response = self.dashscope.Generation.call(
-                    model=self.model_name,
+                    model=self.model_for(tier),
                     prompt=prompt,
-                    result_format='message'
+                    result_format='message',
+                    **extra
                 )
             
             if response.status_code == 200:
@@ -271,19 +514,23 @@ class DashScopeProvider(LLMProvider):
 
 class GeminiProvider(LLMProvider):
     """Google Gemini API提供商"""
+
+    supports_structured_output = True
     
     def __init__(self, api_key: str, model_name: str = "gemini-1.5-flash-latest", install_directory: str = None):
         super().__init__(api_key, model_name, install_directory)
         try:
             from google import genai
+            from google.genai import types
             self.genai = genai
+            self.types = types
             # 使用 Client 而不是 GenerativeModel
             self.client = genai.Client(api_key=api_key)
         except ImportError:
             console.print("[ERROR] 未安装 google-genai 库，请运行: pip install google-genai")
             raise
     
-    def _call_api(self, prompt: str, message_history: List[Dict] = None) -> str:
+    def _call_api(self, prompt: str, message_history: List[Dict] = None, system_prompt: str = None, tier: str = "strong") -> str:
         """调用Gemini API"""
         try:
             # 构建消息格式，参考 installer-gemini.py 的格式
@@ -294,9 +541,9 @@ class GeminiProvider(LLMProvider):
                 converted_history = []
                 for msg in message_history:
                     if isinstance(msg, dict) and 'role' in msg and 'content' in msg:
-                        # 转换为 Gemini 格式
+                        # 转换为 Gemini 格式（Gemini 使用 model 表示助手角色）
                         converted_msg = {
-                            "role": msg['role'],
+                            "role": "model" if msg['role'] == "assistant" else msg['role'],
                             "parts": [{'text': msg['content']}]
                         }
                         converted_history.append(converted_msg)
@@ -308,10 +555,19 @@ class GeminiProvider(LLMProvider):
             else:
                 request_contents = [user_message_content]
             
-            # 使用 client.models.generate_content 方法
+            # 使用 client.models.generate_content 方法，系统提示词通过 system_instruction 发送
+            # 结构化输出模式要求返回符合 RESPONSE_SCHEMA 的 JSON
+            config_args = {}
+            if system_prompt:
+                config_args["system_instruction"] = system_prompt
+            if self.structured_output:
+                config_args["response_mime_type"] = "application/json"
+                config_args["response_schema"] = RESPONSE_SCHEMA
+            config = self.types.GenerateContentConfig(**config_args) if config_args else None
             response = self.client.models.generate_content(
-                model=self.model_name,
-                contents=request_contents
+                model=self.model_for(tier),
+                contents=request_contents,
+                config=config
             )
             
             if response.text:
@@ -335,8 +591,363 @@ class GeminiProvider(LLMProvider):
             return ""
 
 
+class OpenAICompatibleProvider(LLMProvider):
+    """
+    OpenAI 兼容的 Chat Completions 接口（llama.cpp server、vLLM、Ollama 等本地模型）。
+    使用 requests.Session 复用连接，流式读取响应（超时按两个数据块之间的间隔计算，生成时间长也不会超时）。
+    """
+
+    supports_structured_output = True
+
+    def __init__(self, api_key: str, model_name: str, base_url: str, install_directory: str = None, timeout: float = 120.0, stream: bool = True):
+        super().__init__(api_key, model_name, install_directory)
+        try:
+            import requests
+            from requests.adapters import HTTPAdapter
+        except ImportError:
+            console.print("[ERROR] 未安装 requests 库，请运行: pip install requests")
+            raise
+        self.requests = requests
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self.stream = stream
+        # 守护进程中多个任务共用同一个会话（for_session 浅复制），连接池要容纳并发请求
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        if api_key:
+            self.session.headers["Authorization"] = f"Bearer {api_key}"
+        # 部分服务不支持 response_format，遇到 400 错误后关闭 JSON 模式
+        self.json_mode = self.structured_output
+        if model_name == "auto":
+            self.model_name = self._detect_model()
+
+    def _detect_model(self) -> str:
+        """未指定模型时使用服务列出的第一个模型（llama.cpp 只有一个模型，Ollama/vLLM 需要模型名）"""
+        try:
+            response = self.session.get(f"{self.base_url}/models", timeout=10)
+            response.raise_for_status()
+            model = response.json()["data"][0]["id"]
+            console.print(f"[INFO] OpenAI 兼容接口未指定模型，使用服务提供的 {model}。")
+            return model
+        except (self.requests.RequestException, ValueError, KeyError, IndexError) as e:
+            console.print(f"[WARN] 无法获取 OpenAI 兼容接口的模型列表，请设置 OPENAI_COMPAT_MODEL_NAME: {e}")
+            return "default"
+
+    def _post(self, messages: List[Dict], model: str):
+        payload = {"model": model, "messages": messages, "stream": self.stream}
+        if self.json_mode:
+            payload["response_format"] = {"type": "json_object"}
+        return self.session.post(f"{self.base_url}/chat/completions", json=payload, stream=self.stream, timeout=(10, self.timeout))
+
+    def _read_stream(self, response) -> str:
+        """读取 SSE 流：每个 data 行是一个增量，data: [DONE] 表示结束"""
+        # text/event-stream 通常不带 charset，requests 会按 ISO-8859-1 解码
+        response.encoding = "utf-8"
+        parts = []
+        # 读到流结束（[DONE] 之后还有分块结束标记），连接才会放回连接池复用
+        for line in response.iter_lines(decode_unicode=True):
+            if not line or not line.startswith("data:"):
+                continue
+            data = line[len("data:"):].strip()
+            if data == "[DONE]":
+                continue
+            choices = json.loads(data).get("choices") or []
+            if choices:
+                parts.append((choices[0].get("delta") or {}).get("content") or "")
+        return "".join(parts)
+
+    def _call_api(self, prompt: str, message_history: List[Dict] = None, system_prompt: str = None, tier: str = "strong") -> str:
+        """调用 OpenAI 兼容接口"""
+        messages = [{"role": "system", "content": system_prompt}] if system_prompt else []
+        messages.extend({"role": msg["role"], "content": msg["content"]} for msg in message_history or [])
+        messages.append({"role": "user", "content": prompt})
+        try:
+            response = self._post(messages, self.model_for(tier))
+            if response.status_code == 400 and self.json_mode:
+                console.print("[WARN] OpenAI 兼容接口不支持 JSON 模式（response_format），改为普通输出，由提示词约束格式。")
+                response.close()
+                self.json_mode = False
+                response = self._post(messages, self.model_for(tier))
+            with response:
+                if response.status_code != 200:
+                    console.print(f"[ERROR] API调用失败: {response.status_code} - {response.text[:500]}")
+                    return ""
+                if self.stream:
+                    text = self._read_stream(response)
+                else:
+                    text = response.json()["choices"][0]["message"]["content"] or ""
+            # 推理模型（如 DeepSeek-R1、Qwen3）会先输出 <think> 思考过程
+            return re.sub(r"<think>.*?</think>", "", text, flags=re.S).strip()
+        except (self.requests.RequestException, ValueError, KeyError, IndexError) as e:
+            console.print(f"[ERROR] 调用 OpenAI 兼容接口时出错: {e}")
+            return ""
+
+
+class ProviderStats:
+    """记录各提供商的延迟与成功率，并持久化到本地，供路由时优先选择更快更稳的提供商"""
+
+    def __init__(self, stats_file: str = None):
+        self.stats_file = stats_file or get_data_path("provider_stats.json")
+        self.lock = threading.Lock()
+        self.stats = self._load()
+
+    def _load(self) -> Dict[str, Dict[str, float]]:
+        try:
+            with open(self.stats_file, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save(self):
+        try:
+            with open(self.stats_file, "w", encoding="utf-8") as f:
+                json.dump(self.stats, f, ensure_ascii=False, indent=2)
+        except OSError as e:
+            console.print(f"[WARN] 保存提供商统计失败: {e}")
+
+    def record(self, name: str, latency: float, success: bool):
+        """记录一次调用的延迟与结果"""
+        with self.lock:
+            entry = self.stats.setdefault(name, {"calls": 0, "successes": 0, "total_latency": 0.0, "ewma_latency": latency})
+            entry["calls"] += 1
+            entry["total_latency"] += latency
+            if success:
+                entry["successes"] += 1
+                # 只用成功调用更新平滑延迟，失败/超时的耗时不代表正常响应速度
+                entry["ewma_latency"] = 0.7 * entry["ewma_latency"] + 0.3 * latency
+            self._save()
+
+    def success_rate(self, name: str) -> float:
+        entry = self.stats.get(name)
+        if not entry or not entry["calls"]:
+            return 1.0
+        return entry["successes"] / entry["calls"]
+
+    def rank(self, names: List[str]) -> List[str]:
+        """按成功率降序、平滑延迟升序排序；没有历史数据的提供商保持原顺序"""
+        def key(item):
+            index, name = item
+            entry = self.stats.get(name)
+            if not entry:
+                return (0, 0.0, index)
+            return (-round(self.success_rate(name), 1), entry["ewma_latency"], index)
+        return [name for _, name in sorted(enumerate(names), key=key)]
+
+    def display(self, names: List[str]):
+        """以表格形式显示统计信息"""
+        table = Table(title="提供商调用统计", style="cyan")
+        table.add_column("提供商", style="magenta")
+        table.add_column("调用次数", justify="right")
+        table.add_column("成功率", justify="right")
+        table.add_column("平均延迟(s)", justify="right")
+        table.add_column("平滑延迟(s)", justify="right")
+        for name in names:
+            entry = self.stats.get(name)
+            if not entry:
+                continue
+            avg = entry["total_latency"] / entry["calls"] if entry["calls"] else 0.0
+            table.add_row(name, str(entry["calls"]), f"{self.success_rate(name):.0%}", f"{avg:.2f}", f"{entry['ewma_latency']:.2f}")
+        console.print(table)
+
+
+class RouterStats(ProviderStats):
+    """
+    模型路由统计：按 tier:模型 记录每次请求的延迟和是否返回可用命令，
+    以及该模型生成的命令执行结果（下一轮开始时得知），用于调整路由阈值
+    """
+
+    def record_outcome(self, name: str, success: bool):
+        """记录某模型生成的命令是否执行成功"""
+        with self.lock:
+            entry = self.stats.setdefault(name, {"calls": 0, "successes": 0, "total_latency": 0.0, "ewma_latency": 0.0})
+            entry["outcomes"] = entry.get("outcomes", 0) + 1
+            if success:
+                entry["outcome_successes"] = entry.get("outcome_successes", 0) + 1
+            self._save()
+
+    def display(self, names: List[str]):
+        table = Table(title="模型路由统计", style="cyan")
+        table.add_column("模型", style="magenta")
+        table.add_column("请求次数", justify="right")
+        table.add_column("有效响应", justify="right")
+        table.add_column("平均延迟(s)", justify="right")
+        table.add_column("平滑延迟(s)", justify="right")
+        table.add_column("命令执行成功率", justify="right")
+        for name in names:
+            entry = self.stats.get(name)
+            if not entry:
+                continue
+            avg = entry["total_latency"] / entry["calls"] if entry["calls"] else 0.0
+            outcomes = entry.get("outcomes", 0)
+            outcome_rate = f"{entry.get('outcome_successes', 0) / outcomes:.0%} ({outcomes})" if outcomes else "-"
+            table.add_row(name, str(entry["calls"]), f"{self.success_rate(name):.0%}", f"{avg:.2f}", f"{entry['ewma_latency']:.2f}", outcome_rate)
+        console.print(table)
+
+
+# 明显需要深入分析的错误（编译、依赖冲突、CUDA 等），即使是第一次失败也使用强模型
+COMPLEX_ERROR_PATTERN = re.compile(
+    r"Traceback \(most recent call last\)|CMake Error|subprocess-exited-with-error|Failed building wheel|"
+    r"ResolutionImpossible|conflicting dependencies|UnsatisfiableError|undefined reference|"
+    r"Segmentation fault|nvcc|CUDA|ld returned|fatal error:"
+)
+
+
+class ModelRouter:
+    """
+    按轮次在快速模型与强模型之间选择：初始计划、补发 README、格式修正和命令成功后的后续规划都使用强模型；
+    命令失败后的修复轮次按错误签名、输出大小、轮次数和连续失败次数判断，简单的修复交给快速模型。
+    阈值可以通过环境变量调整，RouterStats 中的延迟和执行成功率用于评估阈值是否合适。
+    """
+
+    def __init__(self, stats: RouterStats = None):
+        self.stats = stats or RouterStats(get_data_path("model_router_stats.json"))
+        # 输出超过该字符数时错误往往比较复杂
+        self.max_output_chars = int(os.getenv("ROUTER_FAST_MAX_OUTPUT_CHARS", "4000"))
+        # 连续失败达到该次数后升级到强模型
+        self.escalate_after = int(os.getenv("ROUTER_ESCALATE_AFTER", "2"))
+        # 会话中的修复轮次超过该数量后不再使用快速模型
+        self.max_fast_turns = int(os.getenv("ROUTER_FAST_MAX_TURNS", "10"))
+
+    def choose(self, stdout: str, stderr: str, fix_turn: int, consecutive_failures: int, repeated_signature: bool) -> Tuple[str, str]:
+        """为修复轮次选择 tier，返回 (tier, 原因)"""
+        output_chars = len(stdout or "") + len(stderr or "")
+        if consecutive_failures >= self.escalate_after:
+            return "strong", f"连续失败 {consecutive_failures} 次"
+        if repeated_signature:
+            return "strong", "同样的错误再次出现"
+        if fix_turn > self.max_fast_turns:
+            return "strong", f"已进行 {fix_turn} 轮修复"
+        if output_chars > self.max_output_chars:
+            return "strong", f"输出较长（{output_chars} 字符）"
+        match = COMPLEX_ERROR_PATTERN.search(stderr or stdout or "")
+        if match:
+            return "strong", f"复杂错误: {match.group(0)}"
+        return "fast", f"简单修复：输出 {output_chars} 字符，第 {fix_turn} 轮修复"
+
+
+_model_router = None
+_model_router_lock = threading.Lock()
+
+
+def get_model_router() -> ModelRouter:
+    """所有提供商共用一个路由器，统计写入同一个文件"""
+    global _model_router
+    with _model_router_lock:
+        if _model_router is None:
+            _model_router = ModelRouter()
+        return _model_router
+
+
+class MultiProvider(LLMProvider):
+    """组合提供商：初始计划同时请求多个后端并采用最先解析成功的结果，后续轮次按统计排序依次故障转移"""
+
+    def __init__(self, providers: Dict[str, LLMProvider], install_directory: str = None, timeout: float = 60.0, race_initial: bool = True, stats: ProviderStats = None):
+        self.providers = providers
+        self.timeout = timeout
+        self.race_initial = race_initial
+        self.stats = stats or ProviderStats()
+        self.last_provider = None
+        # 所有后端都支持时才使用结构化输出，保证竞速和故障转移时的提示词与解析方式一致
+        self.supports_structured_output = all(p.supports_structured_output for p in providers.values())
+        super().__init__(None, " + ".join(p.model_name for p in providers.values()), install_directory)
+
+    def _stats_key(self, name: str, tier: str = "strong") -> str:
+        return f"{name}:{self.providers[name].model_for(tier)}"
+
+    def model_for(self, tier: str) -> str:
+        return " + ".join(p.model_for(tier) for p in self.providers.values())
+
+    def _timed_call(self, name: str, prompt: str, message_history: List[Dict] = None, system_prompt: str = None, tier: str = "strong") -> str:
+        """调用单个提供商并记录延迟；只有能解析出命令的响应才算成功"""
+        start = time.monotonic()
+        try:
+            response_text = self.providers[name]._call_api(prompt, message_history, system_prompt, tier)
+        except Exception as e:
+            console.print(f"[WARN] {name} 调用出错: {e}")
+            response_text = ""
+        success = bool(response_text) and self._parses_to_commands(response_text)
+        self.stats.record(self._stats_key(name, tier), time.monotonic() - start, success)
+        return response_text if success else ""
+
+    def _ordered_names(self, tier: str = "strong") -> List[str]:
+        keys = {self._stats_key(name, tier): name for name in self.providers}
+        return [keys[key] for key in self.stats.rank(list(keys))]
+
+    def _race(self, prompt: str, system_prompt: str = None) -> str:
+        """同时请求所有提供商，返回最先得到有效解析的响应"""
+        executor = ThreadPoolExecutor(max_workers=len(self.providers))
+        # 在调用方的上下文中执行，工作线程的输出与调用方写到同一个控制台
+        futures = {executor.submit(contextvars.copy_context().run, self._timed_call, name, prompt, None, system_prompt): name for name in self.providers}
+        deadline = time.monotonic() + self.timeout
+        pending = set(futures)
+        try:
+            while pending:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    console.print("[WARN] 所有提供商均未在超时时间内返回有效结果。")
+                    break
+                done, pending = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+                for future in done:
+                    response_text = future.result()
+                    if response_text:
+                        self.last_provider = futures[future]
+                        console.print(f"[INFO] 竞速结果：采用 {self.last_provider} 的响应。")
+                        return response_text
+            return ""
+        finally:
+            # 不等待落后的请求，它们完成后只会更新统计
+            executor.shutdown(wait=False)
+
+    def _failover(self, prompt: str, message_history: List[Dict] = None, system_prompt: str = None, tier: str = "strong") -> str:
+        """按统计排序依次尝试各提供商，出错、空响应或超时则切换到下一个"""
+        executor = ThreadPoolExecutor(max_workers=len(self.providers))
+        try:
+            for name in self._ordered_names(tier):
+                history = [dict(msg) for msg in message_history] if message_history else None
+                future = executor.submit(contextvars.copy_context().run, self._timed_call, name, prompt, history, system_prompt, tier)
+                try:
+                    response_text = future.result(timeout=self.timeout)
+                except Exception:
+                    console.print(f"[WARN] {name} 超过 {self.timeout:.0f} 秒未响应，切换提供商...")
+                    continue
+                if response_text:
+                    self.last_provider = name
+                    return response_text
+                console.print(f"[WARN] {name} 未返回有效结果，切换提供商...")
+            return ""
+        finally:
+            executor.shutdown(wait=False)
+
+    def _call_api(self, prompt: str, message_history: List[Dict] = None, system_prompt: str = None, tier: str = "strong") -> str:
+        """初始请求（无历史）竞速，后续请求故障转移"""
+        if not message_history and self.race_initial and len(self.providers) > 1:
+            return self._race(prompt, system_prompt)
+        return self._failover(prompt, message_history, system_prompt, tier)
+
+    def for_session(self, install_directory: str) -> "LLMProvider":
+        session = super().for_session(install_directory)
+        session.providers = {name: provider.for_session(install_directory) for name, provider in self.providers.items()}
+        session.last_provider = None
+        return session
+
+    def report_stats(self):
+        self.stats.display([self._stats_key(name) for name in self.providers])
+        super().report_stats()
+
+
 def create_llm_provider(provider_name: str, config: Dict[str, Any], install_directory: str = None) -> Optional[LLMProvider]:
-    """创建LLM提供商实例"""
+    """创建LLM提供商实例；配置了快速模型（fast_model）时启用模型路由"""
+    provider = _create_llm_provider(provider_name, config, install_directory)
+    if provider and config.get("fast_model") and config["fast_model"] != provider.model_name:
+        provider.fast_model_name = config["fast_model"]
+        provider.router = get_model_router()
+        console.print(f"[INFO] 已启用模型路由：简单的修复轮次使用 {provider.fast_model_name}，其余轮次使用 {provider.model_name}。")
+    return provider
+
+
+def _create_llm_provider(provider_name: str, config: Dict[str, Any], install_directory: str = None) -> Optional[LLMProvider]:
     try:
         if provider_name == "qwen":
             return DashScopeProvider(
@@ -350,9 +961,37 @@ def create_llm_provider(provider_name: str, config: Dict[str, Any], install_dire
                 model_name=config["model"],
                 install_directory=install_directory
             )
+        elif provider_name == "openai_compat":
+            return OpenAICompatibleProvider(
+                api_key=os.getenv("OPENAI_COMPAT_API_KEY"),
+                model_name=config["model"],
+                base_url=config["base_url"],
+                install_directory=install_directory,
+                timeout=float(os.getenv("OPENAI_COMPAT_TIMEOUT", "120")),
+                stream=os.getenv("OPENAI_COMPAT_STREAM", "1") != "0"
+            )
         else:
             console.print(f"[ERROR] 不支持的提供商: {provider_name}")
             return None
     except Exception as e:
         console.print(f"[ERROR] 创建{provider_name}提供商时出错: {e}")
-        return None
\ No newline at end of file
+        return None
+
+
+def create_multi_provider(available_apis: Dict[str, Dict[str, Any]], install_directory: str = None) -> Optional[LLMProvider]:
+    """用所有可用的API创建组合提供商"""
+    providers = {}
+    for name, config in available_apis.items():
+        provider = create_llm_provider(name, config, install_directory)
+        if provider:
+            providers[name] = provider
+    if not providers:
+        return None
+    if len(providers) == 1:
+        return next(iter(providers.values()))
+    timeout = float(os.getenv("MULTI_PROVIDER_TIMEOUT", "60"))
+    race_initial = os.getenv("MULTI_PROVIDER_RACE", "1") != "0"
+    multi_provider = MultiProvider(providers, install_directory, timeout=timeout, race_initial=race_initial)
+    if any(provider.router for provider in providers.values()):
+        multi_provider.router = get_model_router()
+    return multi_provider
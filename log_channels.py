@@ -0,0 +1,349 @@
+import atexit
+import contextvars
+import gzip
+import io
+import itertools
+import os
+import queue
+import re
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from rich.console import Console
+from rich.text import Text
+
+# 队列中最多缓存的记录数；写线程跟不上时丢弃新的记录并计数，产生日志的线程从不等待磁盘或终端
+QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "20000"))
+# 写线程每次最多取出的记录数，取完一批后刷新一次压缩文件
+BATCH_SIZE = 1000
+# 通道前缀：auto 时多个通道同时活动（并行的试验、守护进程中同时执行的任务）才加前缀，always 总是加，never 不加
+PREFIX_MODE = os.getenv("LOG_PREFIX", "auto")
+PREFIX_STYLES = ["cyan", "magenta", "green", "yellow", "blue", "bright_red", "bright_cyan", "bright_magenta"]
+ANSI_ESCAPE = re.compile(r"\x1b\[[0-9;?]*[A-Za-z]")
+FLUSH_TIMEOUT = 5.0
+
+_current_channel = contextvars.ContextVar("log_channel", default=None)
+
+
+class LogChannel:
+    """
+    日志通道：会话、会话中的一条命令、并行试验中的一个方案各对应一个通道，子通道写入所属会话的日志。
+    write() 只把记录放进写线程的队列；console_for() 返回写入该通道的 rich 控制台，模块中的 console.print 经 ConsoleProxy 转到这里。
+    """
+
+    def __init__(self, writer: "LogWriter", label: str, parent: Optional["LogChannel"] = None, echo_output: bool = False):
+        self.writer = writer
+        self.label = label
+        self.parent = parent
+        self.session: "SessionLog" = parent.session if parent else self
+        # 不含会话名的前缀（写入会话自己的日志）和完整前缀（多个会话写到同一个终端）
+        self.relative_prefix = " ".join(c.label for c in self._ancestors() if c.parent)
+        self.prefix = " ".join(c.label for c in self._ancestors())
+        # 命令输出是否也显示在终端（有实时输出视图的命令不需要）
+        self.echo_output = echo_output
+        self.style = PREFIX_STYLES[next(writer.style_counter) % len(PREFIX_STYLES)]
+        self._consoles: Dict[int, Console] = {}
+        self._command_counter = itertools.count(1)
+        self.closed = False
+        writer.control(("open", self))
+
+    def _ancestors(self) -> List["LogChannel"]:
+        chain, channel = [], self
+        while channel:
+            chain.append(channel)
+            channel = channel.parent
+        return chain[::-1]
+
+    def write(self, text: str, kind: str = "message"):
+        """kind 为 message（控制台消息）、stdout 或 stderr（命令输出）"""
+        self.writer.submit(("write", self, kind, text, time.time()))
+
+    def child(self, label: str, echo_output: bool = False) -> "LogChannel":
+        return LogChannel(self.writer, label, self, echo_output)
+
+    def next_command_label(self) -> str:
+        return f"#{next(self.session._command_counter)}"
+
+    def console_for(self, target: Console) -> Console:
+        """与 target 宽度、颜色设置相同，但写入本通道的控制台"""
+        console = self._consoles.get(id(target))
+        if console is None:
+            console = Console(
+                file=ChannelFile(self), width=target.width, color_system=target.color_system,
+                force_terminal=target.is_terminal, highlight=False,
+            )
+            self._consoles[id(target)] = console
+        return console
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.writer.control(("close", self))
+
+
+class SessionLog(LogChannel):
+    """一次安装会话的根通道：所有子通道的记录写入同一个 gzip 压缩的日志文件，并分发给会话的输出（终端、任务日志等）"""
+
+    def __init__(self, writer: "LogWriter", label: str, path: str, sinks: List):
+        self.path = path
+        self.sinks = sinks
+        self.secrets: List[str] = []
+        self.file = None
+        super().__init__(writer, label)
+
+    def add_secret(self, value: str):
+        """登记需要在日志文件中隐藏的值（占位符的值）"""
+        if value and value not in self.secrets:
+            self.secrets.append(value)
+
+    def mask(self, text: str) -> str:
+        for secret in self.secrets:
+            text = text.replace(secret, "******")
+        return text
+
+
+class ChannelFile(io.TextIOBase):
+    """rich 控制台的输出文件：按行写入通道"""
+
+    def __init__(self, channel: LogChannel):
+        self.channel = channel
+        self.buffer = ""
+        self.lock = threading.Lock()
+
+    def write(self, text: str) -> int:
+        with self.lock:
+            self.buffer += text
+            *lines, self.buffer = self.buffer.split("\n")
+        for line in lines:
+            self.channel.write(line)
+        return len(text)
+
+    def flush(self):
+        pass
+
+    def isatty(self) -> bool:
+        return False
+
+
+class TerminalSink:
+    """
+    把记录显示在终端控制台上。多个通道同时活动时每行前加上通道前缀（不同通道不同颜色），
+    include_session 时前缀带上会话名（多个会话共用一个终端）；mask 时隐藏占位符的值。
+    """
+
+    def __init__(self, console: Console, include_session: bool = False, mask: bool = False):
+        self.console = console
+        self.include_session = include_session
+        self.mask = mask
+
+    def __call__(self, channel: LogChannel, kind: str, text: str, prefixed: bool):
+        if kind != "message" and not channel.echo_output:
+            return
+        if self.mask:
+            text = channel.session.mask(text)
+        body = Text.from_ansi(text) if "\x1b" in text else Text(text)
+        if kind == "stderr":
+            body.stylize("red")
+        elif kind == "stdout":
+            body.stylize("dim")
+        prefix = channel.prefix if self.include_session else channel.relative_prefix
+        if prefixed and prefix:
+            body = Text.assemble((f"[{prefix}] ", channel.style), body)
+        self.console.print(body, soft_wrap=True, highlight=False)
+
+
+class LogWriter:
+    """
+    后台写日志线程：产生日志的线程只把记录放进有界队列（不做任何 I/O，不会被慢终端或磁盘阻塞），
+    写线程按顺序写入各会话的 gzip 文件并分发给会话的输出，每取完一批刷新一次文件。
+    """
+
+    def __init__(self):
+        self.queue: "queue.Queue" = queue.Queue(maxsize=QUEUE_SIZE)
+        self.style_counter = itertools.count()
+        self.dropped: Dict[SessionLog, int] = {}
+        self.dropped_lock = threading.Lock()
+        # 只在写线程中访问：打开的通道和每个通道打开的子通道数
+        self.open_channels: Dict[LogChannel, int] = {}
+        self.thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+        self.thread.start()
+
+    def submit(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            with self.dropped_lock:
+                session = record[1].session
+                self.dropped[session] = self.dropped.get(session, 0) + 1
+
+    def control(self, record):
+        """打开/关闭通道等控制记录不能丢弃"""
+        self.queue.put(record)
+
+    def flush(self, timeout: float = FLUSH_TIMEOUT):
+        """等待已提交的记录全部写出（询问用户之前、会话结束时调用）"""
+        if threading.current_thread() is self.thread:
+            return
+        done = threading.Event()
+        try:
+            self.queue.put(("flush", done), timeout=timeout)
+        except queue.Full:
+            return
+        done.wait(timeout)
+
+    def shutdown(self, timeout: float = FLUSH_TIMEOUT):
+        """进程退出时写出剩余的记录，并关闭仍在写的会话日志（补全 gzip 结尾）"""
+        done = threading.Event()
+        try:
+            self.queue.put(("shutdown", done), timeout=timeout)
+        except queue.Full:
+            return
+        done.wait(timeout)
+
+    def _multiplexed(self, channel: LogChannel, include_session: bool) -> bool:
+        """范围内（同一会话，或 include_session 时所有会话）是否有多个叶子通道同时打开"""
+        if PREFIX_MODE != "auto":
+            return PREFIX_MODE == "always"
+        leaves = [c for c, children in self.open_channels.items() if not children and (include_session or c.session is channel.session)]
+        return len(leaves) > 1
+
+    def _open(self, channel: LogChannel):
+        self.open_channels[channel] = 0
+        if channel.parent in self.open_channels:
+            self.open_channels[channel.parent] += 1
+        if isinstance(channel, SessionLog):
+            os.makedirs(os.path.dirname(channel.path), exist_ok=True)
+            channel.file = gzip.open(channel.path, "at", encoding="utf-8", errors="replace")
+
+    def _close(self, channel: LogChannel):
+        self.open_channels.pop(channel, None)
+        if channel.parent in self.open_channels:
+            self.open_channels[channel.parent] -= 1
+        if isinstance(channel, SessionLog) and channel.file:
+            channel.file.close()
+            channel.file = None
+
+    def _write(self, channel: LogChannel, kind: str, text: str, timestamp: float):
+        session = channel.session
+        if session.file:
+            line = ANSI_ESCAPE.sub("", session.mask(text)).rstrip()
+            label = f"[{channel.relative_prefix}] " if channel.relative_prefix else ""
+            marker = "[stderr] " if kind == "stderr" else ""
+            session.file.write(f"{datetime.fromtimestamp(timestamp).strftime('%H:%M:%S.%f')[:-3]} {label}{marker}{line}\n")
+        for sink in session.sinks:
+            try:
+                sink(channel, kind, text, self._multiplexed(channel, getattr(sink, "include_session", False)))
+            except Exception:
+                # 输出出错（终端关闭等）不影响日志文件
+                pass
+
+    def _report_dropped(self):
+        with self.dropped_lock:
+            dropped, self.dropped = self.dropped, {}
+        for session, count in dropped.items():
+            self._write(session, "message", f"[WARN] 日志队列已满，丢弃了 {count} 条记录", time.time())
+
+    def _run(self):
+        while True:
+            batch = [self.queue.get()]
+            try:
+                while len(batch) < BATCH_SIZE:
+                    batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                pass
+            touched = set()
+            for record in batch:
+                op = record[0]
+                try:
+                    if op == "write":
+                        self._write(*record[1:])
+                        touched.add(record[1].session)
+                    elif op == "open":
+                        self._open(record[1])
+                    elif op == "close":
+                        self._close(record[1])
+                    elif op == "flush":
+                        self._flush_files(touched)
+                        record[1].set()
+                    elif op == "shutdown":
+                        for channel in [c for c in self.open_channels if isinstance(c, SessionLog)]:
+                            self._close(channel)
+                        record[1].set()
+                except OSError:
+                    pass
+            self._report_dropped()
+            self._flush_files(touched)
+
+    @staticmethod
+    def _flush_files(sessions):
+        for session in sessions:
+            if session.file:
+                # 同步刷新压缩流：进程意外退出时已写出的部分仍可以用 zcat 读取
+                session.file.flush()
+        sessions.clear()
+
+
+_writer: Optional[LogWriter] = None
+_writer_lock = threading.Lock()
+
+
+def get_log_writer() -> LogWriter:
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            _writer = LogWriter()
+            atexit.register(_writer.shutdown)
+        return _writer
+
+
+def flush_logs():
+    if _writer is not None:
+        _writer.flush()
+
+
+def get_channel() -> Optional[LogChannel]:
+    return _current_channel.get()
+
+
+@contextmanager
+def use_channel(channel: Optional[LogChannel]):
+    """在当前线程（上下文）中把日志写入 channel，退出时关闭该通道"""
+    token = _current_channel.set(channel)
+    try:
+        yield channel
+    finally:
+        _current_channel.reset(token)
+        if channel:
+            channel.close()
+
+
+@contextmanager
+def child_channel(label: str = None, echo_output: bool = False):
+    """在当前通道下打开子通道（label 省略时按会话中的命令序号命名）；当前没有通道时什么都不做"""
+    parent = get_channel()
+    if not parent:
+        yield None
+        return
+    with use_channel(parent.child(label or parent.next_command_label(), echo_output)) as channel:
+        yield channel
+
+
+def session_log_path(label: str) -> str:
+    """gzip 压缩的会话日志路径，与命令输出日志放在同一个目录下的 sessions 子目录中"""
+    from output_view import get_log_directory
+    name = re.sub(r"[^A-Za-z0-9_.-]+", "_", label).strip("_") or "session"
+    return os.path.join(get_log_directory(), "sessions", f"{datetime.now().strftime('%Y%m%d-%H%M%S-%f')}-{name}.log.gz")
+
+
+def open_session_log(label: str, sinks: List) -> SessionLog:
+    return SessionLog(get_log_writer(), label, session_log_path(label), sinks)
+
+
+def log_secret(value: str):
+    """当前会话日志中隐藏该值"""
+    channel = get_channel()
+    if channel:
+        channel.session.add_secret(value)
@@ -0,0 +1,128 @@
+import os
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+from rich.console import Console, Group
+from rich.live import Live
+from rich.panel import Panel
+from rich.text import Text
+
+from app_paths import get_data_path
+from interaction import get_interaction
+from log_channels import flush_logs, get_channel
+
+
+def get_log_directory() -> str:
+    """命令输出日志目录，可通过 INSTALLER_LOG_DIR 覆盖"""
+    log_dir = os.getenv("INSTALLER_LOG_DIR") or get_data_path("logs")
+    os.makedirs(log_dir, exist_ok=True)
+    return log_dir
+
+
+def _format_bytes(size: int) -> str:
+    for unit in ("B", "KB", "MB", "GB"):
+        if size < 1024 or unit == "GB":
+            return f"{size:.0f}{unit}" if unit == "B" else f"{size:.1f}{unit}"
+        size /= 1024
+
+
+class LiveOutputView:
+    """
+    命令输出的实时视图：输出行先进入缓冲区，按固定帧率刷新终端，只显示滚动的末尾若干行和行数/字节计数。
+    完整输出原样写入日志文件，不做 rich 标记解析。
+    """
+
+    def __init__(self, command: str, fps: float = None, tail_lines: int = None, log_path: str = None, target_console: Console = None):
+        self.command = command
+        self.fps = fps or float(os.getenv("OUTPUT_REFRESH_FPS", "8"))
+        self.tail = deque(maxlen=tail_lines or int(os.getenv("OUTPUT_TAIL_LINES", "15")))
+        # 刷新线程中无法确定当前的交互实现，创建时就确定要输出到的控制台
+        self.console = target_console or get_interaction().console
+        # 输出同时写入当前的日志通道（会话日志）；读取线程中没有上下文，创建时确定
+        self.channel = get_channel()
+        self.lock = threading.Lock()
+        self.line_count = 0
+        self.byte_count = 0
+        self.stderr_count = 0
+        self.start_time = None
+        self.log_path = log_path or os.path.join(get_log_directory(), datetime.now().strftime("%Y%m%d-%H%M%S-%f") + ".log")
+        self.log_file = None
+        self.live = None
+
+    def _open_log(self):
+        self.start_time = time.monotonic()
+        self.log_file = open(self.log_path, "w", encoding="utf-8", errors="replace", buffering=1024 * 1024)
+        self.log_file.write(f"$ {self.command}\n")
+
+    def __enter__(self):
+        self._open_log()
+        # 面板直接画在终端上，先写出通道中排队的消息（如 [CMD] 正在执行）
+        flush_logs()
+        self.live = Live(get_renderable=self._render, console=self.console, refresh_per_second=self.fps, transient=False)
+        self.live.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.live.stop()
+        self.log_file.close()
+        return False
+
+    def add(self, line: str, stream: str = "stdout"):
+        """添加一行输出（可在多个读取线程中调用）"""
+        with self.lock:
+            self.line_count += 1
+            self.byte_count += len(line)
+            if stream == "stderr":
+                self.stderr_count += 1
+                self.tail.append(("stderr", line))
+                self.log_file.write("[stderr] " + line)
+            else:
+                self.tail.append(("stdout", line))
+                self.log_file.write(line)
+        if self.channel:
+            self.channel.write(line.rstrip("\n"), stream)
+
+    def _render(self):
+        with self.lock:
+            lines = list(self.tail)
+            line_count, byte_count, stderr_count = self.line_count, self.byte_count, self.stderr_count
+        elapsed = max(time.monotonic() - self.start_time, 1e-6)
+        body = Text()
+        for i, (stream, line) in enumerate(lines):
+            # Text 直接追加纯文本，不解析输出中的 [xxx] 标记
+            body.append(("\n" if i else "") + line.rstrip("\n")[:300], style="red" if stream == "stderr" else None)
+        status = Text(
+            f"行数 {line_count}（stderr {stderr_count}）  大小 {_format_bytes(byte_count)}  "
+            f"{line_count / elapsed:,.0f} 行/秒  用时 {elapsed:.1f}s  日志 {self.log_path}",
+            style="dim",
+        )
+        return Panel(Group(body, status), title="命令输出（末尾）", border_style="blue")
+
+    def summary(self) -> str:
+        elapsed = time.monotonic() - self.start_time if self.start_time else 0.0
+        return f"共 {self.line_count} 行（{_format_bytes(self.byte_count)}），用时 {elapsed:.1f}s，完整输出见 {self.log_path}"
+
+
+class StreamOutputView(LiveOutputView):
+    """
+    不渲染终端的输出视图：输出同样写入日志文件，并逐行交给 sink(line, stream)。
+    用于守护进程的任务日志等没有终端的场合。
+    """
+
+    def __init__(self, command: str, sink, log_path: str = None):
+        super().__init__(command, log_path=log_path)
+        self.sink = sink
+
+    def __enter__(self):
+        self._open_log()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.log_file.close()
+        return False
+
+    def add(self, line: str, stream: str = "stdout"):
+        super().add(line, stream)
+        self.sink(line, stream)
@@ -0,0 +1,84 @@
+import os
+import re
+from typing import List, Dict
+
+from interaction import ConsoleProxy, ask
+
+console = ConsoleProxy()
+
+PLACEHOLDER_PATTERN = re.compile(r"<YOUR_[A-Za-z0-9_\-]*_HERE>")
+ENV_PREFIX = "INSTALLER_SECRET_"
+
+
+def extract_placeholders(commands: List[str]) -> List[str]:
+    """按出现顺序提取一批命令中的全部占位符（去重）"""
+    found = []
+    for command in commands:
+        found.extend(PLACEHOLDER_PATTERN.findall(command))
+    return list(dict.fromkeys(found))
+
+
+def placeholder_name(placeholder: str) -> str:
+    """<YOUR_OPENAI_API_KEY_HERE> -> OPENAI_API_KEY"""
+    return placeholder[len("<YOUR_"):-len("_HERE>")].upper().replace("-", "_")
+
+
+def fill_placeholders(command: str, values: Dict[str, str]) -> str:
+    """替换命令中所有已知的占位符"""
+    return PLACEHOLDER_PATTERN.sub(lambda match: values.get(match.group(0), match.group(0)), command)
+
+
+def restore_placeholders(command: str, values: Dict[str, str]) -> str:
+    """fill_placeholders 的逆操作：把命令中已解析的值换回占位符，避免密钥写入计划缓存等记录"""
+    for placeholder, value in sorted(values.items(), key=lambda item: len(item[1]), reverse=True):
+        if value:
+            command = command.replace(value, placeholder)
+    return command
+
+
+def resolve_placeholders(placeholders: List[str], scope: str = None, known: Dict[str, str] = None) -> Dict[str, str]:
+    """
+    解析占位符的值，依次查找：已知的值、环境变量 INSTALLER_SECRET_<NAME>、本地加密密钥存储（先 owner/repo:NAME 再 NAME），
+    其余的一次性询问用户，并可选择保存到密钥存储。返回 {占位符: 值}（包含 known）。
+    """
+    values = dict(known or {})
+    missing = [p for p in placeholders if p not in values]
+    if not missing:
+        return values
+
+    for placeholder in list(missing):
+        value = os.getenv(ENV_PREFIX + placeholder_name(placeholder))
+        if value is not None:
+            values[placeholder] = value
+            missing.remove(placeholder)
+            console.print(f"[INFO] {placeholder} 使用环境变量 {ENV_PREFIX}{placeholder_name(placeholder)} 的值。")
+    if not missing:
+        return values
+
+    # 只有确实需要时才打开密钥存储，避免没有占位符的会话也生成密钥文件
+    from secret_store import SecretStore
+    store = SecretStore()
+    for placeholder in list(missing):
+        value = store.get(placeholder_name(placeholder), scope) if store.available else None
+        if value is not None:
+            values[placeholder] = value
+            missing.remove(placeholder)
+            console.print(f"[INFO] {placeholder} 使用本地密钥存储中保存的值。")
+    if not missing:
+        return values
+
+    console.print(f"\n[bold yellow][INPUT][/bold yellow] 接下来的命令需要以下 {len(missing)} 项信息，输入后整批命令无需再中途等待输入:")
+    for placeholder in missing:
+        console.print(f"  [yellow]{placeholder}[/yellow]")
+    entered = {}
+    for placeholder in missing:
+        entered[placeholder] = ask("placeholder", f"请输入 {placeholder} 的值: ", placeholder=placeholder, name=placeholder_name(placeholder))
+    values.update(entered)
+
+    if store.available:
+        choice = ask("save_placeholders", "保存到本地加密密钥存储，下次自动使用？仅本仓库 (r) / 所有仓库 (a) / 不保存 (n) [n]: ").strip().lower()
+        if choice in ("r", "a"):
+            for placeholder, value in entered.items():
+                store.set(placeholder_name(placeholder), value, scope if choice == "r" else None)
+            console.print("[INFO] 已保存到本地密钥存储。")
+    return values
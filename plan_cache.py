@@ -0,0 +1,81 @@
+import json
+import platform
+import threading
+import time
+from typing import List, Dict, Optional
+
+from app_paths import get_data_path
+from interaction import ConsoleProxy
+
+console = ConsoleProxy()
+
+# 缓存的命令中用该标记代替安装目录，重放时替换为本次的安装目录
+INSTALL_DIR_TOKEN = "@@INSTALL_DIR@@"
+
+
+def plan_key(owner: str, repo_name: str, commit_sha: str) -> str:
+    """缓存键：仓库 + 提交 + 操作系统 + 架构"""
+    return f"{owner}/{repo_name}@{commit_sha}:{platform.system()}:{platform.machine()}"
+
+
+def dedupe_commands(commands: List[str]) -> List[str]:
+    """去掉重复的命令，保留第一次出现的位置"""
+    seen = set()
+    result = []
+    for command in commands:
+        if command not in seen:
+            seen.add(command)
+            result.append(command)
+    return result
+
+
+class PlanCache:
+    """按 (owner, repo, commit SHA, OS, arch) 保存成功安装的命令序列"""
+
+    def __init__(self, path: str = None):
+        self.path = path or get_data_path("plan_cache.json")
+        self.lock = threading.Lock()
+        self.plans: Dict[str, Dict] = self._load()
+
+    def _load(self) -> Dict[str, Dict]:
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save(self):
+        try:
+            with open(self.path, "w", encoding="utf-8") as f:
+                json.dump(self.plans, f, ensure_ascii=False, indent=2)
+        except OSError as e:
+            console.print(f"[WARN] 保存安装计划缓存失败: {e}")
+
+    def get(self, owner: str, repo_name: str, commit_sha: str, install_directory: str) -> Optional[List[str]]:
+        """返回该提交已验证的命令序列（安装目录已替换），没有缓存返回 None"""
+        plan = self.plans.get(plan_key(owner, repo_name, commit_sha))
+        if not plan:
+            return None
+        return [command.replace(INSTALL_DIR_TOKEN, install_directory) for command in plan["commands"]]
+
+    def save(self, owner: str, repo_name: str, commit_sha: str, commands: List[str], install_directory: str):
+        """保存成功安装的命令序列；命令应为替换占位符之前的形式，避免把用户输入的密钥写入缓存"""
+        commands = dedupe_commands(commands)
+        if not commands:
+            return
+        with self.lock:
+            plan = self.plans.setdefault(plan_key(owner, repo_name, commit_sha), {})
+            plan["commands"] = [command.replace(install_directory, INSTALL_DIR_TOKEN) for command in commands]
+            plan["saved"] = time.time()
+            self._save()
+        console.print(f"[INFO] 已缓存 {owner}/{repo_name}@{commit_sha[:7]} 的安装命令（{len(commands)} 条），下次可直接重放。")
+
+    def record_replay(self, owner: str, repo_name: str, commit_sha: str, success: bool):
+        """记录一次重放结果"""
+        with self.lock:
+            plan = self.plans.get(plan_key(owner, repo_name, commit_sha))
+            if not plan:
+                return
+            plan["replays"] = plan.get("replays", 0) + 1
+            plan["replay_successes"] = plan.get("replay_successes", 0) + (1 if success else 0)
+            self._save()
@@ -0,0 +1,182 @@
+import json
+import os
+import platform
+import re
+import shutil
+import subprocess
+from typing import List, Dict, Optional
+
+from command_policy import split_command
+from interaction import ConsoleProxy
+
+console = ConsoleProxy()
+
+# 不需要检查 PATH 的 shell 内建命令和关键字
+SHELL_BUILTINS = {
+    "cd", "export", "source", ".", "set", "unset", "echo", "true", "false", "test", "[", "exit", "alias", "eval", "exec",
+    "if", "then", "else", "fi", "for", "while", "do", "done", "case", "esac", "function", "{", "}", "time", "command",
+    "type", "hash", "ulimit", "umask", "pushd", "popd", "read", "printf", "wait", "shopt", "trap", "return", "local",
+}
+CMD_BUILTINS = {"dir", "copy", "del", "erase", "md", "mkdir", "rd", "rmdir", "move", "ren", "rename", "type", "call", "cls", "start", "ver", "vol", "path", "title", "setlocal", "endlocal"}
+ENV_ASSIGNMENT = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*=")
+CONDA_EXECUTABLES = ("conda", "mamba", "micromamba")
+
+
+def _command_words(tokens: List[str]) -> List[str]:
+    """去掉段首的环境变量赋值和 sudo"""
+    tokens = list(tokens)
+    while tokens and ENV_ASSIGNMENT.match(tokens[0]):
+        tokens.pop(0)
+    if tokens and tokens[0] in ("sudo", "doas"):
+        tokens.pop(0)
+        while tokens and tokens[0].startswith("-"):
+            tokens.pop(0)
+    return tokens
+
+
+def _env_bin_dirs(prefix: str) -> List[str]:
+    if platform.system() == "Windows":
+        return [prefix, os.path.join(prefix, "Scripts"), os.path.join(prefix, "Library", "bin")]
+    return [os.path.join(prefix, "bin")]
+
+
+class PreflightChecker:
+    """
+    执行前的快速检查：只检查确定会失败的情况（命令不在 PATH 中、cd 的目录不存在、要激活的 conda 环境或 venv 不存在），
+    不启动命令本身。一旦遇到会改变系统状态的段（安装、克隆等）就停止检查，避免误判后面依赖它的段。
+    """
+
+    def __init__(self):
+        self.windows = platform.system() == "Windows"
+        self._conda_envs: Optional[Dict[str, str]] = None
+
+    def conda_envs(self, refresh: bool = False) -> Optional[Dict[str, str]]:
+        """返回 {环境名: 路径}；找不到 conda 或查询失败时返回 None（此时不检查环境）"""
+        if self._conda_envs is not None and not refresh:
+            return self._conda_envs
+        conda = shutil.which("conda") or os.getenv("CONDA_EXE") or shutil.which("mamba")
+        if not conda:
+            return None
+        try:
+            result = subprocess.run([conda, "env", "list", "--json"], capture_output=True, text=True, timeout=30)
+            prefixes = json.loads(result.stdout)["envs"]
+        except (OSError, subprocess.SubprocessError, ValueError, KeyError):
+            return None
+        self._conda_envs = {os.path.basename(prefix.rstrip("/\\")): prefix for prefix in prefixes}
+        if prefixes:
+            self._conda_envs["base"] = prefixes[0]
+        return self._conda_envs
+
+    def _envs_dirs(self) -> List[str]:
+        dirs = [d for d in os.getenv("CONDA_ENVS_PATH", "").split(os.pathsep) if d]
+        conda = os.getenv("CONDA_EXE") or shutil.which("conda")
+        if conda:
+            dirs.append(os.path.join(os.path.dirname(os.path.dirname(conda)), "envs"))
+        dirs.append(os.path.join(os.path.expanduser("~"), ".conda", "envs"))
+        return dirs
+
+    def _find_conda_env(self, name: str, cwd: str) -> Optional[str]:
+        """返回环境路径；确定不存在时返回 ""；无法判断时返回 None"""
+        if "/" in name or "\\" in name:
+            path = os.path.join(cwd, os.path.expanduser(name))
+            return path if os.path.isdir(path) else ""
+        # 快速路径：直接查看常见的环境目录，找不到时再查询 conda（约需 1~2 秒，结果会缓存）
+        for envs_dir in self._envs_dirs():
+            if os.path.isdir(os.path.join(envs_dir, name, "conda-meta")):
+                return os.path.join(envs_dir, name)
+        conda = os.getenv("CONDA_EXE") or shutil.which("conda")
+        if name == "base" and conda:
+            return os.path.dirname(os.path.dirname(conda))
+        cached = self._conda_envs is not None
+        envs = self.conda_envs()
+        if envs is None:
+            return None
+        if name not in envs and cached:
+            # 环境可能是在上次查询之后创建的，重新查询一次
+            envs = self.conda_envs(refresh=True) or {}
+        return envs.get(name, "")
+
+    def _check_executable(self, word: str, cwd: str, search_dirs: List[str], path_changed: bool) -> Optional[str]:
+        if word in SHELL_BUILTINS or (self.windows and word.lower() in CMD_BUILTINS):
+            return None
+        if "/" in word or (self.windows and "\\" in word):
+            path = os.path.join(cwd, os.path.expanduser(word))
+            return None if os.path.exists(path) else f"可执行文件不存在: {path}"
+        for directory in search_dirs:
+            if shutil.which(word, path=directory):
+                return None
+        if path_changed or shutil.which(word):
+            return None
+        if word in CONDA_EXECUTABLES and os.getenv("CONDA_EXE"):
+            return None
+        where = "PATH 和已激活的环境" if search_dirs else "PATH"
+        return f"找不到命令 {word}：不在 {where} 中，需要先安装或激活包含它的环境"
+
+    def check(self, command: str) -> Optional[str]:
+        """返回确定会失败的原因，没有发现问题时返回 None"""
+        try:
+            parts = split_command(command)
+        except ValueError:
+            return None
+
+        cwd = os.getcwd()
+        search_dirs: List[str] = []
+        path_changed = False
+        for operator, tokens in parts:
+            # || | & 之后的段是否执行、在什么环境中执行取决于前面的结果
+            if operator not in ("", "&&", ";"):
+                return None
+            words = _command_words(tokens)
+            if not words or any("$" in word or "`" in word or "*" in word for word in words):
+                return None
+            executable = words[0]
+
+            if executable.lower() == "cd":
+                targets = [word for word in words[1:] if word.lower() != "/d"]
+                target = targets[0] if targets else "~"
+                if target == "-":
+                    return None
+                path = os.path.normpath(os.path.join(cwd, os.path.expanduser(target)))
+                if not os.path.isdir(path):
+                    return f"目录不存在: {path}（cd {target}）"
+                cwd = path
+                continue
+
+            if executable in ("export", "set"):
+                path_changed = path_changed or any(word.upper().startswith("PATH=") for word in words[1:])
+                continue
+
+            # conda activate NAME，以及旧版的 source activate NAME
+            if words[1:2] == ["activate"] and executable in CONDA_EXECUTABLES + ("source", "."):
+                error = self._check_executable(executable, cwd, search_dirs, path_changed) if executable in CONDA_EXECUTABLES else None
+                if error:
+                    return error
+                name = words[2] if len(words) > 2 else "base"
+                prefix = self._find_conda_env(name, cwd)
+                if prefix == "":
+                    return f"conda 环境不存在: {name}（需要先 conda create -n {name} 创建）"
+                search_dirs = _env_bin_dirs(prefix) if prefix else []
+                path_changed = path_changed or prefix is None
+                continue
+
+            if executable in ("source", ".") and len(words) > 1:
+                script = os.path.join(cwd, os.path.expanduser(words[1]))
+                if not os.path.exists(script):
+                    return f"要 source 的文件不存在: {script}"
+                if os.path.basename(script) == "activate":
+                    search_dirs = [os.path.dirname(script)]
+                else:
+                    # 任意脚本都可能修改 PATH
+                    path_changed = True
+                continue
+
+            # 第一条真正执行操作的命令：只检查可执行文件，之后的段可能依赖它的结果
+            return self._check_executable(executable, cwd, search_dirs, path_changed)
+        return None
+
+
+def create_preflight_checker() -> Optional[PreflightChecker]:
+    """PREFLIGHT=0 时关闭执行前检查"""
+    if os.getenv("PREFLIGHT", "1") == "0":
+        return None
+    return PreflightChecker()
@@ -0,0 +1,275 @@
+import os
+import platform
+import re
+import signal
+import subprocess
+import threading
+import time
+from typing import List, Dict, Optional
+
+from interaction import ConsoleProxy
+
+try:
+    import psutil
+except ImportError:
+    # 没有 psutil 时 Linux 读取 /proc，其他系统只按输出判断空闲
+    psutil = None
+
+console = ConsoleProxy()
+
+# 各类命令的默认超时：idle 为既没有输出也没有 CPU/IO 活动的最长时间，total 为总时长上限（秒）
+DEFAULT_PROFILES = {
+    "clone": {"idle": 120, "total": 1800},
+    "download": {"idle": 180, "total": 3600},
+    "install": {"idle": 300, "total": 3600},
+    "build": {"idle": 600, "total": 7200},
+    "default": {"idle": 300, "total": 3600},
+}
+
+COMMAND_CLASSES = [
+    ("clone", re.compile(r"\bgit\s+(clone|fetch|pull|submodule)\b|\bgit\s+lfs\s+(pull|fetch)\b")),
+    ("download", re.compile(r"\b(wget|curl|gdown|aria2c)\b|\bhuggingface-cli\s+download\b|\bpip3?\s+download\b")),
+    ("build", re.compile(r"\b(make|cmake|ninja|bazel|cargo\s+build|go\s+build)\b|\bsetup\.py\s+(build\w*|install|develop)\b|\bpip3?\s+install\s+.*(-e\s+)?\.(\s|$)")),
+    ("install", re.compile(r"\b(pip3?|uv\s+pip|conda|mamba|npm|yarn|pnpm|poetry|apt(-get)?|brew)\s+(install|create|env\s+create|update|sync|add|i|ci)\b")),
+]
+
+# 根据历史耗时学习总时长上限：至少需要的样本数、倍数和下限
+MIN_SAMPLES = 5
+LEARNED_MULTIPLIER = 4
+LEARNED_MIN_TOTAL = 600
+ACTIVITY_SAMPLE_INTERVAL = 5.0
+
+
+def classify_command(command: str) -> str:
+    """按 && 连接的最后一段判断命令类别"""
+    segment = command.rsplit("&&", 1)[-1]
+    for name, pattern in COMMAND_CLASSES:
+        if pattern.search(segment):
+            return name
+    return "default"
+
+
+def _percentile(values: List[float], q: float) -> float:
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, round(q * (len(values) - 1))))
+    return values[index]
+
+
+class TimeoutProfiles:
+    """每类命令的超时设置；有足够的历史样本时，总时长上限取成功执行耗时 p95 的若干倍"""
+
+    def __init__(self, samples: Dict[str, List[float]] = None):
+        self.profiles = {name: dict(profile, samples=0) for name, profile in DEFAULT_PROFILES.items()}
+        scale = float(os.getenv("WATCHDOG_TIMEOUT_SCALE", "1"))
+        for profile in self.profiles.values():
+            profile["idle"] *= scale
+            profile["total"] *= scale
+        for name, durations in (samples or {}).items():
+            if len(durations) >= MIN_SAMPLES:
+                profile = self.profiles[name]
+                profile["total"] = max(LEARNED_MIN_TOTAL, LEARNED_MULTIPLIER * _percentile(durations, 0.95))
+                profile["samples"] = len(durations)
+
+    @classmethod
+    def from_store(cls, store, limit: int = 5000) -> "TimeoutProfiles":
+        """从会话库中最近的成功命令学习"""
+        samples: Dict[str, List[float]] = {}
+        try:
+            rows = store.query("SELECT command, duration FROM commands WHERE success = 1 AND duration IS NOT NULL ORDER BY started_at DESC LIMIT ?", (limit,))
+        except Exception as e:
+            console.print(f"[WARN] 读取历史命令耗时失败，使用默认超时: {e}")
+            rows = []
+        for row in rows:
+            samples.setdefault(classify_command(row["command"]), []).append(row["duration"])
+        return cls(samples)
+
+    def for_command(self, command: str) -> Dict:
+        name = classify_command(command)
+        return dict(self.profiles[name], name=name)
+
+
+_profiles_cache: Dict[str, TimeoutProfiles] = {}
+
+
+def get_timeout_profiles(store=None) -> TimeoutProfiles:
+    """按数据库缓存学习结果，每个进程只查询一次"""
+    key = store.path if store else ""
+    if key not in _profiles_cache:
+        _profiles_cache[key] = TimeoutProfiles.from_store(store) if store else TimeoutProfiles()
+    return _profiles_cache[key]
+
+
+def _proc_tree_pids(root_pid: int) -> List[int]:
+    children: Dict[int, List[int]] = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat", "r") as f:
+                ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, ValueError, IndexError):
+            continue
+        children.setdefault(ppid, []).append(int(entry))
+    pids, stack = [], [root_pid]
+    while stack:
+        pid = stack.pop()
+        pids.append(pid)
+        stack.extend(children.get(pid, []))
+    return pids
+
+
+def process_tree_activity(pid: int) -> Optional[float]:
+    """
+    返回进程树累计的 CPU 时间与读写字节数的组合值，两次采样不同说明仍有活动；无法获取时返回 None。
+    读写字节包括网络读写（Linux 的 rchar/wchar），因此没有输出的下载也算活动。
+    """
+    if psutil:
+        try:
+            root = psutil.Process(pid)
+            total = 0.0
+            for process in [root] + root.children(recursive=True):
+                try:
+                    cpu = process.cpu_times()
+                    total += cpu.user + cpu.system
+                    if hasattr(process, "io_counters"):
+                        io = process.io_counters()
+                        total += getattr(io, "read_chars", io.read_bytes) + getattr(io, "write_chars", io.write_bytes)
+                except (psutil.NoSuchProcess, psutil.AccessDenied):
+                    continue
+            return total
+        except psutil.Error:
+            return None
+    if not os.path.isdir("/proc"):
+        return None
+    total = 0.0
+    for child in _proc_tree_pids(pid):
+        try:
+            with open(f"/proc/{child}/stat", "r") as f:
+                fields = f.read().rsplit(")", 1)[1].split()
+            total += int(fields[11]) + int(fields[12])
+            with open(f"/proc/{child}/io", "r") as f:
+                for line in f:
+                    if line.startswith(("rchar:", "wchar:")):
+                        total += int(line.split()[1])
+        except (OSError, ValueError, IndexError):
+            continue
+    return total
+
+
+def popen_group_kwargs(attach_terminal: bool = False) -> Dict:
+    """
+    让命令在独立的进程组中运行，超时时可以终止整个进程组；同时脱离控制终端，SSH 等不会卡在终端提示上。
+    attach_terminal 时（终端中交互执行的命令）保留在安装器的前台进程组中，sudo 密码、git 凭据等提示可以照常输入，
+    独立的进程组在后台，读取终端时会被 SIGTTIN 挂起；终止时改为逐个终止进程树中的进程。
+    """
+    if platform.system() == "Windows":
+        return {"creationflags": subprocess.CREATE_NEW_PROCESS_GROUP}
+    if attach_terminal:
+        return {}
+    return {"start_new_session": True}
+
+
+def _signal_tree(process: subprocess.Popen, sig: int):
+    """向命令的进程组发送信号；命令没有独立的进程组时发给进程树中的每个进程"""
+    if os.getpgid(process.pid) == process.pid:
+        os.killpg(process.pid, sig)
+        return
+    pids = [process.pid]
+    if psutil:
+        try:
+            pids += [child.pid for child in psutil.Process(process.pid).children(recursive=True)]
+        except psutil.Error:
+            pass
+    elif os.path.isdir("/proc"):
+        pids = _proc_tree_pids(process.pid)
+    for pid in pids:
+        try:
+            os.kill(pid, sig)
+        except ProcessLookupError:
+            continue
+
+
+def kill_process_tree(process: subprocess.Popen, grace: float = 5.0):
+    """先 SIGTERM 整个进程组（或进程树），grace 秒后仍未退出则 SIGKILL"""
+    if platform.system() == "Windows":
+        subprocess.run(["taskkill", "/F", "/T", "/PID", str(process.pid)], capture_output=True)
+        process.wait()
+        return
+    try:
+        _signal_tree(process, signal.SIGTERM)
+        process.wait(timeout=grace)
+    except subprocess.TimeoutExpired:
+        try:
+            _signal_tree(process, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+        process.wait()
+    except ProcessLookupError:
+        process.wait()
+
+
+class CommandWatchdog:
+    """
+    监视一条命令：记录最后一次输出的时间，并定期采样进程树的 CPU/IO 活动。
+    超过空闲上限（既没有输出也没有活动）或总时长上限时 check() 返回终止原因。
+    """
+
+    def __init__(self, command: str, profile: Dict):
+        self.command = command
+        self.profile = profile
+        self.lock = threading.Lock()
+        self.start = time.monotonic()
+        self.last_output = self.start
+        self.last_activity = self.start
+        self.last_sample_time = 0.0
+        self.last_sample = None
+
+    def output(self):
+        """读取线程每收到一行输出调用一次"""
+        with self.lock:
+            self.last_output = time.monotonic()
+
+    def _sample(self, pid: int, now: float):
+        if now - self.last_sample_time < min(ACTIVITY_SAMPLE_INTERVAL, self.profile["idle"] / 3):
+            return
+        self.last_sample_time = now
+        sample = process_tree_activity(pid)
+        if sample is not None and sample != self.last_sample:
+            if self.last_sample is not None:
+                self.last_activity = now
+            self.last_sample = sample
+
+    def check(self, pid: int) -> Optional[Dict]:
+        now = time.monotonic()
+        self._sample(pid, now)
+        with self.lock:
+            last_output = self.last_output
+        elapsed = now - self.start
+        idle = now - max(last_output, self.last_activity)
+        if elapsed > self.profile["total"]:
+            return {"reason": "total_timeout", "command_class": self.profile["name"], "limit": self.profile["total"], "elapsed": elapsed, "idle": idle}
+        if idle > self.profile["idle"]:
+            return {"reason": "idle_timeout", "command_class": self.profile["name"], "limit": self.profile["idle"], "elapsed": elapsed, "idle": idle}
+        return None
+
+
+def create_watchdog(command: str, store=None) -> Optional[CommandWatchdog]:
+    """WATCHDOG=0 时不监视（命令可以一直运行）"""
+    if os.getenv("WATCHDOG", "1") == "0":
+        return None
+    profile = get_timeout_profiles(store).for_command(command)
+    learned = f"，总时长上限根据 {profile['samples']} 次历史执行学习" if profile["samples"] else ""
+    console.print(f"[dim][CMD] 超时设置: {profile['name']} 类命令，空闲 {profile['idle']:.0f}s，总计 {profile['total']:.0f}s{learned}[/dim]")
+    return CommandWatchdog(command, profile)
+
+
+def describe_termination(termination: Dict) -> str:
+    """把终止原因整理成发给大模型的说明；其他来源的终止原因（如致命错误规则）自带 message"""
+    if termination["reason"] == "idle_timeout":
+        return (f"[超时] 命令已被终止：连续 {termination['idle']:.0f} 秒没有任何输出，进程也没有 CPU/IO 活动"
+                f"（{termination['command_class']} 类命令的空闲上限为 {termination['limit']:.0f} 秒，共运行 {termination['elapsed']:.0f} 秒）。"
+                "可能在等待输入（如 SSH 主机密钥确认、密码、交互式确认）或下载卡住。")
+    if termination["reason"] == "total_timeout":
+        return (f"[超时] 命令已被终止：运行了 {termination['elapsed']:.0f} 秒，超过 {termination['command_class']} 类命令的总时长上限"
+                f" {termination['limit']:.0f} 秒（最近 {termination['idle']:.0f} 秒没有输出）。")
+    return termination.get("message") or f"[终止] {termination}"
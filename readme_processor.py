@@ -0,0 +1,149 @@
+import os
+import re
+from typing import List, Dict, Tuple
+
+# 标题中出现这些词的章节与安装高度相关
+INSTALL_HEADING_KEYWORDS = [
+    "install", "installation", "setup", "set up", "requirement", "prerequisite", "dependenc",
+    "quick start", "quickstart", "getting started", "get started", "build", "environment",
+    "usage", "configuration", "docker", "from source", "develop",
+    "安装", "环境", "依赖", "快速开始", "快速上手", "配置", "使用", "编译", "部署",
+]
+
+# 标题中出现这些词的章节基本与安装无关
+NOISE_HEADING_KEYWORDS = [
+    "changelog", "change log", "release", "news", "citation", "cite", "bibtex", "license",
+    "acknowledg", "contributor", "contributing", "benchmark", "result", "performance", "faq",
+    "star history", "contact", "sponsor", "roadmap", "todo", "paper", "reference",
+    "更新", "引用", "致谢", "许可", "贡献", "性能", "结果", "联系", "论文",
+]
+
+# 正文/代码块中出现这些命令说明章节包含安装步骤
+INSTALL_COMMAND_PATTERN = re.compile(
+    r"^\s*(?:\$\s*)?(?:sudo\s+)?(?:pip3?|python3?\s+-m\s+pip|conda|mamba|uv|poetry|pipx|git\s+clone|npm|yarn|pnpm|"
+    r"cargo|go\s+(?:get|install|build)|make|cmake|docker|apt(?:-get)?|brew|python3?\s+setup\.py|bash\s+\S+\.sh|\./\S+\.sh)\b",
+    re.IGNORECASE | re.MULTILINE,
+)
+
+BADGE_PATTERN = re.compile(r"^\s*(?:\[!\[.*?\]\(.*?\)\]\(.*?\)\s*|!\[.*?\]\(.*?\)\s*|<img[^>]*>\s*|\.\. image::.*)+$", re.IGNORECASE)
+FENCE_PATTERN = re.compile(r"^\s*(```|~~~)")
+ATX_HEADING_PATTERN = re.compile(r"^\s{0,3}(#{1,6})\s+(.*?)\s*#*\s*$")
+UNDERLINE_PATTERN = re.compile(r"^([=\-~^\"'`#*+.:_])\1{2,}\s*$")
+
+DEFAULT_MAX_CHARS = 6000
+SUMMARY_MAX_CHARS = 600
+
+# 大模型需要完整 README 时返回的标记
+FULL_README_MARKER = "NEED_FULL_README"
+
+
+def split_sections(text: str) -> List[Dict]:
+    """将 markdown/rst 文本按标题拆分为章节，返回 [{'level', 'heading', 'body'}]，第一个章节为标题前的内容"""
+    lines = text.splitlines()
+    sections = [{"level": 0, "heading": "", "lines": []}]
+    rst_levels = []  # rst 标题层级由下划线字符出现顺序决定
+    in_fence = False
+    i = 0
+    while i < len(lines):
+        line = lines[i]
+        if FENCE_PATTERN.match(line):
+            in_fence = not in_fence
+            sections[-1]["lines"].append(line)
+            i += 1
+            continue
+        if not in_fence:
+            atx = ATX_HEADING_PATTERN.match(line)
+            if atx:
+                sections.append({"level": len(atx.group(1)), "heading": atx.group(2).strip(), "lines": []})
+                i += 1
+                continue
+            next_line = lines[i + 1] if i + 1 < len(lines) else ""
+            if line.strip() and UNDERLINE_PATTERN.match(next_line) and len(next_line.strip()) >= len(line.strip()) * 0.6:
+                char = next_line.strip()[0]
+                if char not in rst_levels:
+                    rst_levels.append(char)
+                sections.append({"level": rst_levels.index(char) + 1, "heading": line.strip(), "lines": []})
+                i += 2
+                continue
+        sections[-1]["lines"].append(line)
+        i += 1
+
+    return [
+        {"level": s["level"], "heading": s["heading"], "body": "\n".join(s["lines"]).strip()}
+        for s in sections
+        if s["heading"] or "\n".join(s["lines"]).strip()
+    ]
+
+
+def score_section(heading: str, body: str) -> float:
+    """按安装相关性给章节打分，分数越高越相关"""
+    heading_lower = heading.lower()
+    score = 0.0
+    if any(keyword in heading_lower for keyword in INSTALL_HEADING_KEYWORDS):
+        score += 5.0
+    if any(keyword in heading_lower for keyword in NOISE_HEADING_KEYWORDS):
+        score -= 6.0
+    command_lines = len(INSTALL_COMMAND_PATTERN.findall(body))
+    score += min(command_lines, 5) * 1.5
+    if "requirements.txt" in body or "environment.yml" in body or "pyproject.toml" in body:
+        score += 1.0
+    return score
+
+
+def _strip_badges(text: str) -> str:
+    return "\n".join(line for line in text.splitlines() if not BADGE_PATTERN.match(line))
+
+
+def build_summary(sections: List[Dict]) -> Tuple[str, int]:
+    """取项目标题和第一段说明作为简短摘要，同时返回摘要所在章节的下标（没有则为 -1）"""
+    title = next((s["heading"] for s in sections if s["heading"]), "")
+    for index, section in enumerate(sections[:3]):
+        paragraphs = [p.strip() for p in re.split(r"\n\s*\n", section["body"]) if p.strip()]
+        for paragraph in paragraphs:
+            if not FENCE_PATTERN.match(paragraph) and not paragraph.startswith(("<", "|")):
+                summary = paragraph[:SUMMARY_MAX_CHARS]
+                return f"{title}\n{summary}".strip(), index
+    return title, -1
+
+
+def condense_readme(readme_content: str, max_chars: int = None) -> str:
+    """
+    提取 README 中与安装相关的章节，加上简短摘要，并限制总长度。
+    README 本身足够短时只去掉徽章后原样返回；max_chars <= 0 表示不精简。
+    """
+    if max_chars is None:
+        max_chars = int(os.getenv("README_MAX_CHARS", str(DEFAULT_MAX_CHARS)))
+    if max_chars <= 0:
+        return readme_content
+    cleaned = _strip_badges(readme_content)
+    if len(cleaned) <= max_chars:
+        return cleaned
+
+    sections = split_sections(cleaned)
+    summary, summary_index = build_summary(sections)
+    scored = [
+        (score_section(s["heading"], s["body"]), index, s)
+        for index, s in enumerate(sections)
+        # 摘要已覆盖的章节和只有标题的章节不再重复收录
+        if s["body"] and not (index == summary_index and len(s["body"]) <= SUMMARY_MAX_CHARS)
+    ]
+    relevant = sorted((item for item in scored if item[0] > 0), key=lambda item: (-item[0], item[1]))
+
+    budget = max_chars - len(summary)
+    selected = []
+    for score, index, section in relevant:
+        block = f"{'#' * max(section['level'], 1)} {section['heading']}\n{section['body']}".strip()
+        if len(block) > budget:
+            if not selected and budget > 200:
+                selected.append((index, block[:budget]))
+                budget = 0
+            continue
+        selected.append((index, block))
+        budget -= len(block) + 2
+
+    if not selected:
+        return cleaned[:max_chars]
+
+    # 保持原文顺序，便于模型理解步骤先后
+    body = "\n\n".join(block for _, block in sorted(selected))
+    return f"{summary}\n\n{body}" if summary else body
@@ -0,0 +1,117 @@
+import argparse
+import getpass
+import json
+import os
+import threading
+from typing import Dict, Optional, List
+
+from app_paths import get_data_path
+from interaction import ConsoleProxy
+
+console = ConsoleProxy()
+
+
+class SecretStore:
+    """
+    本地加密的密钥存储（Fernet 加密，需要 cryptography 库）。
+    加密密钥取自环境变量 INSTALLER_SECRET_KEY，未设置时在数据目录生成仅当前用户可读的密钥文件。
+    """
+
+    def __init__(self, path: str = None, key_path: str = None):
+        self.path = path or get_data_path("secrets.enc")
+        self.key_path = key_path or get_data_path("secret.key")
+        self.lock = threading.Lock()
+        self.fernet = self._create_fernet()
+        self.secrets: Dict[str, str] = self._load() if self.fernet else {}
+
+    @property
+    def available(self) -> bool:
+        return self.fernet is not None
+
+    def _create_fernet(self):
+        try:
+            from cryptography.fernet import Fernet
+        except ImportError:
+            console.print("[WARN] 未安装 cryptography 库，本地密钥存储不可用，请运行: pip install cryptography")
+            return None
+        key = os.getenv("INSTALLER_SECRET_KEY")
+        if not key:
+            if os.path.exists(self.key_path):
+                with open(self.key_path, "rb") as f:
+                    key = f.read().strip()
+            else:
+                key = Fernet.generate_key()
+                fd = os.open(self.key_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+                with os.fdopen(fd, "wb") as f:
+                    f.write(key)
+        return Fernet(key)
+
+    def _load(self) -> Dict[str, str]:
+        if not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path, "rb") as f:
+                return json.loads(self.fernet.decrypt(f.read()).decode("utf-8"))
+        except Exception as e:
+            console.print(f"[WARN] 无法解密本地密钥存储（密钥不匹配或文件损坏）: {e}")
+            return {}
+
+    def _save(self):
+        data = self.fernet.encrypt(json.dumps(self.secrets).encode("utf-8"))
+        fd = os.open(self.path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+
+    def get(self, name: str, scope: str = None) -> Optional[str]:
+        """先查仓库范围（owner/repo:NAME），再查全局（NAME）"""
+        if scope and f"{scope}:{name}" in self.secrets:
+            return self.secrets[f"{scope}:{name}"]
+        return self.secrets.get(name)
+
+    def set(self, name: str, value: str, scope: str = None):
+        if not self.available:
+            return
+        with self.lock:
+            self.secrets[f"{scope}:{name}" if scope else name] = value
+            self._save()
+
+    def delete(self, key: str) -> bool:
+        if not self.available:
+            return False
+        with self.lock:
+            if key not in self.secrets:
+                return False
+            del self.secrets[key]
+            self._save()
+            return True
+
+    def keys(self) -> List[str]:
+        return sorted(self.secrets)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="管理本地加密的占位符值（API 密钥等）")
+    subparsers = parser.add_subparsers(dest="action", required=True)
+    set_parser = subparsers.add_parser("set", help="保存一个值，名称为占位符去掉 <YOUR_ 和 _HERE> 的部分，如 OPENAI_API_KEY")
+    set_parser.add_argument("name")
+    set_parser.add_argument("--repo", help="只用于某个仓库（owner/repo）")
+    subparsers.add_parser("list", help="列出已保存的名称")
+    delete_parser = subparsers.add_parser("delete", help="删除一个值（仓库范围的写作 owner/repo:NAME）")
+    delete_parser.add_argument("key")
+    args = parser.parse_args()
+
+    store = SecretStore()
+    if not store.available:
+        return
+    if args.action == "set":
+        store.set(args.name, getpass.getpass(f"{args.name} 的值: "), args.repo)
+        console.print("[INFO] 已保存。")
+    elif args.action == "list":
+        for key in store.keys():
+            console.print(key)
+    elif args.action == "delete":
+        console.print("[INFO] 已删除。" if store.delete(args.key) else "[WARN] 没有该名称。")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,306 @@
+import argparse
+import hashlib
+import os
+import sqlite3
+import statistics
+import threading
+import time
+from typing import Optional
+
+from rich.table import Table
+
+from app_paths import get_data_path
+from error_kb import fingerprint
+from interaction import ConsoleProxy
+
+console = ConsoleProxy()
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    started_at REAL NOT NULL,
+    ended_at REAL,
+    owner TEXT,
+    repo TEXT,
+    commit_sha TEXT,
+    provider TEXT,
+    model TEXT,
+    install_directory TEXT,
+    outcome TEXT,
+    llm_turns INTEGER DEFAULT 0,
+    commands INTEGER DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS llm_turns (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    session_id INTEGER NOT NULL REFERENCES sessions(id),
+    kind TEXT,
+    model TEXT,
+    started_at REAL NOT NULL,
+    duration REAL,
+    prompt_tokens INTEGER,
+    response_chars INTEGER,
+    success INTEGER
+);
+CREATE TABLE IF NOT EXISTS commands (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    session_id INTEGER NOT NULL REFERENCES sessions(id),
+    command TEXT,
+    started_at REAL NOT NULL,
+    duration REAL,
+    exit_code INTEGER,
+    success INTEGER,
+    error_signature TEXT,
+    output_digest TEXT,
+    output_bytes INTEGER
+);
+CREATE TABLE IF NOT EXISTS fast_path (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    session_id INTEGER NOT NULL REFERENCES sessions(id),
+    command TEXT,
+    translated TEXT,
+    started_at REAL NOT NULL,
+    fast_duration REAL,
+    fast_success INTEGER,
+    fallback_duration REAL,
+    fallback_success INTEGER
+);
+CREATE INDEX IF NOT EXISTS idx_sessions_repo ON sessions(owner, repo);
+CREATE INDEX IF NOT EXISTS idx_sessions_started ON sessions(started_at);
+CREATE INDEX IF NOT EXISTS idx_llm_turns_session ON llm_turns(session_id);
+CREATE INDEX IF NOT EXISTS idx_commands_session ON commands(session_id);
+CREATE INDEX IF NOT EXISTS idx_commands_signature ON commands(error_signature);
+CREATE INDEX IF NOT EXISTS idx_commands_started ON commands(started_at);
+CREATE INDEX IF NOT EXISTS idx_fast_path_session ON fast_path(session_id);
+"""
+
+
+class SessionStore:
+    """本地 SQLite 会话库：记录每次会话、大模型轮次和命令执行情况"""
+
+    def __init__(self, path: str = None):
+        self.path = path or os.getenv("INSTALLER_DB_PATH") or get_data_path("sessions.db")
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(self.path, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(SCHEMA)
+        self.conn.commit()
+
+    def execute(self, sql: str, params=()) -> sqlite3.Cursor:
+        with self.lock:
+            cursor = self.conn.execute(sql, params)
+            self.conn.commit()
+            return cursor
+
+    def query(self, sql: str, params=()):
+        with self.lock:
+            return self.conn.execute(sql, params).fetchall()
+
+    def start_session(self, owner: str, repo: str, commit_sha: Optional[str], provider: str, model: str, install_directory: str) -> "SessionRecorder":
+        cursor = self.execute(
+            "INSERT INTO sessions (started_at, owner, repo, commit_sha, provider, model, install_directory) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (time.time(), owner, repo, commit_sha, provider, model, install_directory),
+        )
+        return SessionRecorder(self, cursor.lastrowid)
+
+
+class SessionRecorder:
+    """单个会话的记录器，由大模型提供商和命令执行器调用"""
+
+    def __init__(self, store: SessionStore, session_id: int):
+        self.store = store
+        self.session_id = session_id
+        # 用户为占位符输入的值，写入数据库前替换为 ***
+        self.secrets = set()
+
+    def add_secret(self, value: str):
+        if value and value.strip():
+            self.secrets.add(value)
+
+    def _mask(self, text: str) -> str:
+        for secret in self.secrets:
+            text = text.replace(secret, "***")
+        return text
+
+    def record_llm_turn(self, kind: str, model: str, started_at: float, duration: float, prompt_tokens: int, response_text: str):
+        self.store.execute(
+            "INSERT INTO llm_turns (session_id, kind, model, started_at, duration, prompt_tokens, response_chars, success) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (self.session_id, kind, model, started_at, duration, prompt_tokens, len(response_text or ""), 1 if response_text else 0),
+        )
+        self.store.execute("UPDATE sessions SET llm_turns = llm_turns + 1 WHERE id = ?", (self.session_id,))
+
+    def record_command(self, command: str, started_at: float, duration: float, exit_code: Optional[int], stdout: str, stderr: str):
+        success = exit_code == 0
+        signature = None if success else fingerprint(stdout, stderr)[0]
+        output = f"{stdout}\0{stderr}".encode("utf-8", errors="replace")
+        self.store.execute(
+            "INSERT INTO commands (session_id, command, started_at, duration, exit_code, success, error_signature, output_digest, output_bytes) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (self.session_id, self._mask(command), started_at, duration, exit_code, 1 if success else 0, signature,
+             hashlib.sha1(output).hexdigest(), len(output) - 1),
+        )
+        self.store.execute("UPDATE sessions SET commands = commands + 1 WHERE id = ?", (self.session_id,))
+
+    def record_fast_path(self, command: str, translated: str, started_at: float, fast_duration: float, fast_success: bool,
+                         fallback_duration: Optional[float] = None, fallback_success: Optional[bool] = None):
+        """记录一次 uv 快速路径的执行：翻译后命令的耗时和结果，失败时还有回退执行原命令的耗时和结果"""
+        self.store.execute(
+            "INSERT INTO fast_path (session_id, command, translated, started_at, fast_duration, fast_success, fallback_duration, fallback_success) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (self.session_id, self._mask(command), self._mask(translated), started_at, fast_duration, 1 if fast_success else 0,
+             fallback_duration, None if fallback_success is None else (1 if fallback_success else 0)),
+        )
+
+    def end_session(self, outcome: str):
+        """outcome: success / failed / aborted / incomplete"""
+        self.store.execute("UPDATE sessions SET ended_at = ?, outcome = ? WHERE id = ?", (time.time(), outcome, self.session_id))
+
+
+# --- 报表 ---
+
+def _median(values):
+    return statistics.median(values) if values else 0
+
+
+def _print_table(title, columns, rows):
+    table = Table(title=title, style="cyan")
+    for column in columns:
+        table.add_column(column)
+    for row in rows:
+        table.add_row(*[str(value) for value in row])
+    console.print(table)
+
+
+def report_summary(store: SessionStore, since: float, repo: str = None):
+    """会话总数、成功率，以及成功安装的大模型轮次和耗时中位数"""
+    sql = "SELECT outcome, llm_turns, commands, started_at, ended_at FROM sessions WHERE started_at >= ?"
+    params = [since]
+    if repo:
+        sql += " AND (repo = ? OR owner || '/' || repo = ?)"
+        params += [repo, repo]
+    rows = store.query(sql, params)
+    successes = [row for row in rows if row["outcome"] == "success"]
+    _print_table("会话概况", ["指标", "值"], [
+        ("会话数", len(rows)),
+        ("成功数", len(successes)),
+        ("成功率", f"{len(successes) / len(rows):.0%}" if rows else "-"),
+        ("成功安装的大模型轮次中位数", _median([row["llm_turns"] for row in successes])),
+        ("成功安装的命令数中位数", _median([row["commands"] for row in successes])),
+        ("成功安装的耗时中位数(s)", f"{_median([row['ended_at'] - row['started_at'] for row in successes if row['ended_at']]):.1f}"),
+    ])
+
+
+def report_slow_commands(store: SessionStore, since: float, repo: str = None, limit: int = 20):
+    """按仓库统计最慢的命令"""
+    sql = (
+        "SELECT s.owner || '/' || s.repo AS repo, c.command, COUNT(*) AS runs, AVG(c.duration) AS avg_duration, MAX(c.duration) AS max_duration "
+        "FROM commands c JOIN sessions s ON s.id = c.session_id WHERE c.started_at >= ?"
+    )
+    params = [since]
+    if repo:
+        sql += " AND (s.repo = ? OR s.owner || '/' || s.repo = ?)"
+        params += [repo, repo]
+    sql += " GROUP BY repo, c.command ORDER BY avg_duration DESC LIMIT ?"
+    rows = store.query(sql, params + [limit])
+    _print_table("最慢的命令", ["仓库", "命令", "次数", "平均(s)", "最长(s)"], [
+        (row["repo"], row["command"][:80], row["runs"], f"{row['avg_duration']:.1f}", f"{row['max_duration']:.1f}") for row in rows
+    ])
+
+
+def report_errors(store: SessionStore, since: float, repo: str = None, limit: int = 20):
+    """最常见的错误签名"""
+    sql = (
+        "SELECT c.error_signature, COUNT(*) AS failures, COUNT(DISTINCT c.session_id) AS sessions, MIN(c.command) AS example "
+        "FROM commands c JOIN sessions s ON s.id = c.session_id WHERE c.error_signature IS NOT NULL AND c.started_at >= ?"
+    )
+    params = [since]
+    if repo:
+        sql += " AND (s.repo = ? OR s.owner || '/' || s.repo = ?)"
+        params += [repo, repo]
+    sql += " GROUP BY c.error_signature ORDER BY failures DESC LIMIT ?"
+    rows = store.query(sql, params + [limit])
+    _print_table("常见错误签名", ["签名", "失败次数", "会话数", "示例命令"], [
+        (row["error_signature"], row["failures"], row["sessions"], row["example"][:80]) for row in rows
+    ])
+
+
+def report_time(store: SessionStore, since: float, repo: str = None):
+    """会话时间分布：大模型等待、命令执行和其余（主要是人工确认）"""
+    where = "WHERE s.started_at >= ? AND s.ended_at IS NOT NULL"
+    params = [since]
+    if repo:
+        where += " AND (s.repo = ? OR s.owner || '/' || s.repo = ?)"
+        params += [repo, repo]
+    rows = store.query(
+        "SELECT s.owner || '/' || s.repo AS repo, COUNT(*) AS sessions, SUM(s.ended_at - s.started_at) AS total, "
+        "SUM((SELECT COALESCE(SUM(duration), 0) FROM llm_turns t WHERE t.session_id = s.id)) AS llm, "
+        "SUM((SELECT COALESCE(SUM(duration), 0) FROM commands c WHERE c.session_id = s.id)) AS cmd "
+        f"FROM sessions s {where} GROUP BY repo ORDER BY total DESC",
+        params,
+    )
+    result = []
+    for row in rows:
+        total = row["total"] or 0
+        other = max(total - row["llm"] - row["cmd"], 0)
+        share = lambda value: f"{value:.0f}s ({value / total:.0%})" if total else "-"
+        result.append((row["repo"], row["sessions"], f"{total:.0f}s", share(row["llm"]), share(row["cmd"]), share(other)))
+    _print_table("安装时间分布", ["仓库", "会话数", "总耗时", "大模型", "命令执行", "其他(人工等)"], result)
+
+
+def report_fast_path(store: SessionStore, since: float, repo: str = None):
+    """
+    uv 快速路径的效果：按仓库统计翻译后命令的成功率和耗时，
+    与同一仓库中原命令正常执行（未启用快速路径或回退执行）成功时的平均耗时对比
+    """
+    where = "WHERE f.started_at >= ?"
+    params = [since]
+    if repo:
+        where += " AND (s.repo = ? OR s.owner || '/' || s.repo = ?)"
+        params += [repo, repo]
+    rows = store.query(
+        "SELECT s.owner || '/' || s.repo AS repo, COUNT(*) AS runs, SUM(f.fast_success) AS fast_successes, "
+        "AVG(CASE WHEN f.fast_success = 1 THEN f.fast_duration END) AS fast_avg, "
+        "AVG(CASE WHEN f.fast_success = 1 THEN (SELECT AVG(c.duration) FROM commands c JOIN sessions cs ON cs.id = c.session_id "
+        "WHERE c.command = f.command AND c.success = 1 AND cs.owner = s.owner AND cs.repo = s.repo) END) AS original_avg, "
+        "SUM(COALESCE(f.fallback_duration, 0) + CASE WHEN f.fast_success = 0 THEN f.fast_duration ELSE 0 END) AS fallback_cost "
+        f"FROM fast_path f JOIN sessions s ON s.id = f.session_id {where} GROUP BY repo ORDER BY runs DESC",
+        params,
+    )
+    result = []
+    for row in rows:
+        fast_avg, original_avg = row["fast_avg"], row["original_avg"]
+        result.append((
+            row["repo"], row["runs"], f"{row['fast_successes'] / row['runs']:.0%}",
+            f"{fast_avg:.1f}" if fast_avg is not None else "-",
+            f"{original_avg:.1f}" if original_avg is not None else "-",
+            f"{original_avg / fast_avg:.1f}x" if fast_avg and original_avg else "-",
+            f"{row['fallback_cost']:.1f}",
+        ))
+    _print_table("uv 快速路径", ["仓库", "翻译次数", "uv 成功率", "uv 平均(s)", "原命令平均(s)", "加速", "失败回退耗时(s)"], result)
+
+
+REPORTS = {
+    "summary": report_summary,
+    "slow-commands": report_slow_commands,
+    "errors": report_errors,
+    "time": report_time,
+    "fast-path": report_fast_path,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="查询安装会话统计")
+    subparsers = parser.add_subparsers(dest="action", required=True)
+    report_parser = subparsers.add_parser("report", help="输出统计报表")
+    report_parser.add_argument("name", choices=sorted(REPORTS), help="报表名称")
+    report_parser.add_argument("--days", type=float, default=7, help="统计最近多少天（默认 7）")
+    report_parser.add_argument("--repo", help="只统计某个仓库（repo 或 owner/repo）")
+    report_parser.add_argument("--db", help="数据库路径")
+    args = parser.parse_args()
+
+    store = SessionStore(args.db)
+    REPORTS[args.name](store, time.time() - args.days * 86400, args.repo)
+
+
+if __name__ == "__main__":
+    main()
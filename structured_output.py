@@ -0,0 +1,194 @@
+import json
+import re
+import shlex
+from typing import List, Dict, Optional, Tuple
+
+from readme_processor import FULL_README_MARKER
+
+DONE_MARKER = "DONE_SETUP_COMMANDS"
+
+# 大模型结构化输出的格式（OpenAPI 子集，Gemini 的 response_schema 可以直接使用）；
+# env 用 name/value 数组表示，因为 Gemini 的 schema 不支持任意键的对象
+RESPONSE_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "steps": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "command": {"type": "string"},
+                    "cwd": {"type": "string"},
+                    "env": {
+                        "type": "array",
+                        "items": {
+                            "type": "object",
+                            "properties": {"name": {"type": "string"}, "value": {"type": "string"}},
+                            "required": ["name", "value"],
+                        },
+                    },
+                    "depends_on": {"type": "array", "items": {"type": "integer"}},
+                },
+                "required": ["command"],
+            },
+        },
+        "done": {"type": "boolean"},
+        "need_full_readme": {"type": "boolean"},
+    },
+    "required": ["steps", "done"],
+}
+
+# 替换系统提示词中按行返回命令的规则
+STRUCTURED_RULES = [
+    '只返回一个 JSON 对象，不要有其他文字，格式：{"steps": [{"command": "单行 shell 命令", "cwd": "执行目录（可选）", '
+    '"env": [{"name": "变量名", "value": "值"}]（可选）, "depends_on": [依赖的前面步骤的下标，从 0 开始]（可选）}], '
+    '"done": 是否所有步骤都已完成, "need_full_readme": 是否需要完整README}',
+    "steps 按执行顺序排列；设置了 cwd 或 env 时会自动在命令前加上 cd 和环境变量设置",
+    "如果需要查看完整的README才能继续，steps 留空并把 need_full_readme 设为 true",
+    "如果所有步骤都已完成，把 done 设为 true（本批次的 steps 仍会先执行）",
+]
+
+ENV_NAME = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
+
+# 一次返回多个候选修复方案时，每个方案以单独一行（结构化输出时为单独一个步骤）"# 方案 N" 开头
+CANDIDATE_MARKER = re.compile(r"^#\s*(?:方案|candidate)\s*\d+", re.I)
+
+
+def _strip_code_fence(text: str) -> str:
+    text = text.strip()
+    match = re.match(r"^```[a-zA-Z]*\s*\n?(.*?)\n?```$", text, re.S)
+    return match.group(1).strip() if match else text
+
+
+def validate_plan(data) -> Optional[str]:
+    """校验结构化响应，返回第一个错误描述，合法时返回 None"""
+    if not isinstance(data, dict):
+        return "顶层必须是 JSON 对象"
+    steps = data.get("steps")
+    if not isinstance(steps, list):
+        return "缺少 steps 数组"
+    if not isinstance(data.get("done"), bool):
+        return "缺少布尔值 done"
+    if "need_full_readme" in data and not isinstance(data["need_full_readme"], bool):
+        return "need_full_readme 必须是布尔值"
+    for index, step in enumerate(steps):
+        if not isinstance(step, dict):
+            return f"steps[{index}] 必须是对象"
+        command = step.get("command")
+        if not isinstance(command, str) or not command.strip():
+            return f"steps[{index}].command 必须是非空字符串"
+        if "\n" in command.strip():
+            return f"steps[{index}].command 必须是单行命令"
+        if step.get("cwd") is not None and not isinstance(step["cwd"], str):
+            return f"steps[{index}].cwd 必须是字符串"
+        env = step.get("env") or []
+        if isinstance(env, dict):
+            env = [{"name": k, "value": v} for k, v in env.items()]
+        if not isinstance(env, list):
+            return f"steps[{index}].env 必须是数组"
+        for item in env:
+            if not isinstance(item, dict) or not ENV_NAME.match(str(item.get("name", ""))) or not isinstance(item.get("value"), (str, int, float)):
+                return f"steps[{index}].env 中的变量必须有合法的 name 和字符串 value"
+        depends_on = step.get("depends_on") or []
+        if not isinstance(depends_on, list) or not all(isinstance(d, int) and 0 <= d < len(steps) and d != index for d in depends_on):
+            return f"steps[{index}].depends_on 必须是其他步骤的下标（0 到 {len(steps) - 1}）"
+    if _dependency_order(steps) is None:
+        return "depends_on 存在循环依赖"
+    return None
+
+
+def _dependency_order(steps: List[Dict]) -> Optional[List[int]]:
+    """按 depends_on 稳定地拓扑排序：没有依赖冲突时保持原顺序；存在循环时返回 None"""
+    order, placed = [], set()
+    while len(order) < len(steps):
+        for index, step in enumerate(steps):
+            if index not in placed and all(d in placed for d in step.get("depends_on") or []):
+                order.append(index)
+                placed.add(index)
+                break
+        else:
+            return None
+    return order
+
+
+def _render_step(step: Dict, os_name: str) -> str:
+    """把一个步骤转换为可执行的单行命令：cwd 和 env 变成 && 连接的前置命令"""
+    windows = os_name == "Windows"
+    parts = []
+    if step.get("cwd"):
+        parts.append(f'cd /d "{step["cwd"]}"' if windows else f"cd {shlex.quote(step['cwd'])}")
+    env = step.get("env") or []
+    if isinstance(env, dict):
+        env = [{"name": k, "value": v} for k, v in env.items()]
+    for item in env:
+        value = str(item["value"])
+        parts.append(f"set {item['name']}={value}" if windows else f"export {item['name']}={shlex.quote(value)}")
+    parts.append(step["command"].strip())
+    return " && ".join(parts)
+
+
+def parse_structured_response(response_text: str, os_name: str) -> Tuple[Optional[List[str]], Optional[str]]:
+    """
+    解析结构化响应为命令列表（与文本解析结果的格式相同，含 DONE_SETUP_COMMANDS / NEED_FULL_README 标记）。
+    返回 (命令列表, None)，无法解析或校验失败时返回 (None, 错误描述)。
+    """
+    try:
+        data = json.loads(_strip_code_fence(response_text))
+    except ValueError as e:
+        return None, f"不是合法的 JSON: {e}"
+    error = validate_plan(data)
+    if error:
+        return None, error
+    if data.get("need_full_readme"):
+        return [FULL_README_MARKER], None
+    steps = data["steps"]
+    commands = [_render_step(steps[index], os_name) for index in _dependency_order(steps)]
+    if data["done"]:
+        commands.append(DONE_MARKER)
+    return commands, None
+
+
+def salvage_commands(response_text: str) -> Optional[List[str]]:
+    """
+    修正后仍不合格时的兜底：响应看起来是 JSON 时只取出其中命令数组的字符串（steps[].command、commands[]），
+    无法解析时返回空列表，不按行解析（否则 {、"commands": [ 这样的行会被当成命令）；不是 JSON 时返回 None。
+    """
+    text = _strip_code_fence(response_text)
+    if not text.startswith(("{", "[")):
+        return None
+    try:
+        data = json.loads(text)
+    except ValueError:
+        return []
+    if isinstance(data, dict):
+        items = data.get("steps") if isinstance(data.get("steps"), list) else data.get("commands")
+    else:
+        items = data
+    commands = []
+    for item in items if isinstance(items, list) else []:
+        command = item.get("command") if isinstance(item, dict) else item
+        if isinstance(command, str) and command.strip() and "\n" not in command.strip():
+            commands.append(command.strip())
+    if isinstance(data, dict) and data.get("done") is True:
+        commands.append(DONE_MARKER)
+    return commands
+
+
+def commands_to_response(commands: List[str]) -> str:
+    """把命令列表表示为结构化响应，用于根据缓存的计划构造消息历史"""
+    steps = [{"command": command} for command in commands if command.upper() != DONE_MARKER]
+    return json.dumps({"steps": steps, "done": False}, ensure_ascii=False)
+
+
+def split_candidates(commands: List[str]) -> List[List[str]]:
+    """按 "# 方案 N" 标记把命令列表拆成多个候选方案；没有标记时整个列表作为一个方案"""
+    candidates: List[List[str]] = []
+    for command in commands:
+        if CANDIDATE_MARKER.match(command.strip()):
+            candidates.append([])
+        elif candidates:
+            candidates[-1].append(command)
+        else:
+            candidates.append([command])
+    return [candidate for candidate in candidates if candidate]
+
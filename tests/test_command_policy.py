@@ -0,0 +1,63 @@
+import pytest
+
+from command_policy import ALLOW, ASK, DENY, DEFAULT_POLICY, CommandPolicy
+
+
+@pytest.fixture
+def policy(tmp_path, monkeypatch):
+    install_directory = tmp_path / "inst"
+    install_directory.mkdir()
+    monkeypatch.chdir(install_directory)
+    return CommandPolicy(DEFAULT_POLICY, str(install_directory))
+
+
+@pytest.mark.parametrize("command", [
+    # 变量和命令替换在执行前无法确定路径
+    'rm -rf "$HOME"',
+    "rm -rf ${HOME}",
+    "mv build $HOME/.bashrc",
+    "cp -r build `echo ~`",
+    "echo $(id)",
+    # env 可以运行任意命令
+    "env sh -c 'rm -rf \"$HOME\"'",
+    # 通过包管理器运行任意命令
+    "uv run bash -c 'rm -rf ~/.ssh'",
+    "conda run -n x python -c 'import shutil'",
+    "npm exec some-package",
+    "npx some-package",
+    "pipx run some-package",
+    # 在当前 shell 中执行脚本
+    "source evil.sh",
+    ". evil.sh",
+    # 内联脚本
+    "python -c 'import os'",
+    "python - < script.py",
+])
+def test_not_auto_approved(policy, command):
+    assert policy.evaluate(command)[0] != ALLOW
+
+
+def test_cd_into_install_directory_does_not_hide_variables(policy):
+    assert policy.evaluate(f'cd {policy.install_directory} && rm -rf "$HOME"')[0] == ASK
+
+
+def test_relative_operands_follow_cd(policy, tmp_path):
+    assert policy.evaluate("rm -rf build")[0] == ALLOW
+    assert policy.evaluate(f"cd {tmp_path} && rm -rf build")[0] != ALLOW
+
+
+@pytest.mark.parametrize("command", [
+    "pip install -e .",
+    "conda install -n x -y numpy",
+    "uv pip install requests",
+    "npm install",
+    "git clone https://github.com/o/r.git",
+    "ls",
+])
+def test_common_install_commands_still_allowed(policy, command):
+    assert policy.evaluate(command)[0] == ALLOW
+
+
+def test_deleting_home_is_denied(policy):
+    assert policy.evaluate("rm -rf $HOME")[0] == DENY
+    assert policy.evaluate("rm -rf ~")[0] == DENY
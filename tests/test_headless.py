@@ -0,0 +1,31 @@
+import json
+import os
+import subprocess
+import sys
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 在无界面模式下先执行一条读取标准输入的命令，再回答一次询问
+DRIVER = """
+from command_executor import run_command
+from headless import JsonLinesInteraction
+from interaction import use_interaction
+
+with use_interaction(JsonLinesInteraction()) as interaction:
+    stdout, _, returncode, _ = run_command("head -n 1")
+    interaction.emit("result", command_stdout=stdout, returncode=returncode, answer=interaction.ask("confirm_command", "?"))
+"""
+
+
+def test_command_does_not_consume_decision_lines(tmp_path):
+    env = dict(os.environ, INSTALLER_DATA_DIR=str(tmp_path), PYTHONPATH=REPO_ROOT)
+    result = subprocess.run(
+        [sys.executable, "-c", DRIVER], input=json.dumps({"value": "y"}) + "\n",
+        capture_output=True, text=True, cwd=tmp_path, env=env, timeout=60,
+    )
+    assert result.returncode == 0, result.stderr
+    events = [json.loads(line) for line in result.stdout.splitlines() if line.startswith("{")]
+    outcome = [event for event in events if event["event"] == "result"][-1]
+    assert outcome["command_stdout"] == ""
+    assert outcome["returncode"] == 0
+    assert outcome["answer"] == "y"
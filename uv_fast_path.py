@@ -0,0 +1,123 @@
+import os
+import re
+import shlex
+import shutil
+from typing import List, Optional
+
+from interaction import ConsoleProxy
+
+console = ConsoleProxy()
+
+# pip install / pip3 install / /path/venv/bin/pip install / python -m pip install
+PIP_INSTALL = re.compile(r"^(?:(?P<pip_dir>\S*?)(?P<pip>pip3?)|(?P<python>\S*python[\d.]*(?:\.exe)?)\s+-m\s+pip)\s+install(?=\s|$)(?P<rest>.*)$", re.S)
+# python -m venv DIR / virtualenv DIR
+VENV_CREATE = re.compile(r"^(?:(?P<python>\S*python[\d.]*(?:\.exe)?)\s+-m\s+venv|(?P<virtualenv>virtualenv))(?=\s|$)(?P<rest>.*)$", re.S)
+# 带有这些 shell 语法的段不翻译，保持原样
+SHELL_SYNTAX = re.compile(r"[|;<>`]|\$\(")
+# uv pip install 不支持的 pip 参数
+UNSUPPORTED_PIP_OPTIONS = {
+    "--user", "--global-option", "--install-option", "--build-option", "--use-feature", "--progress-bar",
+    "--trusted-host", "--src", "--root", "--prefix", "--log", "--cache-dir", "--isolated", "--no-clean",
+}
+# 没有副作用、重复执行也没有影响的段（回退时整条原命令会重新执行一次）
+SIDE_EFFECT_FREE = re.compile(r"^(?:cd|pushd|popd|source|\.|export|set|unset|true|echo|pwd)(?:\s|$)|^(?:conda|mamba|micromamba)\s+activate(?:\s|$)")
+# uv venv 支持的 venv 参数（--without-pip 表示不安装 pip，对应去掉 --seed）
+VENV_OPTIONS = {"--clear", "--system-site-packages", "--without-pip", "--prompt"}
+
+
+def split_and(command: str) -> List[str]:
+    """按引号之外的 && 拆分命令，各段保留原文"""
+    segments, start, quote, index = [], 0, None, 0
+    while index < len(command):
+        char = command[index]
+        if quote:
+            if char == "\\" and quote == '"':
+                index += 1
+            elif char == quote:
+                quote = None
+        elif char in "'\"":
+            quote = char
+        elif command.startswith("&&", index):
+            segments.append(command[start:index])
+            start = index + 2
+            index += 1
+        index += 1
+    segments.append(command[start:])
+    return segments
+
+
+def _options(rest: str) -> Optional[List[str]]:
+    try:
+        return [token for token in shlex.split(rest) if token.startswith("-")]
+    except ValueError:
+        return None
+
+
+def _translate_pip_install(match) -> Optional[str]:
+    pip_dir = match.group("pip_dir") or ""
+    if pip_dir and not pip_dir.endswith(("/", "\\")):
+        return None
+    options = _options(match.group("rest"))
+    if options is None or any(option.split("=", 1)[0] in UNSUPPORTED_PIP_OPTIONS for option in options):
+        return None
+    if match.group("python"):
+        python = match.group("python")
+    else:
+        # 与 pip 同目录、同版本的解释器，环境由 PATH（conda activate / source activate 之后）决定
+        python = pip_dir + ("python3" if match.group("pip") == "pip3" else "python")
+    return f"uv pip install --python {python}{match.group('rest')}"
+
+
+def _translate_venv(match) -> Optional[str]:
+    options = _options(match.group("rest"))
+    if options is None or any(option.split("=", 1)[0] not in VENV_OPTIONS for option in options):
+        return None
+    rest = re.sub(r"\s--without-pip\b", "", match.group("rest"))
+    seed = "" if "--without-pip" in options else " --seed"
+    python = f" --python {match.group('python')}" if match.group("python") else ""
+    return f"uv venv{seed}{python}{rest}"
+
+
+def translate_segment(segment: str) -> Optional[str]:
+    """把单个段翻译为 uv 命令，不能翻译时返回 None"""
+    stripped = segment.strip()
+    if SHELL_SYNTAX.search(stripped):
+        return None
+    match = PIP_INSTALL.match(stripped)
+    if match:
+        return _translate_pip_install(match)
+    match = VENV_CREATE.match(stripped)
+    if match:
+        return _translate_venv(match)
+    return None
+
+
+def translate_command(command: str) -> Optional[str]:
+    """
+    把命令中的 venv 创建和 pip install 段翻译为 uv（uv venv --seed、uv pip install --python），其余段保持原样；
+    没有可翻译的段时返回 None。
+    conda create 不翻译：后面的 conda activate 需要真正的 conda 环境，但 conda 环境中的 pip install 会翻译。
+    uv 失败时整条原命令会重新执行，因此其余段中有 git clone、mkdir 等有副作用的命令时不翻译（第二次执行会失败或重复操作）。
+    """
+    segments = split_and(command)
+    translated = [translate_segment(segment) for segment in segments]
+    if not any(translated):
+        return None
+    if any(not new and not (SIDE_EFFECT_FREE.match(old.strip()) and not SHELL_SYNTAX.search(old)) for old, new in zip(segments, translated)):
+        return None
+    return " && ".join(new if new else old.strip() for old, new in zip(segments, translated))
+
+
+_uv_checked = None
+
+
+def fast_path_enabled() -> bool:
+    """UV_FAST_PATH=1 且 uv 在 PATH 中时启用"""
+    global _uv_checked
+    if os.getenv("UV_FAST_PATH", "0") != "1":
+        return False
+    if _uv_checked is None:
+        _uv_checked = bool(shutil.which("uv"))
+        if not _uv_checked:
+            console.print("[WARN] 已设置 UV_FAST_PATH=1，但没有找到 uv，请运行: pip install uv")
+    return _uv_checked
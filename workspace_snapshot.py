@@ -0,0 +1,285 @@
+import os
+import re
+import shutil
+import sys
+import threading
+import time
+import uuid
+from typing import List, Dict, Optional, Tuple
+
+from fix_trials import conda_env_names, SHARED_ENVS
+from preflight import PreflightChecker
+from process_watchdog import classify_command
+from interaction import ConsoleProxy, emit
+
+console = ConsoleProxy()
+
+# 执行前需要快照的命令类别（process_watchdog.classify_command）：安装和构建失败时最容易留下不完整的状态
+RISKY_CLASSES = ("install", "build")
+# 命令中以绝对路径引用的 venv：source /path/venv/bin/activate 或 /path/venv/bin/pip；
+# 只有含 pyvenv.cfg 的目录才是 venv（/usr/bin/python3、/opt/conda/bin/pip 不是）
+VENV_PATTERN = re.compile(r"""(?:^|[\s;&|'"])(/[^\s;&|'"]+?)[/\\](?:bin|Scripts)[/\\](?:activate|python[\d.]*|pip[\d.]*)\b""")
+# 快照目录名，放在被快照目录的上一级（与被快照的目录在同一个文件系统上才能使用硬链接）
+SNAPSHOT_DIR_NAME = ".installer-snapshots"
+
+
+def _scan(root: str, max_files: int) -> Optional[Dict[str, Tuple]]:
+    """
+    记录目录中每个条目的状态：文件为 ("f", 大小, 修改时间, inode)，符号链接为 ("l", 目标)，目录为 ("d",)。
+    条目数超过 max_files 时返回 None。
+    """
+    manifest: Dict[str, Tuple] = {}
+    stack = [""]
+    while stack:
+        relative = stack.pop()
+        try:
+            entries = list(os.scandir(os.path.join(root, relative)))
+        except OSError:
+            continue
+        for entry in entries:
+            path = os.path.join(relative, entry.name)
+            try:
+                if entry.is_symlink():
+                    manifest[path] = ("l", os.readlink(entry.path))
+                elif entry.is_dir():
+                    manifest[path] = ("d",)
+                    stack.append(path)
+                else:
+                    info = entry.stat(follow_symlinks=False)
+                    manifest[path] = ("f", info.st_size, info.st_mtime_ns, info.st_ino)
+            except OSError:
+                continue
+            if len(manifest) > max_files:
+                return None
+    return manifest
+
+
+def _remove(path: str):
+    if os.path.isdir(path) and not os.path.islink(path):
+        shutil.rmtree(path, ignore_errors=True)
+    else:
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+
+
+class DirectorySnapshot:
+    """
+    一个目录的快照：文件清单 + 所有文件的硬链接副本（不复制数据，十万个文件约一两秒）。
+    命令大多通过新建文件、删除、重命名修改目录（pip、conda、git 都是如此），原来的内容保留在硬链接中；
+    原地修改的文件会同时改变硬链接副本，恢复时按清单识别出来并保留当前内容。
+    不能建立硬链接时（跨文件系统等）改为复制文件。
+    """
+
+    def __init__(self, path: str, label: str, store: str):
+        self.path = path
+        self.label = label
+        self.store = store
+        self.manifest: Dict[str, Tuple] = {}
+        # 无法链接也无法复制的文件，恢复时保留当前内容
+        self.unsaved = set()
+
+    def take(self, max_files: int) -> bool:
+        manifest = _scan(self.path, max_files)
+        if manifest is None:
+            return False
+        os.makedirs(self.store)
+        for relative, entry in sorted(manifest.items()):
+            target = os.path.join(self.store, relative)
+            if entry[0] == "d":
+                os.makedirs(target, exist_ok=True)
+            elif entry[0] == "f":
+                source = os.path.join(self.path, relative)
+                try:
+                    os.link(source, target)
+                except OSError:
+                    try:
+                        shutil.copy2(source, target)
+                    except OSError:
+                        self.unsaved.add(relative)
+        self.manifest = manifest
+        return True
+
+    def _snapshot_intact(self, relative: str, entry: Tuple) -> bool:
+        """快照中的文件是否仍是执行前的内容（硬链接副本可能被原地修改）"""
+        try:
+            info = os.stat(os.path.join(self.store, relative))
+        except OSError:
+            return False
+        return (info.st_size, info.st_mtime_ns) == entry[1:3]
+
+    def restore(self) -> Dict[str, int]:
+        """把目录恢复到快照时的状态，返回 {removed, restored, kept} 计数"""
+        counts = {"removed": 0, "restored": 0, "kept": 0}
+        current = _scan(self.path, float("inf")) or {}
+        # 先删除新增的条目（目录从深到浅）
+        for relative in sorted(set(current) - set(self.manifest), key=len, reverse=True):
+            _remove(os.path.join(self.path, relative))
+            counts["removed"] += 1
+        for relative, entry in sorted(self.manifest.items()):
+            path = os.path.join(self.path, relative)
+            now = current.get(relative)
+            if now == entry:
+                continue
+            if entry[0] == "d":
+                if now and now[0] != "d":
+                    _remove(path)
+                os.makedirs(path, exist_ok=True)
+                continue
+            if entry[0] == "l":
+                if now:
+                    _remove(path)
+                os.symlink(entry[1], path)
+                counts["restored"] += 1
+                continue
+            if now and now[0] == "f" and now[1:3] == entry[1:3]:
+                # 内容没变，只是 inode 不同（被重写成相同内容），不需要恢复
+                continue
+            if relative in self.unsaved or not self._snapshot_intact(relative, entry):
+                counts["kept"] += 1
+                continue
+            if now:
+                _remove(path)
+            try:
+                os.link(os.path.join(self.store, relative), path)
+            except OSError:
+                shutil.copy2(os.path.join(self.store, relative), path)
+            counts["restored"] += 1
+        return counts
+
+
+def _remove_stores(stores: List[str]):
+    for store in stores:
+        shutil.rmtree(store, ignore_errors=True)
+        try:
+            # 没有其他快照时顺便删掉 .installer-snapshots 目录
+            os.rmdir(os.path.dirname(store))
+        except OSError:
+            pass
+
+
+class StepSnapshot:
+    """一条命令执行前对项目目录和相关环境目录的快照"""
+
+    def __init__(self, command: str, directories: List[DirectorySnapshot], duration: float):
+        self.command = command
+        self.directories = directories
+        self.duration = duration
+
+    def _restore_directories(self) -> Dict[str, int]:
+        totals = {"removed": 0, "restored": 0, "kept": 0}
+        for directory in self.directories:
+            try:
+                for key, value in directory.restore().items():
+                    totals[key] += value
+            except OSError as e:
+                console.print(f"[WARN] 恢复 {directory.label} 时出错: {e}")
+        return totals
+
+    def rewind(self):
+        """恢复所有目录但保留快照，用于同一步骤再执行一次之前（如 uv 快速路径失败后回退执行原命令）"""
+        start = time.monotonic()
+        totals = self._restore_directories()
+        console.print(f"[dim][INFO] 已恢复到执行前的状态（删除 {totals['removed']} 个、恢复 {totals['restored']} 个条目，用时 {time.monotonic() - start:.1f}s）。[/dim]")
+
+    def restore(self) -> str:
+        """恢复所有目录，返回附加给大模型的说明"""
+        start = time.monotonic()
+        totals = self._restore_directories()
+        duration = time.monotonic() - start
+        labels = "、".join(directory.label for directory in self.directories)
+        console.print(f"[INFO] 已将 {labels} 恢复到命令执行前的状态（删除 {totals['removed']} 个、恢复 {totals['restored']} 个条目，用时 {duration:.1f}s）")
+        if totals["kept"]:
+            console.print(f"[WARN] {totals['kept']} 个文件被原地修改，无法恢复，保留当前内容。")
+        emit("workspace_restored", command=self.command, directories=[d.path for d in self.directories], duration=round(duration, 3), **totals)
+        self.discard()
+        return f"[回滚] 命令失败后，{labels} 已恢复到这条命令执行前的状态，之前成功的步骤仍然有效，修复时不需要重新执行。"
+
+    def discard(self):
+        """删除快照（后台执行）"""
+        threading.Thread(target=_remove_stores, args=([directory.store for directory in self.directories],)).start()
+
+
+def protected_directories() -> List[str]:
+    """
+    不做快照的系统目录：Python 安装目录、/usr、/usr/local、用户主目录和 conda 的根目录（base 环境）。
+    这些目录中还有其他进程（守护进程中的其他任务等）创建的文件，恢复时会被删除。
+    """
+    directories = ["/", "/usr", "/usr/local", sys.base_prefix, os.path.expanduser("~")]
+    conda = os.getenv("CONDA_EXE") or shutil.which("conda") or shutil.which("mamba")
+    if conda:
+        directories.append(os.path.dirname(os.path.dirname(os.path.realpath(conda))))
+    return [os.path.realpath(directory) for directory in directories]
+
+
+class WorkspaceSnapshots:
+    """
+    在安装、构建等有风险的命令执行前，为项目目录（安装目录/项目名）以及命令激活的 conda 环境或 venv 建立快照，
+    命令失败时恢复，使修复从确定的状态开始，不需要重新克隆或重建环境。
+    base 环境、系统目录（protected_directories）和文件数超过 SNAPSHOT_MAX_FILES 的目录不做快照。
+    """
+
+    def __init__(self, install_directory: str, repo_name: str, preflight=None):
+        self.install_directory = os.path.abspath(install_directory)
+        self.repo_name = repo_name
+        self.preflight = preflight or PreflightChecker()
+        self.max_files = int(os.getenv("SNAPSHOT_MAX_FILES", "200000"))
+        self.protected = protected_directories()
+
+    def _targets(self, command: str) -> List[Tuple[str, str]]:
+        """返回需要快照的 (目录, 显示名)，去掉重复和嵌套的目录"""
+        targets = [(os.path.join(self.install_directory, self.repo_name), f"项目目录 {self.repo_name}")]
+        for name in conda_env_names(command):
+            if name in SHARED_ENVS:
+                continue
+            path = self.preflight._find_conda_env(name, self.install_directory)
+            if path:
+                targets.append((path, f"conda 环境 {name}"))
+        for match in VENV_PATTERN.finditer(command):
+            if os.path.isfile(os.path.join(match.group(1), "pyvenv.cfg")):
+                targets.append((match.group(1), f"虚拟环境 {match.group(1)}"))
+        result = []
+        for path, label in targets:
+            path = os.path.realpath(path)
+            if not os.path.isdir(path):
+                continue
+            # 系统目录本身或包含系统目录的目录（如 /）
+            if any(path == protected or protected.startswith(path.rstrip(os.sep) + os.sep) for protected in self.protected):
+                continue
+            if any(path == other or path.startswith(other + os.sep) for other, _ in result):
+                continue
+            result = [(other, other_label) for other, other_label in result if not other.startswith(path + os.sep)]
+            result.append((path, label))
+        return result
+
+    def take(self, command: str) -> Optional[StepSnapshot]:
+        """有风险的命令执行前建立快照；不需要快照或无法快照时返回 None"""
+        if classify_command(command) not in RISKY_CLASSES:
+            return None
+        start = time.monotonic()
+        tag = uuid.uuid4().hex[:8]
+        directories = []
+        for path, label in self._targets(command):
+            directory = DirectorySnapshot(path, label, os.path.join(os.path.dirname(path), SNAPSHOT_DIR_NAME, f"{tag}-{os.path.basename(path)}"))
+            try:
+                if directory.take(self.max_files):
+                    directories.append(directory)
+                else:
+                    console.print(f"[dim][INFO] {label} 的文件数超过 {self.max_files}，不建立快照。[/dim]")
+            except OSError as e:
+                shutil.rmtree(directory.store, ignore_errors=True)
+                console.print(f"[WARN] 为 {label} 建立快照失败: {e}")
+        if not directories:
+            return None
+        duration = time.monotonic() - start
+        files = sum(len(directory.manifest) for directory in directories)
+        console.print(f"[dim][INFO] 已为 {'、'.join(d.label for d in directories)} 建立快照（{files} 个条目，用时 {duration:.1f}s），命令失败时自动恢复。[/dim]")
+        return StepSnapshot(command, directories, duration)
+
+
+def create_workspace_snapshots(install_directory: str, repo_name: str, preflight=None) -> Optional[WorkspaceSnapshots]:
+    """SNAPSHOTS=0 时不建立快照"""
+    if os.getenv("SNAPSHOTS", "1") == "0":
+        return None
+    return WorkspaceSnapshots(install_directory, repo_name, preflight)